@@ -0,0 +1,176 @@
+"""Hardware-free stand-in for the UnicornPy module.
+
+Exposes the same names the study scripts use, so they can run without a headset by setting
+the UNICORN_SIMULATOR environment variable. Behaviour is controlled with `configure()` or the
+UNICORN_SIM_* environment variables read at import time:
+
+    UNICORN_SIM_DEVICES          number of simulated headsets (default 1)
+    UNICORN_SIM_REALTIME         0 to deliver samples as fast as possible (default 1)
+    UNICORN_SIM_REPLAY           CSV or .semg recording to replay instead of synthetic data
+    UNICORN_SIM_JITTER_MS        maximum random delay added to every GetData call
+    UNICORN_SIM_STALL_PROBABILITY  chance per GetData call of a stall
+    UNICORN_SIM_STALL_MS         duration of a stall
+    UNICORN_SIM_DISCONNECT_AFTER seconds of acquisition before the device disconnects
+    UNICORN_SIM_DRIFT_PPM        sample clock error added per headset index, in parts per million
+"""
+import os
+import random
+import time
+import numpy as np
+
+SamplingRate = 250
+NumberOfAcquiredChannels = 17
+EEGChannelsCount = 8
+
+_CHANNELS = [
+    ('EEG 1', 'uV'), ('EEG 2', 'uV'), ('EEG 3', 'uV'), ('EEG 4', 'uV'),
+    ('EEG 5', 'uV'), ('EEG 6', 'uV'), ('EEG 7', 'uV'), ('EEG 8', 'uV'),
+    ('Accelerometer X', 'g'), ('Accelerometer Y', 'g'), ('Accelerometer Z', 'g'),
+    ('Gyroscope X', 'deg/s'), ('Gyroscope Y', 'deg/s'), ('Gyroscope Z', 'deg/s'),
+    ('Battery Level', '%'), ('Counter', ''), ('Validation Indicator', ''),
+]
+
+settings = {
+    'devices': int(os.environ.get('UNICORN_SIM_DEVICES', 1)),
+    'realtime': os.environ.get('UNICORN_SIM_REALTIME', '1') != '0',
+    'replay': os.environ.get('UNICORN_SIM_REPLAY') or None,
+    'jitter_ms': float(os.environ.get('UNICORN_SIM_JITTER_MS', 0)),
+    'stall_probability': float(os.environ.get('UNICORN_SIM_STALL_PROBABILITY', 0)),
+    'stall_ms': float(os.environ.get('UNICORN_SIM_STALL_MS', 0)),
+    'disconnect_after': float(os.environ['UNICORN_SIM_DISCONNECT_AFTER']) if os.environ.get('UNICORN_SIM_DISCONNECT_AFTER') else None,
+    'drift_ppm': float(os.environ.get('UNICORN_SIM_DRIFT_PPM', 0)),
+    'seed': None,
+}
+
+
+class DeviceException(Exception):
+    pass
+
+
+class Channel:
+    def __init__(self, name, unit):
+        self.Name = name
+        self.Unit = unit
+        self.Range = (-750000.0, 750000.0) if unit == 'uV' else (0.0, 0.0)
+        self.Enabled = True
+
+
+class AmplifierConfiguration:
+    def __init__(self):
+        self.Channels = [Channel(name, unit) for name, unit in _CHANNELS]
+
+
+def configure(**kwargs):
+    # Changes simulator settings for devices opened afterwards.
+    unknown = set(kwargs) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown simulator settings: {', '.join(sorted(unknown))}")
+    settings.update(kwargs)
+
+
+def GetAvailableDevices(onlyPaired):
+    return [f"UN-SIM.{i + 1:04d}" for i in range(settings['devices'])]
+
+
+class Unicorn:
+    def __init__(self, serial):
+        if serial not in GetAvailableDevices(True):
+            raise DeviceException(f"Could not connect to '{serial}'.")
+        self.serial = serial
+        self.settings = dict(settings)
+        # Every headset after the first runs its sample clock a little faster than nominal.
+        index = GetAvailableDevices(True).index(serial)
+        self.sampling_rate = SamplingRate * (1 + index * self.settings['drift_ppm'] * 1e-6)
+        self.rng = np.random.default_rng(self.settings['seed'])
+        self.replay = _load_replay(self.settings['replay']) if self.settings['replay'] else None
+        self.acquiring = False
+        self.sample_index = 0
+        self.started_at = None
+
+    def GetNumberOfAcquiredChannels(self):
+        return NumberOfAcquiredChannels
+
+    def GetConfiguration(self):
+        return AmplifierConfiguration()
+
+    def StartAcquisition(self, testSignalEnabled):
+        if self.acquiring:
+            raise DeviceException("Acquisition already started.")
+        self.test_signal = testSignalEnabled
+        self.acquiring = True
+        self.sample_index = 0
+        self.started_at = time.perf_counter()
+
+    def StopAcquisition(self):
+        self.acquiring = False
+
+    def GetData(self, numberOfScans, destinationBuffer, destinationBufferLength):
+        if not self.acquiring:
+            raise DeviceException("Acquisition not started.")
+        if destinationBufferLength < numberOfScans * NumberOfAcquiredChannels * 4:
+            raise DeviceException("Destination buffer too small.")
+        elapsed = time.perf_counter() - self.started_at
+        disconnect_after = self.settings['disconnect_after']
+        if disconnect_after is not None and elapsed >= disconnect_after:
+            self.acquiring = False
+            raise DeviceException("Device disconnected.")
+
+        self._pace(numberOfScans)
+        data = np.frombuffer(destinationBuffer, dtype=np.float32, count=numberOfScans * NumberOfAcquiredChannels)
+        data = data.reshape(numberOfScans, NumberOfAcquiredChannels)
+        data[:] = self._generate(numberOfScans)
+        self.sample_index += numberOfScans
+
+    def _pace(self, numberOfScans):
+        delay = 0.0
+        if self.settings['jitter_ms']:
+            delay += random.uniform(0, self.settings['jitter_ms']) / 1000.0
+        if self.settings['stall_probability'] and random.random() < self.settings['stall_probability']:
+            delay += self.settings['stall_ms'] / 1000.0
+        if self.settings['realtime']:
+            # Like the real device FIFO, a frame is only ready once its last sample was sampled.
+            ready_at = self.started_at + (self.sample_index + numberOfScans) / self.sampling_rate
+            delay = max(delay, ready_at - time.perf_counter())
+        if delay > 0:
+            time.sleep(delay)
+
+    def _generate(self, count):
+        index = self.sample_index + np.arange(count)
+        if self.replay is not None:
+            data = self.replay[index % len(self.replay)].copy()
+        elif self.test_signal:
+            data = np.zeros((count, NumberOfAcquiredChannels), dtype=np.float32)
+            data[:, :EEGChannelsCount] = 50.0 * np.sign(np.sin(2 * np.pi * index / SamplingRate))[:, None]
+        else:
+            data = self._synthetic(index)
+        data[:, 14] = 100.0
+        data[:, 15] = index + 1
+        data[:, 16] = 1.0
+        return data
+
+    def _synthetic(self, index):
+        # Background noise and mains hum, plus sEMG bursts whose intensity cycles through
+        # the study's 30/60/100% levels every 5 s block.
+        t = index / SamplingRate
+        count = len(index)
+        data = np.zeros((count, NumberOfAcquiredChannels), dtype=np.float32)
+        noise = self.rng.normal(0.0, 5.0, (count, EEGChannelsCount))
+        mains = 10.0 * np.sin(2 * np.pi * 50.0 * t)[:, None]
+        block = (t // 5).astype(int)
+        intensity = np.where(block % 2 == 1, np.array([1.0, 0.6, 0.3])[(block // 2) % 3], 0.0)
+        burst = self.rng.normal(0.0, 80.0, (count, EEGChannelsCount)) * intensity[:, None]
+        data[:, :EEGChannelsCount] = noise + mains + burst
+        data[:, 8:11] = self.rng.normal(0.0, 0.01, (count, 3)) + np.array([0.0, 0.0, 1.0])
+        data[:, 11:14] = self.rng.normal(0.0, 0.5, (count, 3))
+        return data
+
+
+def _load_replay(path):
+    if path.endswith('.csv'):
+        data = np.loadtxt(path, delimiter=',', dtype=np.float32, ndmin=2)
+    else:
+        from recording import load_recording
+        data, header = load_recording(path)
+    if data.shape[1] < NumberOfAcquiredChannels or len(data) == 0:
+        raise DeviceException(f"{path} does not contain {NumberOfAcquiredChannels} channels to replay.")
+    return np.array(data[:, :NumberOfAcquiredChannels], dtype=np.float32)
@@ -1,20 +1,57 @@
-import UnicornPy
-import numpy as np
 import os
+if os.environ.get("UNICORN_SIMULATOR"):
+    import UnicornPySim as UnicornPy
+else:
+    import UnicornPy
 import datetime
+import sys
+import time
+from acquisition import frame_timing, get_channel_names
+from recording import RecordingWriter, EXTENSION
+from telemetry import Histogram
+
+def acquire(device, file, FrameLength, numberOfGetDataCalls, consoleUpdateRate=0):
+    # Acquisition loop: receives numberOfGetDataCalls frames of FrameLength samples and appends
+    # each to the file, printing a dot every consoleUpdateRate frames (0: never). Returns the
+    # elapsed time, the processing time per frame and the GetData and write latency histograms.
+    numberOfAcquiredChannels = device.GetNumberOfAcquiredChannels()
+    receiveBufferBufferLength = FrameLength * numberOfAcquiredChannels * 4
+    receiveBuffer = bytearray(receiveBufferBufferLength)
+    startTime = time.perf_counter()
+    processingTime = 0.0
+    getDataLatency = Histogram()
+    writeLatency = Histogram()
+    for i in range (0,numberOfGetDataCalls):
+        # Receives the configured number of samples from the Unicorn device and writes it to the acquisition buffer.
+        called = time.perf_counter()
+        device.GetData(FrameLength,receiveBuffer,receiveBufferBufferLength)
+        received = time.perf_counter()
+        getDataLatency.record(1e6 * (received - called))
+
+        # Append the raw frame bytes without any text formatting.
+        file.write_bytes(receiveBuffer)
+        writeLatency.record(1e6 * (time.perf_counter() - received))
+
+        # Update console to indicate that the data acquisition is running.
+        if consoleUpdateRate and i % consoleUpdateRate == 0:
+            print('.',end='',flush=True)
+        processingTime += time.perf_counter() - received
+    elapsed = time.perf_counter() - startTime
+    return elapsed, processingTime / max(numberOfGetDataCalls, 1), getDataLatency, writeLatency
 
 def main():
     # Specifications for the data acquisition.
     #-------------------------------------------------------------------------------------
     TestsignaleEnabled = False;
-    FrameLength = 1;
+    # Samples per GetData call: 1 for lowest latency live feedback, 8-32 for bulk recording.
+    FrameLength = int(sys.argv[1]) if len(sys.argv) > 1 else 1;
     AcquisitionDurationInSeconds = 60;
     today = datetime.datetime.today().strftime('%m%d%Y')
-    DataFile = f"{today}_01.csv"
+    DataFile = f"{today}_01{EXTENSION}"
     counter = 1
     while os.path.exists(DataFile):
         counter += 1
-        DataFile = f"{today}_{str(counter).zfill(2)}.csv"
+        DataFile = f"{today}_{str(counter).zfill(2)}{EXTENSION}"
 
     
     print("Unicorn Acquisition Example")
@@ -52,9 +89,6 @@ def main():
         print("Connected to '%s'." %deviceList[deviceID])
         print()
 
-        # Create a file to store data.
-        file = open(DataFile, "wb")
-
         # Initialize acquisition members.
         #-------------------------------------------------------------------------------------
         numberOfAcquiredChannels= device.GetNumberOfAcquiredChannels()
@@ -64,13 +98,18 @@ def main():
         print("Acquisition Configuration:");
         print("Sampling Rate: %i Hz" %UnicornPy.SamplingRate);
         print("Frame Length: %i" %FrameLength);
+        timing = frame_timing(FrameLength, UnicornPy.SamplingRate)
+        print("Frame Latency: %.1f ms (%.1f GetData calls/s)" %(timing['frame_latency_ms'], timing['get_data_calls_per_second']));
         print("Number Of Acquired Channels: %i" %numberOfAcquiredChannels);
         print("Data Acquisition Length: %i s" %AcquisitionDurationInSeconds);
         print();
 
-        # Allocate memory for the acquisition buffer.
-        receiveBufferBufferLength = FrameLength * numberOfAcquiredChannels * 4
-        receiveBuffer = bytearray(receiveBufferBufferLength)
+        # Create a binary recording to store data. Writes happen inside the GetData loop, so the
+        # file is only fsynced every 10 blocks (10 s): a crash loses at most that much, and slow
+        # storage stalls the loop ten times less often. Nothing may run between this and the try
+        # below, or a failure would leave the journal behind as an interrupted trial.
+        file = RecordingWriter(DataFile, UnicornPy.SamplingRate, get_channel_names(device), sync_every=10,
+                               device=deviceList[deviceID])
 
         try:
             # Start data acquisition.
@@ -88,33 +127,23 @@ def main():
 
             # Acquisition loop.
             #-------------------------------------------------------------------------------------
-            for i in range (0,numberOfGetDataCalls):
-                # Receives the configured number of samples from the Unicorn device and writes it to the acquisition buffer.
-                device.GetData(FrameLength,receiveBuffer,receiveBufferBufferLength)
-
-                # Convert receive buffer to numpy float array 
-                data = np.frombuffer(receiveBuffer, dtype=np.float32, count=numberOfAcquiredChannels * FrameLength)
-                data = np.reshape(data, (FrameLength, numberOfAcquiredChannels))
-                np.savetxt(file,data,delimiter=',',fmt='%.3f',newline='\n')
-                
-                # Update console to indicate that the data acquisition is running.
-                if i % consoleUpdateRate == 0:
-                    print('.',end='',flush=True)
+            elapsed, processingTime, getDataLatency, writeLatency = acquire(device, file, FrameLength, numberOfGetDataCalls, consoleUpdateRate)
 
             # Stop data acquisition.
             #-------------------------------------------------------------------------------------
             device.StopAcquisition();
             print()
             print("Data acquisition stopped.");
+            print("Throughput: %.1f samples/s, %.1f us processing per frame" %(numberOfGetDataCalls * FrameLength / elapsed, 1e6 * processingTime));
+            for name, histogram in (("GetData", getDataLatency), ("Write", writeLatency)):
+                summary = histogram.summary()
+                print("%s latency: mean %.0f us, p50 <= %.0f us, p99 <= %.0f us, max %.0f us" %(name, summary['mean'], summary['p50'], summary['p99'], summary['max']));
 
         except UnicornPy.DeviceException as e:
             print(e)
         except Exception as e:
             print("An unknown error occured. %s" %e)
         finally:
-            # release receive allocated memory of receive buffer
-            del receiveBuffer
-
             #close file
             file.close()
 
@@ -131,4 +160,5 @@ def main():
     input("\n\nPress ENTER key to exit")
 
 #execute main
-main()
+if __name__ == "__main__":
+    main()
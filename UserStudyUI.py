@@ -1,12 +1,23 @@
 import tkinter as tk
 from tkinter import messagebox
-import UnicornPy
-import numpy as np
 import os
-import datetime
-import threading
+if os.environ.get("UNICORN_SIMULATOR"):
+    import UnicornPySim as UnicornPy
+else:
+    import UnicornPy
 from pylsl import StreamInfo, StreamOutlet
-import time
+from acquisition import get_channel_names
+from markers import events_path
+from catalog import Catalog
+from lsl_publisher import LSLPublisher
+from features import FeatureExtractor
+from classifier import MODEL_SUFFIX
+from audio_cues import CuePlayer
+from live_plot import LivePlot
+from telemetry import metrics_path, status_line
+from protocol import PROTOCOL_DIR
+from session import StudySession, UI_REFRESH_MS, new_trial, print_statistics, resume_question, resume_trial
+from recording import EXTENSION, journal_path
 
 class SEMGStudyApp:
     def __init__(self, root):
@@ -19,10 +30,29 @@ class SEMGStudyApp:
         self.trial_number = 1
         self.device = None
         self.output_folder = "Data"
-        self.data_file = None
+        # Index of the recordings under the output folder, kept up to date as trials are written.
+        self.catalog = Catalog(self.output_folder)
+        self.catalog.scan()
+        self.session = None
+        # Instructions, durations, event codes and cues of a trial, compiled per participant.
+        self.protocol_path = os.path.join(PROTOCOL_DIR, "single_block.json")
+        # Samples per GetData call; raise to 8-32 to trade feedback latency for throughput.
+        self.frame_length = 1
+        # Samples per LSL chunk; 0 pushes every block drained from the acquisition ring.
+        self.lsl_chunk_size = 8
+        # Record only the instructions, as V1 always has. Set to True to also record the
+        # countdowns, so the file has no gaps and the markers give the instruction boundaries.
+        self.record_countdowns = False
+        self.feature_extractor = None
+        self.live_plot = None
+        # Also publish the acquisition health metrics as an LSL stream.
+        self.publish_metrics = False
+        # Trials of the single block used to calibrate the live classifier; later trials reuse it.
+        self.calibration_repetitions = 1
         
         self.create_ui()
         self.lsl_streams = self.setup_lsl_streams()
+        self.cue_player = self.setup_audio()
     
     def create_ui(self):
         tk.Label(self.root, text="Participant Label:").grid(row=0, column=0)
@@ -40,16 +70,26 @@ class SEMGStudyApp:
         
         self.countdown_label = tk.Label(self.root, text="", font=("Helvetica", 16, "bold"))
         self.countdown_label.grid(row=6, column=0, columnspan=3)
+        
+        self.status_bar = tk.Label(self.root, text=status_line(None), anchor=tk.W, relief=tk.SUNKEN)
+        self.status_bar.grid(row=8, column=0, columnspan=3, sticky=tk.EW)
     
     def setup_lsl_streams(self):
-        # Create LSL stream for raw data and events
-        info_data = StreamInfo('UnicornRawData', 'EEG', 17, 250, 'float32', 'unicorn_raw_data')
-        outlet_data = StreamOutlet(info_data)
-        
+        # Create LSL stream for events; the raw data stream is described from the device
+        # configuration once a Unicorn is connected.
         info_event = StreamInfo('UnicornEvent', 'Markers', 1, 0, 'int32', 'unicorn_event')
         outlet_event = StreamOutlet(info_event)
         
-        return {'data': outlet_data, 'event': outlet_event}
+        return {'data': None, 'event': outlet_event}
+    
+    def setup_audio(self):
+        # Spoken prompts are optional: without PyAV, sounddevice or an output device the
+        # countdown stays visual only.
+        try:
+            return CuePlayer(frame_seconds=self.frame_length / UnicornPy.SamplingRate)
+        except Exception as e:
+            print(f"Audio cues disabled: {e}")
+            return None
     
     def connect_to_unicorn(self):
         try:
@@ -58,6 +98,13 @@ class SEMGStudyApp:
                 raise Exception("No device available. Please pair with a Unicorn first.")
             self.device = UnicornPy.Unicorn(device_list[0])
             num_channels = self.device.GetNumberOfAcquiredChannels()  # Get the number of channels
+            self.lsl_streams['data'] = LSLPublisher(self.device, UnicornPy.SamplingRate, 'UnicornRawData', 'EEG',
+                                                    'unicorn_raw_data', serial=device_list[0],
+                                                    chunk_size=self.lsl_chunk_size)
+            self.feature_extractor = FeatureExtractor(self.device, UnicornPy.SamplingRate)
+            if self.live_plot is None:
+                self.live_plot = LivePlot(self.root, UnicornPy.SamplingRate, get_channel_names(self.device))
+                self.live_plot.widget.grid(row=7, column=0, columnspan=3)
             messagebox.showinfo("Success", f"Connected to Unicorn device with {num_channels} channels.")
         except Exception as e:
             messagebox.showerror("Error", str(e))
@@ -75,17 +122,34 @@ class SEMGStudyApp:
             messagebox.showerror("Error", "Please select an expression (Smile or Frown).")
             return
         
+        if self.session and self.session.is_running():
+            messagebox.showerror("Error", "Data collection is already running.")
+            return
+        
         self.is_collecting = True
-        self.trial_number = self.get_next_trial_number()
-        threading.Thread(target=self.collect_data).start()
+        try:
+            if self.offer_resume():
+                return
+            self.trial_number = self.get_next_trial_number()
+            self.collect_data()
+        except Exception as e:
+            # Nothing was recorded; the session setup already closed the trial's files.
+            self.is_collecting = False
+            messagebox.showerror("Error", f"Could not start data collection: {e}")
     
     def stop_data_collection(self):
         self.is_collecting = False
+        if self.session:
+            self.session.stop()
     
     def delete_last_trial(self):
         last_trial_file = self.get_last_trial_file()
         if last_trial_file:
             os.remove(last_trial_file)
+            for sidecar in (events_path(last_trial_file), journal_path(last_trial_file), metrics_path(last_trial_file)):
+                if os.path.exists(sidecar):
+                    os.remove(sidecar)
+            self.catalog.remove(last_trial_file)
             messagebox.showinfo("Success", f"Deleted {last_trial_file}")
     
     def get_next_trial_number(self):
@@ -93,84 +157,78 @@ class SEMGStudyApp:
         expression = self.expression_choice.get()
         folder_path = os.path.join(self.output_folder, label)
         os.makedirs(folder_path, exist_ok=True)
-        existing_files = [f for f in os.listdir(folder_path) if f.startswith(f"{label}_{expression}")]
-        return len(existing_files) + 1
+        return self.catalog.next_trial(label, expression)
     
     def get_last_trial_file(self):
-        label = self.participant_label.get()
-        expression = self.expression_choice.get()
-        folder_path = os.path.join(self.output_folder, label)
-        existing_files = sorted([f for f in os.listdir(folder_path) if f.startswith(f"{label}_{expression}")])
-        if existing_files:
-            return os.path.join(folder_path, existing_files[-1])
-        return None
+        return self.catalog.last_recording(self.participant_label.get(), self.expression_choice.get())
     
     def collect_data(self):
         label = self.participant_label.get()
         expression = self.expression_choice.get()
         trial_number = self.trial_number
-        file_path = os.path.join(self.output_folder, label, f"{label}_{expression}_{trial_number:02d}.csv")
+        file_path = os.path.join(self.output_folder, label, f"{label}_{expression}_{trial_number:02d}{EXTENSION}")
         
-        FrameLength = 1
-        AcquisitionDurationInSeconds = 35  # Total duration for the steps
-        
-        self.data_file = open(file_path, "wb")
-        number_of_acquired_channels = self.device.GetNumberOfAcquiredChannels()
-        print("Number of Channels: " + number_of_acquired_channels)
-        receive_buffer_buffer_length = FrameLength * number_of_acquired_channels * 4
-        print("Buffer Length: " + receive_buffer_buffer_length)
-        receive_buffer = bytearray(receive_buffer_buffer_length)
-        
-        try:
-            self.device.StartAcquisition(False)
-            print("Data acquisition started.")
-            
-            steps = [
-                (5, "Neutral", 0),
-                (5, "Strong Expression", 3 if expression == "Frown" else 6),
-                (5, "Neutral", 0),
-                (5, "Medium Expression", 2 if expression == "Frown" else 5),
-                (5, "Neutral", 0),
-                (5, "Weak Expression", 1 if expression == "Frown" else 4),
-                (5, "Neutral", 0)
-            ]
-            
-            for duration, description, event_code in steps:
-                if not self.is_collecting:
-                    break
-                
-                for sec in range(duration, 0, -1):
-                    self.update_countdown(f"{description} in {sec} seconds")
-                    time.sleep(1)
-                
-                self.update_countdown(description)
-                start_time = time.time()
-                while time.time() - start_time < duration:
-                    print("Starting data collection...")
-                    self.device.GetData(FrameLength, receive_buffer, receive_buffer_buffer_length)
-                    print("Reading data from buffer...")
-                    data = np.frombuffer(receive_buffer, dtype=np.float32, count=number_of_acquired_channels * FrameLength)
-                    data = np.reshape(data, (FrameLength, number_of_acquired_channels))
-                    np.savetxt(self.data_file, data, delimiter=',', fmt='%.3f', newline='\n')
-
-                    self.lsl_streams['data'].push_chunk(data.tolist())
-                    self.lsl_streams['event'].push_sample([event_code])
-                
-                if not self.is_collecting:
-                    break
-            
+        counterbalance = self.catalog.counterbalance(label)
+        writer, timeline = new_trial(file_path, self.protocol_path, UnicornPy.SamplingRate,
+                                     get_channel_names(self.device), label, expression, trial_number, counterbalance,
+                                     continuous=self.record_countdowns, event_column=False)
+        self.start_session(writer, timeline)
+    
+    def offer_resume(self):
+        folder_path = os.path.join(self.output_folder, self.participant_label.get())
+        resumed = resume_trial(folder_path, self.expression_choice.get(), UnicornPy.SamplingRate,
+                               get_channel_names(self.device),
+                               lambda path, timeline: messagebox.askyesno("Resume Trial",
+                                                                          resume_question(path, timeline)),
+                               self.catalog.add_recording)
+        if resumed is None:
+            return False
+        writer, timeline, keep = resumed
+        self.start_session(writer, timeline, resume_from=keep)
+        return True
+    
+    def start_session(self, writer, timeline, resume_from=None):
+        # Each instruction gets one marker in the events sidecar and on the LSL marker stream;
+        # countdown samples are only recorded with record_countdowns. Live predictions come from
+        # the participant's model, calibrated on this trial for classes not yet covered.
+        label = self.participant_label.get()
+        self.session = StudySession(self.device, UnicornPy.SamplingRate, writer, timeline,
+                                    continuous=writer.header.get('continuous', True), frame_length=self.frame_length,
+                                    resume_from=resume_from, data_outlet=self.lsl_streams['data'],
+                                    event_outlet=self.lsl_streams['event'], feature_extractor=self.feature_extractor,
+                                    model_path=os.path.join(self.output_folder, label, f"{label}{MODEL_SUFFIX}"),
+                                    calibration_repetitions=self.calibration_repetitions, plot=self.live_plot,
+                                    cues=self.cue_player, publish_metrics=self.publish_metrics)
+        self.session.start()
+        print("Data acquisition started.")
+        self.root.after(UI_REFRESH_MS, self.poll_session)
+    
+    def poll_session(self):
+        # Runs on the Tk thread: the only place session progress touches the widgets.
+        if self.session.poll(lambda text, entry: self.update_countdown(text), self.finish_session, self.catalog):
+            self.status_bar.config(text=self.session.status())
+            self.root.after(UI_REFRESH_MS, self.poll_session)
+    
+    def finish_session(self, outcome, error, stats):
+        self.is_collecting = False
+        self.status_bar.config(text=status_line(self.session.metrics.latest))
+        print_statistics(stats)
+        if error is not None:
+            print(f"Error during data collection: {error}")
+            self.update_countdown("Data collection failed")
+        else:
             self.update_countdown("Data collection completed")
-        except Exception as e:
-            print(f"Error during data collection: {e}")
-        finally:
-            self.device.StopAcquisition()
-            self.data_file.close()
-            del receive_buffer
     
     def update_countdown(self, text):
         self.countdown_label.config(text=text)
     
     def on_closing(self):
+        if self.session and self.session.is_running():
+            self.session.stop()
+            self.session.controller.thread.join()
+            self.session.finish(self.catalog)
+        if self.cue_player is not None:
+            self.cue_player.close()
         if self.device:
             self.device.StopAcquisition()
             del self.device
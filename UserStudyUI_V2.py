@@ -1,56 +1,54 @@
-import UnicornPy
-import numpy as np
 import os
-import datetime
+if os.environ.get("UNICORN_SIMULATOR"):
+    import UnicornPySim as UnicornPy
+else:
+    import UnicornPy
 import tkinter as tk
 from tkinter import messagebox, ttk
 from pylsl import StreamInfo, StreamOutlet
+from acquisition import get_channel_names
+from catalog import Catalog
+from lsl_publisher import LSLPublisher
+from features import FeatureExtractor
+from classifier import MODEL_SUFFIX
+from audio_cues import CuePlayer
+from live_plot import LivePlot
+from telemetry import status_line
+from protocol import PROTOCOL_DIR
+from session import StudySession, UI_REFRESH_MS, new_trial, print_statistics, resume_question, resume_trial
+from recording import EXTENSION
 
 class DataCollectionApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Data Collection UI")
-        self.instructions = [
-            ("Relax Face", 5, "Neutral", 0),
-            ("Strong Expression", 5, "100%", 3),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Medium Expression", 5, "60%", 2),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Weak Expression", 5, "30%", 1),
-            ("Relax Face", 10, "Neutral", 0),
-            ("Strong Expression", 5, "100%", 3),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Medium Expression", 5, "60%", 2),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Weak Expression", 5, "30%", 1),
-            ("Relax Face", 10, "Neutral", 0),
-            ("Strong Expression", 5, "100%", 3),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Medium Expression", 5, "60%", 2),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Weak Expression", 5, "30%", 1),
-            ("Relax Face", 10, "Neutral", 0),
-            ("Strong Expression", 5, "100%", 3),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Medium Expression", 5, "60%", 2),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Weak Expression", 5, "30%", 1),
-            ("Relax Face", 10, "Neutral", 0),
-            ("Strong Expression", 5, "100%", 3),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Medium Expression", 5, "60%", 2),
-            ("Relax Face", 5, "Neutral", 0),
-            ("Weak Expression", 5, "30%", 1)
-        ]
-        self.current_instruction = 0
+        # Instructions, durations, event codes and cues of a session, compiled per participant.
+        self.protocol_path = os.path.join(PROTOCOL_DIR, "intensity_blocks.json")
+        self.session = None
+        # Index of the recordings under Data/, kept up to date as sessions are written.
+        self.catalog = Catalog("Data")
+        self.catalog.scan()
         self.device = None
-        self.file = None
+        # Samples per GetData call; raise to 8-32 to trade feedback latency for throughput.
+        self.frame_length = 1
+        # Samples per LSL chunk; 0 pushes every block drained from the acquisition ring.
+        self.lsl_chunk_size = 8
+        self.device_serial = None
+        # Stream the device for the whole session, including preparation and countdown
+        # periods, instead of starting and stopping acquisition for every instruction.
+        self.continuous_acquisition = True
+        # Also publish the acquisition health metrics as an LSL stream.
+        self.publish_metrics = False
+        # Protocol repetitions used to calibrate the live classifier in a participant's first trial.
+        self.calibration_repetitions = 2
         self.label = None
         self.expression_type = tk.StringVar(value="Smile")
 
         self.create_widgets()
         self.setup_device()
         self.setup_lsl()
+        self.setup_live_plot()
+        self.setup_audio()
 
     def create_widgets(self):
         self.label_frame = tk.Frame(self.root)
@@ -78,6 +76,9 @@ class DataCollectionApp:
         self.start_button = tk.Button(self.root, text="Start", command=self.start_data_collection)
         self.start_button.pack(pady=20)
 
+        self.status_bar = tk.Label(self.root, text=status_line(None), anchor=tk.W, relief=tk.SUNKEN)
+        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+
     def setup_device(self):
         try:
             deviceList = UnicornPy.GetAvailableDevices(True)
@@ -85,6 +86,7 @@ class DataCollectionApp:
                 raise Exception("No device available. Please pair with a Unicorn first.")
 
             self.device = UnicornPy.Unicorn(deviceList[0])
+            self.device_serial = deviceList[0]
             messagebox.showinfo("Device Connected", f"Connected to '{deviceList[0]}'.")
 
         except Exception as e:
@@ -92,11 +94,32 @@ class DataCollectionApp:
             self.root.quit()
 
     def setup_lsl(self):
-        self.data_info = StreamInfo('UnicornData', 'EEG', 18, UnicornPy.SamplingRate, 'float32', 'unicorn12345')
-        #self.event_info = StreamInfo('UnicornEvents', 'Markers', 1, 0, 'int32', 'unicorn_events12345')
+        if self.device is None:
+            return
+        # Channel labels, units and count come from the device configuration, plus the event column.
+        self.data_outlet = LSLPublisher(self.device, UnicornPy.SamplingRate, 'UnicornData', 'EEG', 'unicorn12345',
+                                        serial=self.device_serial, event_column=True, chunk_size=self.lsl_chunk_size)
+        # Filtered RMS/MAV/zero-crossing features of the sEMG channels on their own outlet.
+        self.feature_extractor = FeatureExtractor(self.device, UnicornPy.SamplingRate)
+        self.event_info = StreamInfo('UnicornEvents', 'Markers', 1, 0, 'int32', 'unicorn_events12345')
         
-        self.data_outlet = StreamOutlet(self.data_info)
-        #self.event_outlet = StreamOutlet(self.event_info)
+        self.event_outlet = StreamOutlet(self.event_info)
+
+    def setup_live_plot(self):
+        self.live_plot = None
+        if self.device is None:
+            return
+        self.live_plot = LivePlot(self.root, UnicornPy.SamplingRate, get_channel_names(self.device))
+        self.live_plot.widget.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    def setup_audio(self):
+        # Spoken prompts are optional: without PyAV, sounddevice or an output device the
+        # instructions stay visual only.
+        try:
+            self.cue_player = CuePlayer(frame_seconds=self.frame_length / UnicornPy.SamplingRate)
+        except Exception as e:
+            self.cue_player = None
+            print(f"Audio cues disabled: {e}")
 
     def start_data_collection(self):
         self.participant_label = self.label_entry.get().strip()
@@ -104,76 +127,77 @@ class DataCollectionApp:
             messagebox.showerror("Error", "Please enter a participant label.")
             return
 
-        self.current_instruction = 0
         self.start_button.config(state=tk.DISABLED)
         self.expression_choice.config(state=tk.DISABLED)
         self.label_entry.config(state=tk.DISABLED)
         
+        try:
+            self.begin_session()
+        except Exception as e:
+            # Nothing was recorded; the session setup already closed the trial's files.
+            messagebox.showerror("Error", f"Could not start data collection: {e}")
+            self.start_button.config(state=tk.NORMAL)
+            self.expression_choice.config(state=tk.NORMAL)
+            self.label_entry.config(state=tk.NORMAL)
+
+    def begin_session(self):
         expression_type = self.expression_type.get()
         directory = os.path.join("Data", self.participant_label)
         if not os.path.exists(directory):
             os.makedirs(directory)
-        file_name = f"{self.participant_label}_{expression_type}_1.csv"
-        self.data_file_path = os.path.join(directory, file_name)
-        counter = 1
-        while os.path.exists(self.data_file_path):
-            counter += 1
-            self.data_file_path = os.path.join(directory, f"{self.participant_label}_{expression_type}_{counter}.csv")
+        if self.offer_resume(directory, expression_type):
+            return
+        counter = self.catalog.next_trial(self.participant_label, expression_type)
+        self.data_file_path = os.path.join(directory, f"{self.participant_label}_{expression_type}_{counter}{EXTENSION}")
         
-        self.file = open(self.data_file_path, "wb")
-        self.root.after(1000, self.show_next_instruction)
-
-    def show_next_instruction(self):
-        if self.current_instruction < len(self.instructions):
-            instruction, duration, expression, event_code = self.instructions[self.current_instruction]
-            if "Expression" in instruction:
-                expression_mod = f"{self.expression_type.get()} {instruction.split()[0]}"
-                event_code += 3 if self.expression_type.get() == "Frown" else 0
-            else:
-                expression_mod = instruction
-            self.label.config(text=f"Prepare for: {expression_mod} ({expression})")
-            self.root.after(5000, self.countdown, duration, expression_mod, expression, event_code)
-        else:
-            self.stop_data_collection()
-
-    def countdown(self, duration, instruction, expression, event_code):
-        for i in range(3, 0, -1):
-            self.label.config(text=f"{instruction} ({expression}) in {i}")
-            self.root.update()
-            self.root.after(1000)
-        self.label.config(text=f"{instruction} ({expression}) for {duration} seconds")
-        #self.event_outlet.push_sample([event_code])
-        self.root.after(duration * 1000, self.collect_data(event_code))
-        self.current_instruction += 1
-
-    def collect_data(self, event_code):
-        FrameLength = 1
-        try:
-            numberOfAcquiredChannels = self.device.GetNumberOfAcquiredChannels()
-            receiveBufferBufferLength = FrameLength * numberOfAcquiredChannels * 4
-            receiveBuffer = bytearray(receiveBufferBufferLength)
-            
-            self.device.StartAcquisition(False)
-            
-            for _ in range(5 * UnicornPy.SamplingRate // FrameLength):
-                self.device.GetData(FrameLength, receiveBuffer, receiveBufferBufferLength)
-                data = np.frombuffer(receiveBuffer, dtype=np.float32, count=numberOfAcquiredChannels * FrameLength)
-                data = np.append(data, np.float32(event_code))
-                data = np.reshape(data, (FrameLength, numberOfAcquiredChannels+1))
-                np.savetxt(self.file, data, delimiter=',', fmt='%.3f', newline='\n')
-                self.data_outlet.push_chunk(data.tolist())
-            
-            self.device.StopAcquisition()
-
-        except UnicornPy.DeviceException as e:
-            messagebox.showerror("Device Error", str(e))
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
-
-        self.show_next_instruction()
-
-    def stop_data_collection(self):
-        self.file.close()
+        # Shuffled and rotated blocks are reproducible from the participant and trial, which
+        # the header keeps so an interrupted trial can be recompiled and resumed.
+        counterbalance = self.catalog.counterbalance(self.participant_label)
+        writer, timeline = new_trial(self.data_file_path, self.protocol_path, UnicornPy.SamplingRate,
+                                     get_channel_names(self.device), self.participant_label, expression_type, counter,
+                                     counterbalance, continuous=self.continuous_acquisition)
+        self.start_session(writer, timeline)
+
+    def offer_resume(self, directory, expression_type):
+        resumed = resume_trial(directory, expression_type, UnicornPy.SamplingRate, get_channel_names(self.device),
+                               lambda path, timeline: messagebox.askyesno("Resume Trial",
+                                                                          resume_question(path, timeline)),
+                               self.catalog.add_recording)
+        if resumed is None:
+            return False
+        writer, timeline, keep = resumed
+        self.data_file_path = writer.path
+        self.start_session(writer, timeline, resume_from=keep)
+        return True
+
+    def start_session(self, writer, timeline, resume_from=None):
+        # Live expression and intensity predictions, calibrated on the first blocks for the
+        # classes the participant's earlier trials have not covered yet.
+        model_path = os.path.join(os.path.dirname(self.data_file_path), f"{self.participant_label}{MODEL_SUFFIX}")
+        # The protocol runs on the session thread; the Tk loop only polls for progress.
+        self.session = StudySession(self.device, UnicornPy.SamplingRate, writer, timeline,
+                                    continuous=writer.header.get('continuous', True), frame_length=self.frame_length,
+                                    resume_from=resume_from, data_outlet=self.data_outlet,
+                                    event_outlet=self.event_outlet, feature_extractor=self.feature_extractor,
+                                    model_path=model_path, calibration_repetitions=self.calibration_repetitions,
+                                    plot=self.live_plot, cues=self.cue_player, publish_metrics=self.publish_metrics)
+        self.session.start()
+        self.root.after(UI_REFRESH_MS, self.poll_session)
+
+    def poll_session(self):
+        # Runs on the Tk thread: the only place session progress touches the widgets.
+        if self.session.poll(lambda text, entry: self.label.config(text=text), self.stop_data_collection,
+                             self.catalog):
+            self.status_bar.config(text=self.session.status())
+            self.root.after(UI_REFRESH_MS, self.poll_session)
+
+    def stop_data_collection(self, outcome, error, stats):
+        self.status_bar.config(text=status_line(self.session.metrics.latest))
+        print_statistics(stats)
+        if self.cue_player is not None:
+            self.cue_player.close()
+        if error is not None:
+            messagebox.showerror("Device Error", error)
         messagebox.showinfo("Data Collection", "Data collection completed.")
         self.root.quit()
 
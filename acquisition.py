@@ -0,0 +1,379 @@
+import threading
+import time
+import numpy as np
+from telemetry import QUEUE_BOUNDS, Histogram, Telemetry
+
+# Event code stored for samples acquired while no instruction is active.
+NO_EVENT = -1
+
+# Index of the Unicorn sample counter in the 17 acquired channels
+# (8 EEG, 3 accelerometer, 3 gyroscope, battery, counter, validation).
+COUNTER_CHANNEL = 15
+BATTERY_CHANNEL = 14
+VALIDATION_CHANNEL = 16
+
+UNICORN_CHANNELS = [
+    'EEG 1', 'EEG 2', 'EEG 3', 'EEG 4', 'EEG 5', 'EEG 6', 'EEG 7', 'EEG 8',
+    'Accelerometer X', 'Accelerometer Y', 'Accelerometer Z',
+    'Gyroscope X', 'Gyroscope Y', 'Gyroscope Z',
+    'Battery Level', 'Counter', 'Validation Indicator',
+]
+
+
+def get_channel_names(device):
+    # Names of the acquired channels as reported by the device configuration.
+    try:
+        channels = device.GetConfiguration().Channels
+        names = [channel.Name for channel in channels if channel.Enabled]
+    except Exception:
+        names = []
+    count = device.GetNumberOfAcquiredChannels()
+    if len(names) != count:
+        names = UNICORN_CHANNELS[:count] + [f'Channel {i + 1}' for i in range(len(UNICORN_CHANNELS), count)]
+    return names
+
+
+def get_channel_units(device):
+    # Units of the acquired channels, falling back to the Unicorn defaults by channel name.
+    names = get_channel_names(device)
+    try:
+        units = [channel.Unit for channel in device.GetConfiguration().Channels if channel.Enabled]
+    except Exception:
+        units = []
+    if len(units) != len(names):
+        defaults = {'EEG': 'microvolts', 'Accelerometer': 'g', 'Gyroscope': 'deg/s', 'Battery': 'percent'}
+        units = [defaults.get(name.split()[0], '') for name in names]
+    return units
+
+
+def frame_timing(frame_length, sampling_rate):
+    # Buffering latency added by waiting for a whole frame versus GetData round trips per second.
+    return {
+        'frame_length': frame_length,
+        'frame_latency_ms': 1000.0 * frame_length / sampling_rate,
+        'get_data_calls_per_second': sampling_rate / frame_length,
+    }
+
+
+class RingBuffer:
+    """Preallocated sample ring written by a single reader thread.
+
+    The writer only advances `write_index` after a frame has been copied in, and every
+    consumer keeps its own read position, so no lock is needed on the data itself. Until it
+    does, the `frame_length` slots after `write_index` may already hold part of the next frame.
+    """
+
+    def __init__(self, capacity, num_channels, frame_length=1):
+        self.capacity = capacity
+        self.num_channels = num_channels
+        self.frame_length = frame_length
+        self.data = np.zeros((capacity, num_channels), dtype=np.float32)
+        self.codes = np.full(capacity, NO_EVENT, dtype=np.int32)
+        # Acquisition clock time of every sample.
+        self.times = np.zeros(capacity, dtype=np.float64)
+        # Total number of samples ever written; positions are taken modulo capacity.
+        self.write_index = 0
+
+    def write(self, frame, event_code, timestamp, offsets):
+        # `timestamp` is the time the frame was received and `offsets` how long before that
+        # each of its samples was taken.
+        start = self.write_index % self.capacity
+        stop = start + len(frame)
+        if stop > self.capacity:
+            # Frames stop being aligned to the ring once a bounded run has ended on a partial frame.
+            split = self.capacity - start
+            codes = np.broadcast_to(event_code, len(frame))
+            self.data[start:] = frame[:split]
+            self.data[:stop - self.capacity] = frame[split:]
+            self.codes[start:] = codes[:split]
+            self.codes[:stop - self.capacity] = codes[split:]
+            np.subtract(timestamp, offsets[:split], out=self.times[start:])
+            np.subtract(timestamp, offsets[split:], out=self.times[:stop - self.capacity])
+        else:
+            self.data[start:stop] = frame
+            self.codes[start:stop] = event_code
+            np.subtract(timestamp, offsets, out=self.times[start:stop])
+        self.write_index += len(frame)
+
+    def read(self, read_index, count):
+        # Copy out `count` samples starting at absolute position `read_index`.
+        start = read_index % self.capacity
+        stop = start + count
+        if stop <= self.capacity:
+            return self.data[start:stop].copy(), self.codes[start:stop].copy()
+        wrap = stop - self.capacity
+        data = np.concatenate((self.data[start:], self.data[:wrap]))
+        codes = np.concatenate((self.codes[start:], self.codes[:wrap]))
+        return data, codes
+
+
+class Consumer:
+    """Drains the ring buffer on its own thread and hands blocks to `handler`.
+
+    `handler(data, codes, first_sample)` receives a (samples, channels) float32 array, the
+    event code of every sample and the absolute index of the first sample in the block.
+    """
+
+    def __init__(self, name, handler, poll_interval=0.02):
+        self.name = name
+        self.handler = handler
+        self.poll_interval = poll_interval
+        self.read_index = 0
+        self.samples_consumed = 0
+        self.overruns = 0
+        self.underruns = 0
+        self.error = None
+        self.thread = None
+        # Samples waiting in the ring at each drain, and time spent in the handler.
+        self.queue_depth = Histogram(QUEUE_BOUNDS)
+        self.handler_us = Histogram()
+
+    def drain(self, ring):
+        available = ring.write_index - self.read_index
+        self.queue_depth.record(max(available, 0))
+        if available <= 0:
+            self.underruns += 1
+            return 0
+        if available > ring.capacity:
+            # The reader lapped us: the oldest samples were overwritten before we got to them.
+            lost = available - ring.capacity
+            self.overruns += lost
+            self.read_index += lost
+            available = ring.capacity
+        first_sample = self.read_index
+        data, codes = ring.read(first_sample, available)
+        # Overwritten while we were copying, counting the frame the writer may be filling
+        # but has not published yet; drop the stale head of the block.
+        if ring.write_index + ring.frame_length - first_sample > ring.capacity:
+            lost = min(ring.write_index + ring.frame_length - first_sample - ring.capacity, len(data))
+            self.overruns += lost
+            data, codes = data[lost:], codes[lost:]
+            first_sample += lost
+        self.read_index = first_sample + len(data)
+        if not len(data):
+            return 0
+        self.samples_consumed += len(data)
+        started = time.perf_counter()
+        self.handler(data, codes, first_sample)
+        self.handler_us.record(1e6 * (time.perf_counter() - started))
+        return len(data)
+
+
+class AcquisitionEngine:
+    """Reads a Unicorn on a dedicated thread into a ring buffer drained by consumer threads.
+
+    The reader thread does nothing but `GetData` and a copy into the ring, so slow disks,
+    LSL or console output in the consumers can no longer back up the device FIFO.
+    """
+
+    def __init__(self, device, sampling_rate, frame_length=1, buffer_seconds=10,
+                 counter_channel=COUNTER_CHANNEL, clock=time.perf_counter):
+        self.device = device
+        # Time source for sample timestamps; pass pylsl.local_clock to align with LSL streams.
+        self.clock = clock
+        self.sampling_rate = sampling_rate
+        self.frame_length = frame_length
+        self.num_channels = device.GetNumberOfAcquiredChannels()
+        frames = max(1, int(buffer_seconds * sampling_rate) // frame_length)
+        self.ring = RingBuffer(frames * frame_length, self.num_channels, frame_length)
+        self.counter_channel = counter_channel if counter_channel is not None and counter_channel < self.num_channels else None
+        self.consumers = []
+        self.current_event = (NO_EVENT, None)
+        self._new_event = True
+        self.schedule = None
+        self.schedule_origin = 0
+        self._next_entry = 0
+        # (sample_index, event_code, label) for every set_event call or timeline entry, as seen by the reader.
+        self.events = []
+        self.stop_at = None
+        self.dropped_samples = 0
+        self.error = None
+        self.running = False
+        self.acquiring = False
+        self.reader_thread = None
+        self.get_data_calls = 0
+        self.reader_busy_seconds = 0.0
+        self.started_at = None
+        self.stopped_at = None
+        self._last_counter = None
+        # Latency histograms of the reader and every consumer, cheap enough to stay on.
+        self.telemetry = Telemetry()
+        self.get_data_us = self.telemetry.histogram('get_data_us')
+        self.reader_busy_us = self.telemetry.histogram('reader_busy_us')
+
+    def add_consumer(self, handler, name=None, poll_interval=0.02):
+        consumer = Consumer(name or f"consumer{len(self.consumers)}", handler, poll_interval)
+        self.consumers.append(consumer)
+        self.telemetry.add(f"{consumer.name}.queue_depth", consumer.queue_depth)
+        self.telemetry.add(f"{consumer.name}.handler_us", consumer.handler_us)
+        return consumer
+
+    def set_event(self, event_code, label=None):
+        # Tags every sample read from now on; NO_EVENT marks samples outside an instruction.
+        # Every call starts a new event, even when the code does not change.
+        self.current_event = (event_code, label)
+        self._new_event = True
+
+    def sample_time(self, sample_index):
+        # Acquisition clock time of a sample that is still held in the ring.
+        return float(self.ring.times[sample_index % self.ring.capacity])
+
+    def device_health(self, since_index=None):
+        # Battery level of the newest sample and how many samples since `since_index` (at most
+        # the ring) the device flagged as invalid. Read from the ring, so the reader pays nothing.
+        end = self.ring.write_index
+        if end == 0 or self.num_channels <= VALIDATION_CHANNEL:
+            return float('nan'), 0
+        start = max(end - self.ring.capacity, 0 if since_index is None else since_index)
+        positions = np.arange(start, end) % self.ring.capacity
+        battery = float(self.ring.data[(end - 1) % self.ring.capacity, BATTERY_CHANNEL])
+        invalid = int(np.count_nonzero(self.ring.data[positions, VALIDATION_CHANNEL] != 1))
+        return battery, invalid
+
+    def start(self, test_signal=False, max_samples=None, schedule=None):
+        # With max_samples set the reader stops by itself after that many further samples.
+        # A schedule (protocol.Timeline) makes the reader tag samples itself, switching event
+        # codes at the timeline's sample offsets from this start instead of on set_event calls.
+        self.stop_at = None if max_samples is None else self.ring.write_index + max_samples
+        self.schedule = schedule
+        self.schedule_origin = self.ring.write_index
+        self._next_entry = 0
+        self.error = None
+        self._last_counter = None
+        self.device.StartAcquisition(test_signal)
+        self.acquiring = True
+        self.get_data_calls = 0
+        self.reader_busy_seconds = 0.0
+        self.started_at = time.perf_counter()
+        self.stopped_at = None
+        self.running = True
+        for consumer in self.consumers:
+            consumer.read_index = self.ring.write_index
+            consumer.thread = threading.Thread(target=self._consume, args=(consumer,), name=consumer.name, daemon=True)
+            consumer.thread.start()
+        self.reader_thread = threading.Thread(target=self._read, name="unicorn-reader", daemon=True)
+        self.reader_thread.start()
+
+    def wait(self, timeout=None):
+        # Blocks until the reader has stopped (max_samples reached, stop() or a device error).
+        if self.reader_thread is not None:
+            self.reader_thread.join(timeout)
+
+    def stop(self):
+        self.running = False
+        if self.reader_thread is not None:
+            self.reader_thread.join()
+            self.reader_thread = None
+        try:
+            if self.acquiring:
+                self.acquiring = False
+                self.device.StopAcquisition()
+        finally:
+            for consumer in self.consumers:
+                if consumer.thread is not None:
+                    consumer.thread.join()
+                    consumer.thread = None
+
+    def stats(self):
+        elapsed = ((self.stopped_at or time.perf_counter()) - self.started_at) if self.started_at else 0.0
+        stats = frame_timing(self.frame_length, self.sampling_rate)
+        stats.update({
+            'samples_acquired': self.ring.write_index,
+            'events': len(self.events),
+            'dropped_samples': self.dropped_samples,
+            'get_data_calls': self.get_data_calls,
+            'samples_per_second': self.get_data_calls * self.frame_length / elapsed if elapsed else 0.0,
+            # Reader time spent outside GetData, i.e. the Python cost of handling each frame.
+            'reader_busy_us_per_frame': 1e6 * self.reader_busy_seconds / self.get_data_calls if self.get_data_calls else 0.0,
+            'consumers': {
+                c.name: {'samples': c.samples_consumed, 'overruns': c.overruns, 'underruns': c.underruns}
+                for c in self.consumers
+            },
+            'latency': self.telemetry.summary(),
+        })
+        return stats
+
+    def _read(self):
+        frame_length = self.frame_length
+        count = frame_length * self.num_channels
+        receive_buffer_length = count * 4
+        receive_buffer = bytearray(receive_buffer_length)
+        frame = np.frombuffer(receive_buffer, dtype=np.float32, count=count).reshape(frame_length, self.num_channels)
+        offsets = np.arange(frame_length - 1, -1, -1) / self.sampling_rate
+        try:
+            while self.running:
+                called = time.perf_counter()
+                self.device.GetData(frame_length, receive_buffer, receive_buffer_length)
+                received = time.perf_counter()
+                self.get_data_us.record(1e6 * (received - called))
+                timestamp = self.clock()
+                self.get_data_calls += 1
+                if self.counter_channel is not None:
+                    self._check_counter(frame[:, self.counter_channel])
+                # The last frame of a bounded run is cut at stop_at, so every run stores exactly
+                # max_samples and block boundaries stay on the timeline's sample offsets.
+                rows = frame_length
+                if self.stop_at is not None:
+                    rows = min(frame_length, self.stop_at - self.ring.write_index)
+                if self.schedule is not None:
+                    event_code = self._scheduled_codes(rows)
+                else:
+                    if self._new_event:
+                        self._new_event = False
+                        self.events.append((self.ring.write_index,) + self.current_event)
+                    event_code = self.current_event[0]
+                if rows < frame_length:
+                    self.ring.write(frame[:rows], event_code, timestamp, offsets[:rows])
+                else:
+                    self.ring.write(frame, event_code, timestamp, offsets)
+                busy = time.perf_counter() - received
+                self.reader_busy_seconds += busy
+                self.reader_busy_us.record(1e6 * busy)
+                if self.stop_at is not None and self.ring.write_index >= self.stop_at:
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self.stopped_at = time.perf_counter()
+            self.running = False
+
+    def _scheduled_codes(self, count):
+        # Event code of the next `count` samples: a scalar while no timeline entry starts inside
+        # the frame, otherwise one code per sample so transitions land on the exact sample.
+        schedule = self.schedule
+        position = self.ring.write_index - self.schedule_origin
+        if self._next_entry >= len(schedule) or schedule.starts[self._next_entry] >= position + count:
+            return self.current_event[0]
+        codes = np.full(count, self.current_event[0], dtype=np.int32)
+        while self._next_entry < len(schedule) and schedule.starts[self._next_entry] < position + count:
+            index = self._next_entry
+            offset = max(0, int(schedule.starts[index]) - position)
+            code = int(schedule.codes[index])
+            codes[offset:] = code
+            # One event per entry, so adjacent entries with the same code stay apart.
+            self.events.append((self.ring.write_index + offset, code, schedule.labels[index]))
+            self.current_event = (code, schedule.labels[index])
+            self._next_entry += 1
+        return codes
+
+    def _check_counter(self, counter):
+        # The Unicorn counter increments by one per sample, so any gap is a dropped sample.
+        first = int(counter[0])
+        if self._last_counter is not None and first != self._last_counter + 1:
+            self.dropped_samples += max(0, first - self._last_counter - 1)
+        last = int(counter[-1])
+        self.dropped_samples += max(0, last - first + 1 - len(counter))
+        self._last_counter = last
+
+    def _consume(self, consumer):
+        try:
+            while True:
+                finished = not self.running
+                consumer.drain(self.ring)
+                if finished:
+                    # One last pass after the reader stopped so nothing is left behind.
+                    consumer.drain(self.ring)
+                    break
+                time.sleep(consumer.poll_interval)
+        except Exception as e:
+            consumer.error = e
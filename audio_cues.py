@@ -0,0 +1,128 @@
+"""Spoken instruction cues, decoded once and played on the audio device's own thread.
+
+Every .m4a prompt is decoded to float32 PCM when the player is created, so starting a cue
+is a queue append. The PortAudio callback thread mixes queued cues into the output at the
+requested clock time, a fixed lead after the first sample of the step they announce, and
+reports when each cue actually reached the speakers. The onset, in the acquisition clock, becomes an event
+marker, so cue-to-marker latency and its jitter can be measured per session.
+
+Decoding needs PyAV and playback needs sounddevice; both are optional, and the study UIs fall
+back to visual-only prompts without them.
+"""
+import collections
+import glob
+import os
+import numpy as np
+from pylsl import local_clock
+
+AUDIO_DIR = os.path.dirname(os.path.abspath(__file__))
+CUE_EXTENSION = '.m4a'
+
+
+def decode_audio(path, sample_rate=48000, channels=1):
+    # Decodes and resamples a whole file into a (samples, channels) float32 array.
+    import av
+    chunks = []
+    with av.open(path) as container:
+        resampler = av.AudioResampler(format='flt', layout='mono' if channels == 1 else 'stereo', rate=sample_rate)
+        for frame in container.decode(audio=0):
+            chunks.extend(resampled.to_ndarray() for resampled in resampler.resample(frame))
+        chunks.extend(resampled.to_ndarray() for resampled in resampler.resample(None))
+    if not chunks:
+        raise ValueError(f"{path} contains no audio.")
+    # 'flt' is packed, so every chunk is a single row of interleaved samples.
+    return np.concatenate(chunks, axis=1).reshape(-1, channels).astype(np.float32, copy=False)
+
+
+class CuePlayer:
+    """Preloaded cue buffers played through one low-latency output stream.
+
+    `play(name, requested_at)` schedules a cue to start `self.lead` seconds after `requested_at`,
+    the timestamp of the step's first sample (default: now), on the `clock` time base. That
+    sample is only seen once its frame arrives, up to `frame_seconds` (one acquisition frame)
+    after its timestamp, so the lead is that plus `lead` for the output latency. Onsets then
+    come out at a constant offset instead of whenever the next audio buffer happens to start.
+    `onset_callback(timestamp, name, requested_at)` is called from the audio thread once the
+    onset is known and must return quickly, e.g. MarkerStream.add_cue_marker.
+    """
+
+    def __init__(self, directory=AUDIO_DIR, names=None, sample_rate=48000, channels=1, lead=0.08,
+                 frame_seconds=0.0, clock=local_clock, latency='low'):
+        import sounddevice
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.lead = frame_seconds + lead
+        self.clock = clock
+        paths = [os.path.join(directory, name) for name in names] if names else \
+            sorted(glob.glob(os.path.join(directory, '*' + CUE_EXTENSION)))
+        self.buffers = {os.path.basename(path): decode_audio(path, sample_rate, channels) for path in paths}
+        self.pending = collections.deque()
+        self.active = []
+        self.onset_callback = None
+        self.latencies = []
+        self.late = 0
+        self.callback_errors = 0
+        self.stream = sounddevice.OutputStream(samplerate=sample_rate, channels=channels, dtype='float32',
+                                               latency=latency, callback=self._callback)
+        self.stream.start()
+
+    def play(self, name, requested_at=None):
+        if name not in self.buffers:
+            raise KeyError(f"Unknown cue '{name}'; loaded: {', '.join(sorted(self.buffers))}")
+        requested_at = self.clock() if requested_at is None else requested_at
+        self.pending.append((name, requested_at, requested_at + self.lead))
+
+    def close(self):
+        self.stream.stop()
+        self.stream.close()
+
+    def stats(self):
+        # Latency from the timestamp of the step's first sample to the measured onset.
+        latencies = np.array(self.latencies)
+        if not len(latencies):
+            return {'cues': 0, 'late': self.late, 'callback_errors': self.callback_errors}
+        return {
+            'cues': len(latencies),
+            'mean_latency_ms': float(1000.0 * latencies.mean()),
+            'jitter_ms': float(1000.0 * latencies.std()),
+            'max_latency_ms': float(1000.0 * latencies.max()),
+            'late': self.late,
+            'callback_errors': self.callback_errors,
+        }
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.callback_errors += 1
+        # Clock time at which the first frame of this buffer leaves the DAC. Some host APIs
+        # report no DAC time, in which case the stream's nominal latency is assumed.
+        now = self.clock()
+        if time_info.outputBufferDacTime:
+            buffer_time = now + (time_info.outputBufferDacTime - time_info.currentTime)
+        else:
+            buffer_time = now + self.stream.latency
+        while self.pending:
+            name, requested_at, at = self.pending[0]
+            offset = int(round((at - buffer_time) * self.sample_rate))
+            if offset >= frames:
+                break
+            self.pending.popleft()
+            if offset < 0:
+                self.late += 1
+                offset = 0
+            onset = buffer_time + offset / self.sample_rate
+            self.active.append([self.buffers[name], 0, offset])
+            self.latencies.append(onset - requested_at)
+            if self.onset_callback is not None:
+                self.onset_callback(onset, name, requested_at)
+        outdata.fill(0)
+        still_playing = []
+        for cue in self.active:
+            buffer, position, offset = cue
+            count = min(frames - offset, len(buffer) - position)
+            outdata[offset:offset + count] += buffer[position:position + count]
+            cue[1] = position + count
+            cue[2] = 0
+            if cue[1] < len(buffer):
+                still_playing.append(cue)
+        self.active = still_playing
+        np.clip(outdata, -1.0, 1.0, out=outdata)
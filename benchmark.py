@@ -0,0 +1,338 @@
+"""Acquisition benchmark against the simulated Unicorn.
+
+Drives the real acquisition code: `acquire` from the template script, or a StudySession set
+up like the V1 app (single block protocol, only the instructions recorded) or the V2 app
+(intensity blocks, continuous acquisition). Only the device, the writer and the protocol
+length are substituted. Reports achieved samples/s, per-iteration latency percentiles,
+inter-frame jitter and dropped samples, saved as JSON so runs can be compared over time.
+
+The sessions keep their real timing, so V1 spends the countdowns with the device stopped;
+`--duration` counts acquired samples, not wall-clock time, and samples/s is measured over
+the acquisition runs only.
+
+    python benchmark.py --loop v1 --duration 30 --lsl --write-delay-ms 5
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+import numpy as np
+# The template script picks its driver module on import.
+os.environ.setdefault("UNICORN_SIMULATOR", "1")
+import UnicornPySim
+import UnicornTemplateCode
+from acquisition import NO_EVENT, get_channel_names
+from protocol import PROTOCOL_DIR, compile_protocol
+from recording import RecordingWriter, load_recording
+from session import StudySession
+
+
+class TimedDevice:
+    """Wraps a device and timestamps every GetData call without touching the loop under test."""
+
+    def __init__(self, device):
+        self.device = device
+        self.call_times = []
+        self.return_times = []
+        self.samples_returned = 0
+        # Index of the first call after every StartAcquisition, where the frame timing restarts,
+        # and the time of every StartAcquisition.
+        self.restarts = []
+        self.start_times = []
+        # Samples the loop keeps of each run, when runs end on a partial frame (see arrival_time).
+        self.run_samples = None
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def StartAcquisition(self, testSignalEnabled):
+        self.restarts.append(len(self.call_times))
+        self.start_times.append(time.perf_counter())
+        self.device.StartAcquisition(testSignalEnabled)
+
+    def GetData(self, numberOfScans, destinationBuffer, destinationBufferLength):
+        self.call_times.append(time.perf_counter())
+        self.device.GetData(numberOfScans, destinationBuffer, destinationBufferLength)
+        self.return_times.append(time.perf_counter())
+        self.samples_returned += numberOfScans
+
+    def arrival_time(self, sample_index, frame_length):
+        # Time at which the frame holding `sample_index` (counted from start) was returned. Runs
+        # bounded to `run_samples` drop the rest of their last frame, so frames count per run.
+        frame = sample_index // frame_length
+        if self.run_samples is not None and self.restarts:
+            ends = np.cumsum(self.run_samples)
+            run = min(int(np.searchsorted(ends, sample_index, side='right')), len(self.restarts) - 1)
+            frame = self.restarts[run] + (sample_index - (int(ends[run - 1]) if run else 0)) // frame_length
+        return self.return_times[min(frame, len(self.return_times) - 1)]
+
+    def acquisition_seconds(self):
+        # Time the device was acquiring: from every StartAcquisition to the last frame of its run.
+        bounds = self.restarts[1:] + [len(self.return_times)]
+        return sum(self.return_times[end - 1] - started
+                   for started, first, end in zip(self.start_times, self.restarts, bounds) if end > first)
+
+
+class CsvWriter:
+    """The per-sample np.savetxt writer the scripts used before the binary format."""
+
+    def __init__(self, path, num_channels, event_column=False):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.num_channels = num_channels
+        self.event_column = event_column
+
+    def write(self, data, codes=None):
+        if self.event_column:
+            data = np.column_stack((data, np.asarray(codes, dtype=np.float32)))
+        np.savetxt(self.file, data, delimiter=',', fmt='%.3f', newline='\n')
+
+    def write_bytes(self, buffer):
+        self.write(np.frombuffer(buffer, dtype=np.float32).reshape(-1, self.num_channels))
+
+    def close(self):
+        self.file.close()
+
+
+class SlowWriter:
+    """Adds a fixed delay to every write to emulate a slow or contended disk."""
+
+    def __init__(self, writer, delay):
+        self.writer = writer
+        self.path = writer.path
+        self.delay = delay
+
+    def write(self, *args):
+        time.sleep(self.delay)
+        self.writer.write(*args)
+
+    def write_bytes(self, buffer):
+        time.sleep(self.delay)
+        self.writer.write_bytes(buffer)
+
+    def close(self):
+        self.writer.close()
+
+
+class TimedWriter:
+    """Records the delay from a frame's arrival to the end of the write that stored it.
+
+    Every loop writes every sample the device returns, in order, so the running sample count
+    locates each write's last sample among the device's frames.
+    """
+
+    def __init__(self, writer, device, frame_length):
+        self.writer = writer
+        self.path = writer.path
+        self.device = device
+        self.frame_length = frame_length
+        self.num_channels = device.GetNumberOfAcquiredChannels()
+        self.samples = 0
+        self.latencies = []
+
+    def write(self, data, codes=None):
+        self.writer.write(data, codes)
+        self._written(len(data))
+
+    def write_bytes(self, buffer):
+        self.writer.write_bytes(buffer)
+        self._written(len(buffer) // (4 * self.num_channels))
+
+    def close(self):
+        self.writer.close()
+
+    def _written(self, count):
+        self.samples += count
+        self.latencies.append(time.perf_counter() - self.device.arrival_time(self.samples - 1, self.frame_length))
+
+
+def busy_ui(stop, interval=0.005):
+    # Emulates a Tk mainloop redrawing widgets: short bursts of Python work holding the GIL.
+    while not stop.is_set():
+        sum(i * i for i in range(20000))
+        time.sleep(interval)
+
+
+def make_writer(args, path, device, event_column=False, sync_every=1):
+    if args.csv:
+        writer = CsvWriter(path + '.csv', device.GetNumberOfAcquiredChannels(), event_column)
+    else:
+        writer = RecordingWriter(path + '.semg', UnicornPySim.SamplingRate, get_channel_names(device), event_column,
+                                 sync_every=sync_every)
+    if args.write_delay_ms:
+        writer = SlowWriter(writer, args.write_delay_ms / 1000.0)
+    return TimedWriter(writer, device, args.frame_length)
+
+
+def run_template(args, device, directory):
+    # UnicornTemplateCode's own loop; the file is synced every 10 blocks like the script's.
+    writer = make_writer(args, os.path.join(directory, 'template'), device, sync_every=10)
+    calls = int(args.duration * UnicornPySim.SamplingRate / args.frame_length)
+    device.StartAcquisition(False)
+    try:
+        UnicornTemplateCode.acquire(device, writer, args.frame_length, calls)
+    finally:
+        device.StopAcquisition()
+        writer.close()
+    return {'write_latency_ms': percentiles(writer.latencies)}
+
+
+def run_session(args, device, directory):
+    # A StudySession with the parts and protocol of the V1 or V2 app, stopped once `duration`
+    # seconds of samples were acquired.
+    v1 = args.loop == 'v1'
+    protocol = os.path.join(PROTOCOL_DIR, 'single_block.json' if v1 else 'intensity_blocks.json')
+    timeline = compile_protocol(protocol, UnicornPySim.SamplingRate, {'expression': 'Smile'}, seed='benchmark')
+    writer = make_writer(args, os.path.join(directory, args.loop), device, event_column=not v1)
+    if v1:
+        # Every recorded instruction is one run of exactly its length.
+        device.run_samples = timeline.lengths[timeline.codes != NO_EVENT].tolist()
+    publisher = None
+    if args.lsl:
+        from lsl_publisher import LSLPublisher
+        publisher = LSLPublisher(device, UnicornPySim.SamplingRate, 'UnicornBenchmark', 'EEG', 'unicorn_benchmark',
+                                 event_column=not v1, chunk_size=args.lsl_chunk_size)
+    extractor = None
+    if args.features:
+        from features import FeatureExtractor
+        extractor = FeatureExtractor(device, UnicornPySim.SamplingRate, publish=args.lsl)
+    session = StudySession(device, UnicornPySim.SamplingRate, writer, timeline, continuous=not v1,
+                           frame_length=args.frame_length, data_outlet=publisher, feature_extractor=extractor,
+                           model_path=os.path.join(directory, 'benchmark.classifier.npz') if extractor else None,
+                           calibration_repetitions=1 if v1 else 2)
+    target = int(args.duration * UnicornPySim.SamplingRate)
+    session.start()
+    while session.is_running() and device.samples_returned < target:
+        time.sleep(0.05)
+    session.stop()
+    session.controller.thread.join()
+    message = None
+    while not session.controller.messages.empty():
+        message = session.controller.messages.get()
+    stats = session.finish()
+    if message is not None and message[0] == 'error':
+        raise RuntimeError(message[1])
+    acquisition = stats['acquisition']
+    result = {
+        'write_latency_ms': percentiles(writer.latencies),
+        'overruns': sum(c['overruns'] for c in acquisition['consumers'].values()),
+        'underruns': sum(c['underruns'] for c in acquisition['consumers'].values()),
+        'reader_busy_us_per_frame': acquisition['reader_busy_us_per_frame'],
+        'events': acquisition['events'],
+    }
+    for name in ('lsl', 'features', 'classifier'):
+        if name in stats:
+            result[name] = stats[name]
+    if len(device.restarts) > 1:
+        result['acquisition_runs'] = len(device.restarts)
+    return result
+
+
+def percentiles(seconds):
+    if len(seconds) == 0:
+        return {}
+    values = np.asarray(seconds) * 1000.0
+    result = {f'p{p}': float(np.percentile(values, p)) for p in (50, 90, 99)}
+    result['max'] = float(values.max())
+    return result
+
+
+def loop_metrics(device, frame_length):
+    calls = np.asarray(device.call_times)
+    returns = np.asarray(device.return_times)
+    nominal = frame_length / UnicornPySim.SamplingRate
+    # Pairs of frames within one acquisition run; the device is stopped between runs.
+    within = np.ones(max(len(calls) - 1, 0), dtype=bool)
+    restarts = np.asarray(device.restarts[1:], dtype=np.int64)
+    within[restarts[(restarts > 0) & (restarts < len(calls))] - 1] = False
+    # Time the loop spends between getting a frame and asking for the next one.
+    iteration = (calls[1:] - returns[:-1])[within]
+    intervals = np.diff(returns)[within]
+    seconds = device.acquisition_seconds()
+    return {
+        'samples': device.samples_returned,
+        'samples_per_second': device.samples_returned / seconds if seconds else 0.0,
+        'iteration_latency_ms': percentiles(iteration),
+        'inter_frame_jitter_ms': {
+            'std': float(np.std(intervals - nominal) * 1000.0) if len(intervals) else 0.0,
+            'max_deviation': float(np.max(np.abs(intervals - nominal)) * 1000.0) if len(intervals) else 0.0,
+        },
+    }
+
+
+def count_dropped(counter):
+    counter = np.asarray(counter)
+    return int(np.sum(np.maximum(np.diff(counter) - 1, 0))) if len(counter) > 1 else 0
+
+
+def run(args):
+    UnicornPySim.configure(realtime=not args.fast, jitter_ms=args.jitter_ms,
+                           stall_probability=args.stall_probability, stall_ms=args.stall_ms)
+    device = TimedDevice(UnicornPySim.Unicorn(UnicornPySim.GetAvailableDevices(True)[0]))
+    stop_ui = threading.Event()
+    if args.ui_load:
+        threading.Thread(target=busy_ui, args=(stop_ui,), daemon=True).start()
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            if args.loop == 'template':
+                result = run_template(args, device, directory)
+            else:
+                result = run_session(args, device, directory)
+        finally:
+            stop_ui.set()
+        result.update(loop_metrics(device, args.frame_length))
+        result['dropped_samples'] = recorded_drops(directory, args)
+    return result
+
+
+def recorded_drops(directory, args):
+    # Gaps in the Unicorn counter column of what actually reached the disk. Sessions also
+    # leave events and metrics sidecars next to the recording.
+    path = os.path.join(directory, args.loop)
+    if os.path.exists(path + '.semg'):
+        data, header = load_recording(path + '.semg')
+        return count_dropped(data[:, 15])
+    if os.path.exists(path + '.csv'):
+        return count_dropped(np.loadtxt(path + '.csv', delimiter=',', ndmin=2)[:, 15])
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Unicorn acquisition loops against the simulator.")
+    parser.add_argument('--loop', choices=('template', 'v1', 'v2'), default='v1')
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of data to acquire")
+    parser.add_argument('--frame-length', type=int, default=1)
+    parser.add_argument('--lsl', action='store_true', help="stream to an LSL outlet as well")
+    parser.add_argument('--lsl-chunk-size', type=int, default=8, help="samples per LSL chunk, 0 for every drained block")
+    parser.add_argument('--features', action='store_true', help="run the feature extraction and live classifier")
+    parser.add_argument('--csv', action='store_true', help="use the legacy np.savetxt CSV writer")
+    parser.add_argument('--write-delay-ms', type=float, default=0.0, help="emulate a slow disk")
+    parser.add_argument('--ui-load', action='store_true', help="run a busy thread emulating the Tk UI")
+    parser.add_argument('--fast', action='store_true', help="deliver samples as fast as possible")
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--stall-probability', type=float, default=0.0)
+    parser.add_argument('--stall-ms', type=float, default=0.0)
+    parser.add_argument('--output', help="JSON file to write (default: benchmarks/<loop>_<timestamp>.json)")
+    args = parser.parse_args()
+
+    result = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'config': vars(args),
+        'results': run(args),
+    }
+    output = args.output or os.path.join('benchmarks', f"{args.loop}_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(json.dumps(result['results'], indent=2))
+    print(f"Saved {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+import datetime
+import json
+import os
+import sqlite3
+from markers import MOMENT_EVENTS, events_path, load_events
+from recording import EXTENSION, load_recording
+
+CATALOG_NAME = 'catalog.sqlite'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    participant TEXT,
+    expression TEXT,
+    trial INTEGER,
+    sampling_rate REAL,
+    samples INTEGER,
+    duration REAL,
+    columns TEXT,
+    modified REAL,
+    indexed_at TEXT
+);
+CREATE TABLE IF NOT EXISTS events (
+    recording_id INTEGER NOT NULL REFERENCES recordings(id) ON DELETE CASCADE,
+    sample_index INTEGER NOT NULL,
+    end_index INTEGER NOT NULL,
+    lsl_time REAL,
+    event_code INTEGER,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS participants (
+    participant TEXT PRIMARY KEY,
+    counterbalance INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recordings_by_session ON recordings (participant, expression, trial);
+CREATE INDEX IF NOT EXISTS events_by_code ON events (event_code, label);
+"""
+
+
+def block_ends(markers, samples):
+    # A block runs until the next instruction marker; cue and manual markers only mark a moment.
+    ends = []
+    end = samples
+    for sample_index, _, code, _ in reversed(markers):
+        if code in MOMENT_EVENTS:
+            ends.append(sample_index)
+        else:
+            ends.append(end)
+            end = sample_index
+    return ends[::-1]
+
+
+class Catalog:
+    """SQLite manifest of the recordings under a data folder and their event markers.
+
+    The study UIs add each recording when it is closed, so finding trials or cutting epochs for
+    analysis is an indexed query instead of listing folders and parsing every file. Paths are
+    stored relative to the data folder so the whole tree can be moved.
+    """
+
+    def __init__(self, root="Data"):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(root, CATALOG_NAME))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def add_recording(self, path):
+        data, header = load_recording(path)
+        relative = os.path.relpath(path, self.root)
+        markers = load_events(path) if os.path.exists(events_path(path)) else []
+        samples = len(data)
+        with self.connection:
+            self.connection.execute("DELETE FROM recordings WHERE path = ?", (relative,))
+            cursor = self.connection.execute(
+                "INSERT INTO recordings (path, participant, expression, trial, sampling_rate, samples, duration,"
+                " columns, modified, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (relative, header.get('participant'), header.get('expression'), header.get('trial'),
+                 header['sampling_rate'], samples, samples / header['sampling_rate'],
+                 json.dumps(header['columns']), os.path.getmtime(path),
+                 datetime.datetime.now().isoformat(timespec='seconds')))
+            if header.get('participant') is not None and header.get('counterbalance') is not None:
+                # Rebuilt catalogs keep the counterbalancing indices the trials were run with.
+                self.connection.execute("INSERT OR IGNORE INTO participants (participant, counterbalance) VALUES (?, ?)",
+                                        (header['participant'], header['counterbalance']))
+            ends = block_ends(markers, samples)
+            self.connection.executemany(
+                "INSERT INTO events (recording_id, sample_index, end_index, lsl_time, event_code, label)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(cursor.lastrowid, start, end, lsl_time, code, label)
+                 for (start, lsl_time, code, label), end in zip(markers, ends)])
+        return cursor.lastrowid
+
+    def remove(self, path):
+        with self.connection:
+            self.connection.execute("DELETE FROM recordings WHERE path = ?", (os.path.relpath(path, self.root),))
+
+    def scan(self):
+        # Indexes recordings that are missing or changed since they were catalogued, and drops
+        # entries whose file is gone.
+        known = {row['path']: row['modified'] for row in self.connection.execute("SELECT path, modified FROM recordings")}
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if not name.endswith(EXTENSION):
+                    continue
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, self.root)
+                if known.pop(relative, None) != os.path.getmtime(path):
+                    self.add_recording(path)
+        for relative in known:
+            self.remove(os.path.join(self.root, relative))
+
+    def query(self, participant=None, expression=None, trial=None):
+        # Recordings matching the given fields, as dicts with an absolute 'path'.
+        conditions, parameters = self._conditions(participant, expression, trial)
+        rows = self.connection.execute(
+            f"SELECT * FROM recordings {conditions} ORDER BY participant, expression, trial", parameters)
+        return [self._recording(row) for row in rows]
+
+    def next_trial(self, participant, expression):
+        row = self.connection.execute(
+            "SELECT MAX(trial) FROM recordings WHERE participant = ? AND expression = ?",
+            (participant, expression)).fetchone()
+        return (row[0] or 0) + 1
+
+    def counterbalance(self, participant):
+        # Counterbalancing index of a participant: 0 for the first one, 1 for the next and so on,
+        # kept once assigned so all trials of a participant use the same rotation.
+        with self.connection:
+            row = self.connection.execute(
+                "SELECT counterbalance FROM participants WHERE participant = ?", (participant,)).fetchone()
+            if row is not None:
+                return row[0]
+            index = self.connection.execute("SELECT COALESCE(MAX(counterbalance) + 1, 0) FROM participants").fetchone()[0]
+            self.connection.execute("INSERT INTO participants (participant, counterbalance) VALUES (?, ?)",
+                                    (participant, index))
+        return index
+
+    def last_recording(self, participant, expression):
+        recordings = self.query(participant, expression)
+        return recordings[-1]['path'] if recordings else None
+
+    def events(self, path):
+        row = self.connection.execute(
+            "SELECT id FROM recordings WHERE path = ?", (os.path.relpath(path, self.root),)).fetchone()
+        if row is None:
+            return []
+        return [dict(event) for event in self.connection.execute(
+            "SELECT sample_index, end_index, lsl_time, event_code, label FROM events"
+            " WHERE recording_id = ? ORDER BY sample_index", (row['id'],))]
+
+    def epochs(self, event_code=None, label=None, participant=None, expression=None):
+        """Yields (recording, event, data) for every matching instruction block.
+
+        `participant` may be a single label or a list, `label` an SQL LIKE pattern such as
+        'Smile Strong%'. `data` is a slice of the memory-mapped recording, so nothing is read
+        from disk until it is used.
+        """
+        conditions, parameters = self._conditions(participant, expression, None)
+        if event_code is not None:
+            conditions += (" AND " if conditions else "WHERE ") + "e.event_code = ?"
+            parameters.append(event_code)
+        if label is not None:
+            conditions += (" AND " if conditions else "WHERE ") + "e.label LIKE ?"
+            parameters.append(label)
+        rows = self.connection.execute(
+            "SELECT r.*, e.sample_index, e.end_index, e.lsl_time, e.event_code, e.label"
+            f" FROM events e JOIN recordings r ON r.id = e.recording_id {conditions}"
+            " ORDER BY r.participant, r.expression, r.trial, e.sample_index", parameters)
+        loaded = {}
+        for row in rows:
+            recording = self._recording(row)
+            if recording['path'] not in loaded:
+                loaded[recording['path']] = load_recording(recording['path'])[0]
+            event = {key: row[key] for key in ('sample_index', 'end_index', 'lsl_time', 'event_code', 'label')}
+            yield recording, event, loaded[recording['path']][event['sample_index']:event['end_index']]
+
+    def _conditions(self, participant, expression, trial):
+        conditions = []
+        parameters = []
+        if participant is not None:
+            participants = [participant] if isinstance(participant, str) else list(participant)
+            conditions.append(f"participant IN ({', '.join('?' * len(participants))})")
+            parameters.extend(participants)
+        if expression is not None:
+            conditions.append("expression = ?")
+            parameters.append(expression)
+        if trial is not None:
+            conditions.append("trial = ?")
+            parameters.append(trial)
+        return ("WHERE " + " AND ".join(conditions)) if conditions else "", parameters
+
+    def _recording(self, row):
+        recording = {key: row[key] for key in ('id', 'participant', 'expression', 'trial', 'sampling_rate',
+                                                'samples', 'duration')}
+        recording['path'] = os.path.join(self.root, row['path'])
+        recording['columns'] = json.loads(row['columns'])
+        return recording
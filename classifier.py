@@ -0,0 +1,288 @@
+"""Live expression and intensity classification from the sEMG feature stream.
+
+An IntensityClassifier listens to a FeatureExtractor. While calibrating it keeps the feature
+windows of every recorded instruction, labelled with the instruction's event code, leaving
+out the first `settle_seconds` of each so reaction time and ramp-up do not blur the classes.
+Once every class has been held in `repetitions` separate instructions, a shrinkage LDA is
+fitted with the standardisation folded into its weights, so classifying a block of windows
+is one matrix product whose cost does not depend on the amount of calibration data.
+
+There is one model per participant. Its file keeps the calibration windows next to the fitted
+weights, and a session that calibrates new classes refits on those windows together with the
+ones saved by the participant's earlier sessions. After a Smile and a Frown trial the model
+covers both expressions, so it tells them apart as well as their intensities.
+
+Predictions go out on an LSL stream stamped with the time of each window's last sample. The
+delay from that sample to its prediction is recorded in the engine's telemetry, and windows
+that are already older than `budget_ms` when they arrive, e.g. after a stall, are skipped
+rather than published late.
+"""
+import time
+import zipfile
+import numpy as np
+from pylsl import StreamInfo, StreamOutlet
+from telemetry import Histogram
+
+MODEL_SUFFIX = '.classifier.npz'
+
+
+def timeline_classes(timeline):
+    # Event code -> label of every recorded instruction, in order of first appearance.
+    classes = {}
+    for index in range(len(timeline)):
+        if timeline.recorded(index):
+            classes.setdefault(int(timeline.codes[index]), timeline.labels[index])
+    return classes
+
+
+def feature_vectors(features):
+    # (windows, len(FEATURES), channels) -> (windows, dims). Amplitudes are compared on a log
+    # scale, where intensity levels are roughly evenly spaced.
+    amplitudes = np.log(features[:, :2] + 1e-3)
+    return np.concatenate((amplitudes, features[:, 2:]), axis=1).reshape(len(features), -1)
+
+
+class LDAModel:
+    """Linear discriminant with equal class priors; `codes[k]` is the event code of column k."""
+
+    def __init__(self, codes, labels, weights, bias):
+        self.codes = np.asarray(codes)
+        self.labels = list(labels)
+        self.weights = weights
+        self.bias = bias
+
+    @classmethod
+    def fit(cls, x, y, labels, shrinkage=0.1):
+        # The pooled covariance is shrunk towards a scaled identity, which keeps it well
+        # conditioned with a few hundred windows per class.
+        codes = np.unique(y)
+        if len(codes) < 2:
+            raise ValueError("Calibration needs windows of at least two classes.")
+        mean = x.mean(axis=0)
+        scale = x.std(axis=0)
+        scale[scale == 0] = 1.0
+        z = (x - mean) / scale
+        index = np.searchsorted(codes, y)
+        means = np.array([z[index == k].mean(axis=0) for k in range(len(codes))])
+        centred = z - means[index]
+        covariance = centred.T @ centred / max(len(z) - len(codes), 1)
+        dims = len(covariance)
+        covariance = (1 - shrinkage) * covariance + shrinkage * np.trace(covariance) / dims * np.eye(dims)
+        weights = np.linalg.solve(covariance, means.T)
+        bias = -0.5 * np.einsum('kd,dk->k', means, weights)
+        # Fold the standardisation in: ((x - mean) / scale) @ W == x @ (W / scale) - (mean / scale) @ W.
+        weights /= scale[:, None]
+        bias -= mean @ weights
+        return cls(codes, [labels.get(int(code), str(code)) for code in codes], weights, bias)
+
+    def predict_proba(self, x):
+        scores = x @ self.weights + self.bias
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def save(self, path, x, y):
+        # The training windows are kept so later sessions can refit with more classes.
+        np.savez(path, codes=self.codes, labels=np.array(self.labels), weights=self.weights, bias=self.bias,
+                 x=x, y=y)
+
+    @classmethod
+    def load(cls, path):
+        # Returns the model and its training windows.
+        with np.load(path) as f:
+            return cls(f['codes'], f['labels'].tolist(), f['weights'], f['bias']), f['x'], f['y']
+
+
+def load_model(path):
+    # A participant's saved calibration as (model, x, y), or None if there is none or the file
+    # is unreadable, e.g. truncated by a crash or written by an older version; the session then
+    # calibrates afresh and overwrites it.
+    try:
+        return LDAModel.load(path)
+    except (OSError, zipfile.BadZipFile, KeyError, ValueError):
+        return None
+
+
+class IntensityClassifier:
+    """FeatureExtractor listener that calibrates on the session's first repetitions, then predicts.
+
+    `classes` maps the session's event codes to labels (see timeline_classes). Pass a fitted
+    `model` to skip calibration. Otherwise `model_path` names the participant's model: if it
+    already covers these classes, with the same codes and labels, it is used straight away, and
+    if not the session calibrates them and saves a model refitted on its windows plus those of
+    the participant's other classes.
+    `attach` connects it to the extractor of a session, after the extractor was attached to
+    the engine.
+    """
+
+    def __init__(self, classes, repetitions=2, settle_seconds=1.0, shrinkage=0.1, budget_ms=50.0,
+                 model=None, model_path=None, name='UnicornPredictions', source_id='unicorn_predictions',
+                 publish=True):
+        self.classes = dict(classes)
+        self.repetitions = repetitions
+        self.settle_seconds = settle_seconds
+        self.shrinkage = shrinkage
+        self.budget = budget_ms / 1000.0
+        self.model_path = model_path
+        # Windows the participant's earlier sessions calibrated other classes on.
+        self.previous_windows = None
+        self.previous_labels = None
+        if model is None and model_path:
+            saved = load_model(model_path)
+            if saved is not None:
+                saved_model, x, y = saved
+                # Protocols give the same codes different meanings, so a class is only known
+                # when its label matches too.
+                saved_classes = dict(zip(saved_model.codes.tolist(), saved_model.labels))
+                if all(saved_classes.get(code) == label for code, label in self.classes.items()):
+                    model = saved_model
+                else:
+                    # A fresh calibration of a class replaces the earlier one.
+                    keep = ~np.isin(y, list(self.classes))
+                    self.previous_windows, self.previous_labels = x[keep], y[keep]
+                for code, label in zip(saved_model.codes.tolist(), saved_model.labels):
+                    self.classes.setdefault(code, label)
+        self.model = model
+        if model is not None:
+            self.codes = model.codes.tolist()
+        else:
+            known = set(classes) | set(() if self.previous_labels is None else self.previous_labels.tolist())
+            self.codes = sorted(known)
+        self.extractor = None
+        self.clock = time.perf_counter
+        self.settle_windows = 0
+        # Calibration windows and completed instructions per class of this session.
+        self.windows = []
+        self.labels = []
+        self.runs = {code: 0 for code in classes}
+        self.current_code = None
+        self.run_length = 0
+        self.latest = None
+        self.predictions = 0
+        self.skipped = 0
+        self.evaluated = 0
+        self.correct = 0
+        self.error = None
+        # Time per classified block, and delay from a window's last sample to its prediction.
+        self.predict_us = Histogram()
+        self.latency_us = Histogram()
+        self.outlet = None
+        if publish:
+            labels = ['code', 'probability'] + [f"p {self.classes.get(code, code)}" for code in self.codes]
+            info = StreamInfo(name, 'Classifier', len(labels), 0, 'float32', source_id)
+            desc = info.desc()
+            desc.append_child_value('budget_ms', str(budget_ms))
+            chns = desc.append_child('channels')
+            for label in labels:
+                chns.append_child('channel').append_child_value('label', label)
+            self.outlet = StreamOutlet(info)
+
+    @property
+    def calibrated(self):
+        return self.model is not None
+
+    def attach(self, extractor):
+        self.extractor = extractor
+        engine = extractor.engine
+        self.clock = engine.clock
+        self.settle_windows = int(np.ceil(self.settle_seconds * extractor.sampling_rate / extractor.hop))
+        engine.telemetry.add('classifier_us', self.predict_us)
+        engine.telemetry.add('prediction_latency_us', self.latency_us)
+        extractor.add_listener(self.handle)
+
+    def detach(self):
+        if self.extractor is not None:
+            self.extractor.remove_listener(self.handle)
+            self.extractor = None
+
+    def handle(self, features, timestamps, codes):
+        settled = self._track(codes)
+        if self.model is None:
+            self._calibrate(features[settled], codes[settled])
+            return
+        started = time.perf_counter()
+        # Always classify the newest window; older ones only while still within the budget.
+        fresh = self.clock() - timestamps <= self.budget
+        fresh[-1] = True
+        self.skipped += len(fresh) - int(fresh.sum())
+        probabilities = self.model.predict_proba(feature_vectors(features[fresh]))
+        best = probabilities.argmax(axis=1)
+        predicted = self.model.codes[best]
+        confidence = probabilities[np.arange(len(best)), best]
+        if self.outlet is not None:
+            # The stream has no nominal rate, so every prediction carries its own timestamp.
+            chunk = np.column_stack((predicted, confidence, probabilities)).astype(np.float32)
+            self.outlet.push_chunk(chunk, timestamps[fresh].tolist())
+        done = self.clock()
+        self.predict_us.record(1e6 * (time.perf_counter() - started))
+        for latency in (done - timestamps[fresh]).tolist():
+            self.latency_us.record(1e6 * latency)
+        # Online accuracy against the instructions, on settled windows only.
+        scored = settled[fresh]
+        self.evaluated += int(scored.sum())
+        self.correct += int((predicted[scored] == codes[fresh][scored]).sum())
+        self.predictions += len(predicted)
+        self.latest = (int(predicted[-1]), self.model.labels[best[-1]], float(confidence[-1]))
+
+    def status(self):
+        # One-line state for a UI status bar.
+        if self.error is not None:
+            return f"classifier failed: {self.error}"
+        if self.model is None:
+            done = sum(min(runs, self.repetitions) for runs in self.runs.values())
+            return f"calibrating {done}/{self.repetitions * len(self.runs)}"
+        if self.latest is None:
+            return "calibrated"
+        return f"{self.latest[1]} {100 * self.latest[2]:.0f}%"
+
+    def stats(self):
+        stats = {
+            'calibrated': self.calibrated,
+            'calibration_windows': len(self.labels),
+            'predictions': self.predictions,
+            'skipped': self.skipped,
+            'accuracy': self.correct / self.evaluated if self.evaluated else None,
+            'classify_us': self.predict_us.summary(),
+            'latency_us': self.latency_us.summary(),
+        }
+        if self.error is not None:
+            stats['error'] = str(self.error)
+        return stats
+
+    def _track(self, codes):
+        # Marks the windows past the settling time of a known class, counting finished instructions.
+        settled = np.zeros(len(codes), dtype=bool)
+        for i, code in enumerate(codes.tolist()):
+            if code != self.current_code:
+                if self.current_code in self.runs and self.run_length > self.settle_windows:
+                    self.runs[self.current_code] += 1
+                self.current_code = code
+                self.run_length = 0
+            self.run_length += 1
+            settled[i] = code in self.runs and self.run_length > self.settle_windows
+        return settled
+
+    def _calibrate(self, features, codes):
+        if self.error is not None:
+            return
+        if len(codes):
+            self.windows.append(feature_vectors(features))
+            self.labels.extend(codes.tolist())
+        if min(self.runs.values()) < self.repetitions:
+            return
+        try:
+            x = np.concatenate(self.windows)
+            y = np.array(self.labels)
+            if self.previous_labels is not None and len(self.previous_labels):
+                x = np.concatenate((self.previous_windows, x))
+                y = np.concatenate((self.previous_labels, y))
+            self.model = LDAModel.fit(x, y, self.classes, self.shrinkage)
+            if self.model_path:
+                self.model.save(self.model_path, x, y)
+        except Exception as e:
+            # Acquisition carries on; the session simply has no live predictions, and stops
+            # collecting windows it will not use.
+            self.error = e
+            self.model = None
+            self.windows = []
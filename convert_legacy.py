@@ -0,0 +1,190 @@
+"""Converts legacy np.savetxt CSV recordings to the binary .semg format.
+
+    python convert_legacy.py Data --jobs 8 --epochs
+
+Files are converted in parallel, one per worker process, and parsed in fixed-size chunks so
+memory stays bounded for any file size. A last row cut short by a crash is dropped. V2 files
+(17 channels plus the event code column) keep their event column and get an events sidecar
+with one marker per instruction block, so the catalog can cut per-instruction epochs.
+--epochs additionally saves every block as its own .npy file.
+"""
+import argparse
+import csv
+import itertools
+import os
+import re
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from acquisition import UNICORN_CHANNELS
+from catalog import Catalog
+from markers import EVENTS_COLUMNS, events_path
+from recording import EXTENSION, RecordingWriter, load_recording, read_header
+
+# Trial files of both study UIs: <participant>_<expression>_<trial>.csv
+TRIAL_NAME = re.compile(r'^(?P<participant>.+)_(?P<expression>Smile|Frown)_(?P<trial>\d+)\.csv$')
+
+# Labels of the V2 event codes, matching the markers the V2 UI now writes.
+V2_LABELS = {
+    0: 'Relax Face (Neutral)',
+    1: 'Smile Weak (30%)', 2: 'Smile Medium (60%)', 3: 'Smile Strong (100%)',
+    4: 'Frown Weak (30%)', 5: 'Frown Medium (60%)', 6: 'Frown Strong (100%)',
+}
+
+
+def parse_lines(lines):
+    # Splitting the joined text once is much faster than np.loadtxt's per-row parsing.
+    text = ''.join(lines).replace(',', ' ')
+    values = np.array(text.split(), dtype=np.float32)
+    return values.reshape(len(lines), -1)
+
+
+def find_legacy_files(root):
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            if name.endswith('.csv') and not name.endswith('.events.csv'):
+                yield os.path.join(directory, name)
+
+
+def converted_from(output, path):
+    # True if `output` was written by this converter from `path`. Native recordings, and the
+    # CSVs exported from them, must never be replaced by data parsed back from %.3f text.
+    try:
+        return read_header(output).get('source') == os.path.basename(path)
+    except (OSError, ValueError, struct.error):
+        return False
+
+
+def convert_file(path, sampling_rate=250, chunk_lines=20000, overwrite=False, epochs=False):
+    output = os.path.splitext(path)[0] + EXTENSION
+    if os.path.exists(output) and not (overwrite and converted_from(output, path)):
+        return path, None, 0, 0
+    match = TRIAL_NAME.match(os.path.basename(path))
+    metadata = {'source': os.path.basename(path)}
+    if match:
+        metadata.update(participant=match['participant'], expression=match['expression'], trial=int(match['trial']))
+
+    writer = None
+    columns = None
+    markers = []
+    samples = 0
+    last_code = None
+    temporary = output + '.partial'
+    try:
+        with open(path) as f:
+            while True:
+                lines = list(itertools.islice(f, chunk_lines))
+                lines = [line for line in lines if line.strip()]
+                if not lines:
+                    break
+                if columns is None:
+                    columns = lines[0].count(',') + 1
+                if not lines[-1].endswith('\n') and lines[-1].count(',') + 1 != columns:
+                    # Rows were written one at a time, so a session that crashed usually ends
+                    # in a row cut short; everything before it is intact.
+                    print(f"{path}: dropped the incomplete last row ({lines[-1].count(',') + 1} of {columns} values)")
+                    lines.pop()
+                    if not lines:
+                        break
+                block = parse_lines(lines)
+                if writer is None:
+                    channels = block.shape[1]
+                    event_column = channels == len(UNICORN_CHANNELS) + 1
+                    names = channel_names(channels - event_column)
+                    # Partial outputs are discarded on failure anyway, so no fsync or journal.
+                    writer = RecordingWriter(temporary, sampling_rate, names, event_column, block_samples=chunk_lines,
+                                             sync_every=0, **metadata)
+                if event_column:
+                    codes = block[:, -1].astype(np.int32)
+                    changes = np.flatnonzero(np.diff(codes, prepend=np.int32(-2 if last_code is None else last_code)))
+                    markers.extend((samples + int(i), int(codes[i])) for i in changes)
+                    last_code = codes[-1]
+                    writer.write(block[:, :-1], codes)
+                else:
+                    writer.write(block)
+                samples += len(block)
+    except Exception:
+        if writer is not None:
+            writer.close()
+            os.remove(temporary)
+        raise
+    if writer is None:
+        return path, None, 0, 0
+    writer.close()
+    os.replace(temporary, output)
+    if markers:
+        write_events(output, markers)
+        if epochs:
+            save_epochs(output, markers, samples)
+    return path, output, os.path.getsize(path), samples
+
+
+def channel_names(count):
+    return UNICORN_CHANNELS[:count] + [f'Channel {i + 1}' for i in range(len(UNICORN_CHANNELS), count)]
+
+
+def write_events(output, markers):
+    # Legacy files carry no LSL clock, so the marker times are left empty (NaN).
+    with open(events_path(output), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EVENTS_COLUMNS)
+        for sample_index, code in markers:
+            writer.writerow((sample_index, 'nan', code, V2_LABELS.get(code, '')))
+
+
+def save_epochs(output, markers, samples):
+    data, header = load_recording(output)
+    directory = os.path.join(os.path.dirname(output), 'epochs')
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(output))[0]
+    ends = [start for start, _ in markers[1:]] + [samples]
+    for number, ((start, code), end) in enumerate(zip(markers, ends), 1):
+        np.save(os.path.join(directory, f"{stem}_epoch{number:02d}_code{code}.npy"), data[start:end])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert legacy CSV recordings to the binary format.")
+    parser.add_argument('root', nargs='?', default='Data', help="folder searched recursively for .csv files")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--chunk-lines', type=int, default=20000, help="CSV rows parsed per chunk")
+    parser.add_argument('--sampling-rate', type=float, default=250)
+    parser.add_argument('--overwrite', action='store_true',
+                        help="reconvert .semg files converted earlier; native recordings are never replaced")
+    parser.add_argument('--epochs', action='store_true', help="also save every instruction block as .npy")
+    parser.add_argument('--no-catalog', action='store_true', help="do not update the recording catalog")
+    args = parser.parse_args()
+
+    files = list(find_legacy_files(args.root))
+    started = time.perf_counter()
+    converted = 0
+    input_bytes = 0
+    total_samples = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = {pool.submit(convert_file, path, args.sampling_rate, args.chunk_lines, args.overwrite, args.epochs): path
+                   for path in files}
+        for future in as_completed(futures):
+            try:
+                path, output, size, samples = future.result()
+            except Exception as e:
+                print(f"Failed to convert {futures[future]}: {e}")
+                continue
+            if output is None:
+                continue
+            converted += 1
+            input_bytes += size
+            total_samples += samples
+            print(f"{path} -> {output} ({samples} samples)")
+    elapsed = time.perf_counter() - started
+
+    if converted and not args.no_catalog:
+        catalog = Catalog(args.root)
+        catalog.scan()
+        catalog.close()
+    print(f"Converted {converted} of {len(files)} files, {input_bytes / 1e6:.1f} MB, {total_samples} samples "
+          f"in {elapsed:.1f} s: {input_bytes / 1e6 / elapsed if elapsed else 0:.1f} MB/s, "
+          f"{converted / elapsed if elapsed else 0:.1f} files/s")
+
+
+if __name__ == "__main__":
+    main()
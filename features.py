@@ -0,0 +1,152 @@
+import time
+import numpy as np
+from scipy import signal
+from pylsl import StreamInfo, StreamOutlet
+from acquisition import get_channel_names
+
+FEATURES = ('RMS', 'MAV', 'ZC')
+
+
+def design_filter(sampling_rate, band=(20.0, 120.0), notch_freqs=(50.0, 100.0), order=4, notch_quality=30.0):
+    # Causal band-pass plus mains notches as one second-order-sections cascade.
+    sections = [signal.butter(order, band, btype='bandpass', fs=sampling_rate, output='sos')]
+    for freq in notch_freqs:
+        if band[0] < freq < min(band[1], sampling_rate / 2):
+            b, a = signal.iirnotch(freq, notch_quality, fs=sampling_rate)
+            sections.append(signal.tf2sos(b, a))
+    return np.vstack(sections)
+
+
+class SlidingFeatures:
+    """Sliding-window RMS, MAV and zero-crossing count for all channels at once.
+
+    Running sums are updated with what enters and leaves the window, so each sample costs O(1)
+    regardless of the window length, and a whole block is handled with a few array operations.
+    """
+
+    def __init__(self, num_channels, window, hop, zc_threshold=0.0):
+        self.window = window
+        self.hop = hop
+        self.zc_threshold = zc_threshold
+        # Per-sample contributions of the last `window` samples: squared, absolute, crossing.
+        self.history = np.zeros((3, window, num_channels))
+        self.position = 0
+        self.sums = np.zeros((3, num_channels))
+        self.seen = 0
+        self.previous = np.zeros(num_channels)
+        self.until_hop = hop
+
+    def update(self, x):
+        """Adds a (samples, channels) block; returns (offsets, features) for every hop in it.
+
+        `offsets` are the block rows at which a window ended and `features` has shape
+        (hops, 3, channels) in FEATURES order.
+        """
+        n = len(x)
+        window = self.window
+        shifted = np.vstack((self.previous[None, :], x[:-1]))
+        crossing = (np.sign(x) != np.sign(shifted)) & (np.abs(x - shifted) >= self.zc_threshold)
+        added = np.stack((x * x, np.abs(x), crossing))
+        self.previous = x[-1].copy()
+
+        m = min(n, window)
+        slots = (self.position + np.arange(m)) % window
+        removed = self.history[:, slots]
+        if n > window:
+            removed = np.concatenate((removed, added[:, :n - window]), axis=1)
+        running = self.sums[:, None, :] + np.cumsum(added - removed, axis=1)
+        tail = (self.position + np.arange(n - m, n)) % window
+        self.history[:, tail] = added[:, n - m:]
+        self.position = (self.position + n) % window
+        self.sums = running[:, -1]
+
+        offsets = np.arange(self.until_hop - 1, n, self.hop)
+        self.until_hop = self.hop - (n - self.until_hop) % self.hop if len(offsets) else self.until_hop - n
+        counts = np.minimum(self.seen + offsets + 1, window)[:, None]
+        self.seen += n
+        at = running[:, offsets]
+        features = np.empty((len(offsets), 3, x.shape[1]))
+        features[:, 0] = np.sqrt(np.maximum(at[0], 0.0) / counts)
+        features[:, 1] = np.maximum(at[1], 0.0) / counts
+        features[:, 2] = np.round(at[2])
+        return offsets, features
+
+
+class FeatureExtractor:
+    """Engine consumer that filters the sEMG channels and publishes windowed features on LSL.
+
+    Filter state persists across blocks; `attach` connects it to the engine of each session and
+    resets it, like LSLPublisher.
+    """
+
+    def __init__(self, device, sampling_rate, channels=range(8), window_seconds=0.2, hop_seconds=0.05,
+                 band=(20.0, 120.0), notch_freqs=(50.0, 100.0), name='UnicornFeatures',
+                 source_id='unicorn_features', publish=True):
+        self.sampling_rate = sampling_rate
+        self.channels = list(channels)
+        self.window = max(1, int(round(window_seconds * sampling_rate)))
+        self.hop = max(1, int(round(hop_seconds * sampling_rate)))
+        self.sos = design_filter(sampling_rate, band, notch_freqs)
+        self.engine = None
+        self.latest = None
+        self.blocks = 0
+        self.samples = 0
+        self.busy_seconds = 0.0
+        self.listeners = []
+        self.outlet = None
+        if publish:
+            names = get_channel_names(device)
+            labels = [f"{names[c]} {feature}" for c in self.channels for feature in FEATURES]
+            info = StreamInfo(name, 'Features', len(labels), sampling_rate / self.hop, 'float32', source_id)
+            desc = info.desc()
+            desc.append_child_value('window_samples', str(self.window))
+            desc.append_child_value('hop_samples', str(self.hop))
+            desc.append_child_value('band', f"{band[0]}-{band[1]} Hz")
+            chns = desc.append_child('channels')
+            for label in labels:
+                chns.append_child('channel').append_child_value('label', label)
+            self.outlet = StreamOutlet(info)
+        self.reset()
+
+    def reset(self):
+        self.zi = np.zeros((self.sos.shape[0], 2, len(self.channels)))
+        self.sliding = SlidingFeatures(len(self.channels), self.window, self.hop)
+
+    def attach(self, engine):
+        self.engine = engine
+        self.reset()
+        engine.add_consumer(self.handle, 'features')
+
+    def add_listener(self, callback):
+        # callback(features, timestamps, codes) with features shaped (hops, len(FEATURES), channels)
+        # and the event code of the last sample of every window.
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        self.listeners.remove(callback)
+
+    def handle(self, data, codes, first_sample):
+        started = time.perf_counter()
+        filtered, self.zi = signal.sosfilt(self.sos, data[:, self.channels], axis=0, zi=self.zi)
+        offsets, features = self.sliding.update(filtered)
+        if len(offsets):
+            self.latest = features[-1]
+            timestamps = self.engine.ring.times[(first_sample + offsets) % self.engine.ring.capacity]
+            if self.outlet is not None:
+                # Channel-major layout: all features of a channel next to each other.
+                chunk = features.transpose(0, 2, 1).reshape(len(offsets), -1).astype(np.float32)
+                self.outlet.push_chunk(chunk, float(timestamps[-1]))
+            for callback in self.listeners:
+                callback(features, timestamps, codes[offsets])
+        self.blocks += 1
+        self.samples += len(data)
+        self.busy_seconds += time.perf_counter() - started
+
+    def stats(self):
+        # cpu_fraction is processing time relative to the duration of the processed signal.
+        duration = self.samples / self.sampling_rate
+        return {
+            'blocks': self.blocks,
+            'mean_block_us': 1e6 * self.busy_seconds / self.blocks if self.blocks else 0.0,
+            'cpu_fraction': self.busy_seconds / duration if duration else 0.0,
+        }
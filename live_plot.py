@@ -0,0 +1,121 @@
+import time
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
+
+def minmax_envelope(data, bins):
+    """Reduces (samples, channels) to an interleaved min/max envelope of 2 * bins points.
+
+    Drawing the envelope keeps spikes and saturation visible while the number of vertices only
+    depends on the screen width, not on the window length.
+    """
+    samples = len(data)
+    bins = max(1, min(bins, samples))
+    per_bin = samples // bins
+    data = data[samples - bins * per_bin:].reshape(bins, per_bin, -1)
+    envelope = np.empty((2 * bins, data.shape[2]), dtype=data.dtype)
+    envelope[0::2] = data.min(axis=1)
+    envelope[1::2] = data.max(axis=1)
+    return envelope
+
+
+class LivePlot:
+    """Multi-channel signal view for the Tk UIs, refreshed from the engine's ring buffer.
+
+    The plot runs on the Tk thread and only copies the newest samples out of the ring, so the
+    acquisition thread never waits on drawing. Frames are blitted at up to `max_fps`, and the
+    refresh interval stretches whenever drawing would take more than `cpu_budget` of the time.
+    """
+
+    def __init__(self, master, sampling_rate, channel_names, channels=range(8), seconds=5.0,
+                 max_fps=20, cpu_budget=0.1, microvolts_per_division=200.0):
+        self.master = master
+        self.sampling_rate = sampling_rate
+        self.channels = list(channels)
+        self.samples = int(seconds * sampling_rate)
+        self.max_fps = max_fps
+        self.cpu_budget = cpu_budget
+        self.scale = microvolts_per_division
+        self.engine = None
+        self.job = None
+        self.background = None
+        self.frames = 0
+        self.draw_seconds = 0.0
+        self.average_draw = 0.0
+        self.started_at = None
+
+        self.figure = Figure(figsize=(6, 4), dpi=100)
+        self.axes = self.figure.add_subplot(111)
+        self.axes.set_xlim(0, 1)
+        self.axes.set_ylim(-1, len(self.channels))
+        self.axes.set_yticks(range(len(self.channels)))
+        self.axes.set_yticklabels([channel_names[c] for c in self.channels])
+        self.axes.set_xticks([])
+        self.lines = [self.axes.plot([], [], lw=0.8, color='tab:blue', animated=True)[0] for _ in self.channels]
+        self.canvas = FigureCanvasTkAgg(self.figure, master=master)
+        self.widget = self.canvas.get_tk_widget()
+        self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    def attach(self, engine):
+        self.engine = engine
+        self.frames = 0
+        self.draw_seconds = 0.0
+        self.started_at = time.perf_counter()
+        if self.job is None:
+            self.job = self.master.after(int(1000 / self.max_fps), self._refresh)
+
+    def detach(self):
+        if self.job is not None:
+            self.master.after_cancel(self.job)
+            self.job = None
+        self.engine = None
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started_at if self.started_at else 0.0
+        return {
+            'frames': self.frames,
+            'fps': self.frames / elapsed if elapsed else 0.0,
+            'mean_draw_ms': 1000.0 * self.draw_seconds / self.frames if self.frames else 0.0,
+            'cpu_fraction': self.draw_seconds / elapsed if elapsed else 0.0,
+        }
+
+    def _on_draw(self, event):
+        # Full redraws (resize, first show) refresh the cached background used for blitting.
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        for line in self.lines:
+            self.axes.draw_artist(line)
+
+    def _refresh(self):
+        started = time.perf_counter()
+        if self.engine is not None and self.background is not None:
+            self._draw_frame()
+            self.frames += 1
+        elapsed = time.perf_counter() - started
+        self.draw_seconds += elapsed
+        self.average_draw = 0.9 * self.average_draw + 0.1 * elapsed
+        # Cap the frame rate, and stretch the interval so drawing stays within the CPU budget.
+        interval = max(1.0 / self.max_fps, self.average_draw / self.cpu_budget)
+        self.job = self.master.after(max(1, int(1000 * interval)), self._refresh)
+
+    def _draw_frame(self):
+        ring = self.engine.ring
+        end = ring.write_index
+        count = min(end, self.samples, ring.capacity)
+        if count < 2:
+            return
+        data, codes = ring.read(end - count, count)
+        data = data[:, self.channels]
+        envelope = minmax_envelope(data, max(1, self.widget.winfo_width()))
+        x = np.linspace(0, count / self.samples, len(envelope))
+        envelope = envelope - data.mean(axis=0)
+        flat = data.std(axis=0) < 0.1
+        for i, line in enumerate(self.lines):
+            line.set_data(x, i + np.clip(envelope[:, i] / (2 * self.scale), -0.5, 0.5))
+            # Red for a flat line (no contact) or a trace beyond the display range (saturation).
+            clipped = np.abs(envelope[:, i]).max() > self.scale
+            line.set_color('tab:red' if flat[i] or clipped else 'tab:blue')
+        self.canvas.restore_region(self.background)
+        for line in self.lines:
+            self.axes.draw_artist(line)
+        self.canvas.blit(self.axes.bbox)
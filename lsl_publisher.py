@@ -0,0 +1,113 @@
+import time
+import numpy as np
+from pylsl import StreamInfo, StreamOutlet
+from acquisition import get_channel_names, get_channel_units
+from recording import EVENT_COLUMN
+from telemetry import Histogram
+
+
+def build_stream_info(device, name, stream_type, sampling_rate, source_id, serial=None, event_column=False):
+    # Stream metadata derived from the device configuration instead of hard-coded channel counts.
+    labels = get_channel_names(device)
+    units = get_channel_units(device)
+    if event_column:
+        labels.append(EVENT_COLUMN)
+        units.append('')
+    info = StreamInfo(name, stream_type, len(labels), sampling_rate, 'float32', source_id)
+    desc = info.desc()
+    desc.append_child_value('manufacturer', 'g.tec')
+    desc.append_child_value('model', 'Unicorn Hybrid Black')
+    if serial:
+        desc.append_child_value('serial', serial)
+    channels = desc.append_child('channels')
+    for label, unit in zip(labels, units):
+        channel = channels.append_child('channel')
+        channel.append_child_value('label', label)
+        channel.append_child_value('unit', unit)
+        channel.append_child_value('type', stream_type if label.startswith('EEG') else 'AUX')
+    return info
+
+
+class LSLPublisher:
+    """Engine consumer that streams sample blocks to LSL as float32 NumPy chunks.
+
+    The outlet lives as long as the device connection; `attach` hooks it up to the engine of
+    each session. Samples are collected in a preallocated block of `chunk_size` rows and pushed
+    in one call, timestamped with the sample clock of the last row. A chunk_size of 0 pushes
+    whatever each drain of the ring returns.
+    """
+
+    def __init__(self, device, sampling_rate, name, stream_type, source_id, serial=None,
+                 event_column=False, chunk_size=8, max_buffered=360):
+        self.engine = None
+        self.event_column = event_column
+        info = build_stream_info(device, name, stream_type, sampling_rate, source_id, serial, event_column)
+        self.num_columns = info.channel_count()
+        self.outlet = StreamOutlet(info, chunk_size, max_buffered)
+        self.chunk_size = chunk_size
+        self.block = np.zeros((max(chunk_size, 1), self.num_columns), dtype=np.float32)
+        self.reset()
+
+    def reset(self):
+        # Drops a partial chunk and restarts the statistics, which cover one session.
+        self.pending = 0
+        self.last_pending_sample = None
+        self.chunks_pushed = 0
+        self.push_seconds = 0.0
+        self.max_push_seconds = 0.0
+        self.push_us = Histogram()
+
+    def attach(self, engine):
+        self.engine = engine
+        self.reset()
+        engine.add_consumer(self.handle, 'lsl-publisher')
+        engine.telemetry.add('lsl_push_us', self.push_us)
+
+    def handle(self, data, codes, first_sample):
+        if self.chunk_size <= 0:
+            block = self._columns(data, codes)
+            self._push(block, first_sample + len(data) - 1)
+            return
+        offset = 0
+        while offset < len(data):
+            count = min(self.chunk_size - self.pending, len(data) - offset)
+            rows = self.block[self.pending:self.pending + count]
+            rows[:, :data.shape[1]] = data[offset:offset + count]
+            if self.event_column:
+                rows[:, -1] = codes[offset:offset + count]
+            self.pending += count
+            offset += count
+            self.last_pending_sample = first_sample + offset - 1
+            if self.pending == self.chunk_size:
+                self._push(self.block, self.last_pending_sample)
+                self.pending = 0
+
+    def flush(self):
+        # Pushes a partially filled chunk, e.g. at the end of a session.
+        if self.pending:
+            self._push(self.block[:self.pending], self.last_pending_sample)
+            self.pending = 0
+
+    def stats(self):
+        return {
+            'chunks_pushed': self.chunks_pushed,
+            'mean_push_us': 1e6 * self.push_seconds / self.chunks_pushed if self.chunks_pushed else 0.0,
+            'max_push_us': 1e6 * self.max_push_seconds,
+        }
+
+    def _columns(self, data, codes):
+        if not self.event_column:
+            return data
+        block = np.empty((len(data), self.num_columns), dtype=np.float32)
+        block[:, :-1] = data
+        block[:, -1] = codes
+        return block
+
+    def _push(self, block, last_sample):
+        started = time.perf_counter()
+        self.outlet.push_chunk(block, self.engine.sample_time(last_sample))
+        elapsed = time.perf_counter() - started
+        self.chunks_pushed += 1
+        self.push_seconds += elapsed
+        self.max_push_seconds = max(self.max_push_seconds, elapsed)
+        self.push_us.record(1e6 * elapsed)
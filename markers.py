@@ -0,0 +1,120 @@
+import collections
+import csv
+import os
+import numpy as np
+
+EVENTS_SUFFIX = '.events.csv'
+EVENTS_COLUMNS = ['sample_index', 'lsl_time', 'event_code', 'label']
+
+# Event codes of audio cue onsets and of marks added by the experimenter during a session. They
+# mark a moment inside an instruction block rather than the start of one, so epoching skips
+# them when looking for where a block ends.
+CUE_EVENT = 100
+MANUAL_EVENT = 101
+MOMENT_EVENTS = (CUE_EVENT, MANUAL_EVENT)
+
+
+def events_path(recording_path):
+    # Sidecar file holding the markers of a recording.
+    return os.path.splitext(recording_path)[0] + EVENTS_SUFFIX
+
+
+def load_events(recording_path):
+    # Returns the markers of a recording as (sample_index, lsl_time, event_code, label) tuples.
+    with open(events_path(recording_path), newline='') as f:
+        return [(int(row['sample_index']), float(row['lsl_time']), int(row['event_code']), row['label'])
+                for row in csv.DictReader(f)]
+
+
+def truncate_events(recording_path, samples):
+    # Drops markers past the end of a recovered recording; returns the markers kept.
+    path = events_path(recording_path)
+    if not os.path.exists(path):
+        return []
+    markers = [marker for marker in load_events(recording_path) if marker[0] < samples]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EVENTS_COLUMNS)
+        for sample_index, timestamp, event_code, label in markers:
+            writer.writerow((sample_index, f"{timestamp:.6f}", event_code, label))
+    return markers
+
+
+class MarkerStream:
+    """Emits one marker per event of an acquisition engine, i.e. per instruction it tags.
+
+    Runs as an engine consumer, so markers leave in step with the data they belong to and never
+    touch the reader thread. Each marker is pushed to the LSL outlet with the timestamp of the
+    sample where the event starts and appended to the recording's sidecar events file,
+    indexed by sample relative to the first recorded sample.
+
+    Markers for moments known only by their clock time, such as audio cue onsets, are added
+    with `add_timed_marker` from any thread and placed on the first sample at or after it.
+
+    `resume_from` continues the sidecar of a resumed recording, whose first `resume_from`
+    samples were kept; new markers are indexed after them.
+    """
+
+    def __init__(self, engine, recording_path=None, outlet=None, resume_from=None):
+        self.engine = engine
+        self.outlet = outlet
+        self.markers = []
+        self.next_event = len(engine.events)
+        self.timed = collections.deque()
+        self.first_sample = None
+        self.sample_offset = resume_from or 0
+        self.file = None
+        self.writer = None
+        if recording_path is not None:
+            if resume_from is not None:
+                truncate_events(recording_path, resume_from)
+            self.file = open(events_path(recording_path), 'a' if resume_from is not None else 'w', newline='')
+            self.writer = csv.writer(self.file)
+            if resume_from is None:
+                self.writer.writerow(EVENTS_COLUMNS)
+        engine.add_consumer(self.handle, 'markers')
+
+    def add_timed_marker(self, timestamp, event_code=CUE_EVENT, label=None):
+        # Only appends to a deque, so it is safe to call from an audio callback.
+        self.timed.append((timestamp, event_code, label))
+
+    def add_cue_marker(self, timestamp, name, requested_at=None):
+        # Signature of CuePlayer.onset_callback.
+        self.add_timed_marker(timestamp, CUE_EVENT, f"cue {name}")
+
+    def handle(self, data, codes, first_sample):
+        if self.first_sample is None:
+            self.first_sample = first_sample
+        end = first_sample + len(data)
+        pending = []
+        events = self.engine.events
+        while self.next_event < len(events) and events[self.next_event][0] < end:
+            sample_index, event_code, label = events[self.next_event]
+            self.next_event += 1
+            if sample_index >= self.first_sample:
+                pending.append((sample_index, self.engine.sample_time(sample_index), event_code, label))
+        last_time = self.engine.sample_time(end - 1)
+        while self.timed and self.timed[0][0] <= last_time:
+            timestamp, event_code, label = self.timed.popleft()
+            pending.append((self._sample_at(timestamp, end), timestamp, event_code, label))
+        for sample_index, timestamp, event_code, label in sorted(pending, key=lambda marker: marker[0]):
+            marker = (sample_index - self.first_sample + self.sample_offset, timestamp, int(event_code), label or '')
+            self.markers.append(marker)
+            if self.outlet is not None:
+                self.outlet.push_sample([marker[2]], timestamp)
+            if self.writer is not None:
+                self.writer.writerow((marker[0], f"{timestamp:.6f}", marker[2], marker[3]))
+        if pending and self.file is not None:
+            self.file.flush()
+
+    def _sample_at(self, timestamp, end):
+        # First sample still in the ring whose clock time is at or after `timestamp`.
+        ring = self.engine.ring
+        start = max(self.first_sample, end - ring.capacity)
+        times = ring.times[np.arange(start, end) % ring.capacity]
+        return start + min(int(np.searchsorted(times, timestamp)), end - start - 1)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
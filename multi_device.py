@@ -0,0 +1,243 @@
+"""Records several Unicorn headsets at once on a shared clock.
+
+    python multi_device.py --duration 60 --lsl
+
+Every paired headset (or those given with --devices) gets its own AcquisitionEngine, so each
+has a dedicated reader thread and none can hold up another's FIFO. All engines timestamp
+their samples with the LSL clock, and a linear fit of those timestamps against each device's
+sample counter gives its effective sampling rate and the clock time of its first sample. The
+fits are saved next to the recordings, so the per-device files can be put on one time axis
+offline, and the drift between headsets is reported in parts per million.
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+import numpy as np
+from pylsl import local_clock
+from acquisition import AcquisitionEngine, COUNTER_CHANNEL, get_channel_names
+from lsl_publisher import LSLPublisher
+from recording import EXTENSION, RecordingWriter
+
+if os.environ.get("UNICORN_SIMULATOR"):
+    import UnicornPySim as UnicornPy
+else:
+    import UnicornPy
+
+
+class ClockFit:
+    """Running least-squares fit of sample timestamps against the device sample counter.
+
+    Only five sums are kept, so the fit costs O(1) memory however long the recording is.
+    Counters and times are taken relative to the first sample to keep the sums well conditioned.
+    """
+
+    def __init__(self, counter_channel=COUNTER_CHANNEL):
+        self.counter_channel = counter_channel
+        self.origin = None
+        self.n = 0
+        self.sx = self.sy = self.sxx = self.sxy = self.syy = 0.0
+
+    def handle(self, data, times):
+        counters = data[:, self.counter_channel].astype(np.float64)
+        if self.origin is None:
+            self.origin = (counters[0], times[0])
+        x = counters - self.origin[0]
+        y = times - self.origin[1]
+        self.n += len(x)
+        self.sx += x.sum()
+        self.sy += y.sum()
+        self.sxx += x @ x
+        self.sxy += x @ y
+        self.syy += y @ y
+
+    def result(self):
+        # seconds_per_sample and first_sample_time map a counter value c to the shared clock as
+        # first_sample_time + (c - first_counter) * seconds_per_sample.
+        if self.n < 2:
+            return None
+        sxx = self.sxx - self.sx * self.sx / self.n
+        sxy = self.sxy - self.sx * self.sy / self.n
+        syy = self.syy - self.sy * self.sy / self.n
+        if sxx <= 0:
+            return None
+        slope = sxy / sxx
+        intercept = (self.sy - slope * self.sx) / self.n
+        residual = max(0.0, syy - slope * sxy) / self.n
+        return {
+            'first_counter': int(self.origin[0]),
+            'first_sample_time': self.origin[1] + intercept,
+            'seconds_per_sample': slope,
+            'effective_sampling_rate': 1.0 / slope,
+            'timestamp_jitter_ms': 1000.0 * residual ** 0.5,
+        }
+
+
+class DeviceRecorder:
+    # One headset: its engine, recording file, optional LSL stream and clock fit.
+
+    def __init__(self, serial, path, sampling_rate, frame_length, buffer_seconds, lsl, lsl_chunk_size):
+        self.serial = serial
+        self.path = path
+        self.device = UnicornPy.Unicorn(serial)
+        self.sampling_rate = sampling_rate
+        self.engine = AcquisitionEngine(self.device, sampling_rate, frame_length, buffer_seconds, clock=local_clock)
+        self.file = RecordingWriter(path, sampling_rate, get_channel_names(self.device), device=serial, clock='lsl')
+        self.clock_fit = ClockFit()
+        self.engine.add_consumer(self.write_samples, 'file-writer')
+        self.publisher = None
+        if lsl:
+            source_id = f"unicorn_{serial}"
+            self.publisher = LSLPublisher(self.device, sampling_rate, f"Unicorn {serial}", 'EEG', source_id,
+                                          serial=serial, chunk_size=lsl_chunk_size)
+            self.publisher.attach(self.engine)
+
+    def write_samples(self, data, codes, first_sample):
+        self.file.write(data)
+        ring = self.engine.ring
+        self.clock_fit.handle(data, ring.times[(first_sample + np.arange(len(data))) % ring.capacity])
+
+    def close(self):
+        self.file.close()
+        if self.publisher is not None:
+            self.publisher.flush()
+
+    def stats(self):
+        stats = self.engine.stats()
+        stats['path'] = self.path
+        stats['clock'] = self.clock_fit.result()
+        if stats['clock'] is not None:
+            stats['clock']['drift_ppm'] = 1e6 * (stats['clock']['effective_sampling_rate'] / self.sampling_rate - 1)
+        if self.publisher is not None:
+            stats['lsl'] = self.publisher.stats()
+        if self.engine.error is not None:
+            stats['error'] = str(self.engine.error)
+        return stats
+
+
+class MultiDeviceRecorder:
+    """Acquires from several headsets in parallel and writes one recording per device.
+
+    Files are named <session>_<serial>.semg, and <session>.clock.json holds every device's
+    clock fit plus the drift and start offset of each device relative to the first one.
+    """
+
+    def __init__(self, serials, directory="Data", session=None, sampling_rate=UnicornPy.SamplingRate,
+                 frame_length=1, buffer_seconds=10, lsl=False, lsl_chunk_size=8):
+        if not serials:
+            raise ValueError("No devices to record from.")
+        os.makedirs(directory, exist_ok=True)
+        self.session = session or datetime.datetime.now().strftime("%Y-%m-%d_%H%M%S")
+        self.summary_path = os.path.join(directory, f"{self.session}.clock.json")
+        self.recorders = []
+        try:
+            for serial in serials:
+                path = os.path.join(directory, f"{self.session}_{serial.replace('.', '-')}{EXTENSION}")
+                self.recorders.append(DeviceRecorder(serial, path, sampling_rate, frame_length, buffer_seconds,
+                                                     lsl, lsl_chunk_size))
+        except Exception:
+            self.close()
+            raise
+
+    def start(self, test_signal=False, max_samples=None):
+        # StartAcquisition can take a while on real hardware, so all devices are started at
+        # once instead of one after another; the remaining offset shows up in the clock fits.
+        errors = []
+
+        def start(recorder):
+            try:
+                recorder.engine.start(test_signal, max_samples)
+            except Exception as e:
+                errors.append((recorder.serial, e))
+
+        threads = [threading.Thread(target=start, args=(recorder,)) for recorder in self.recorders]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            self.stop()
+            serial, error = errors[0]
+            raise RuntimeError(f"Could not start {serial}: {error}") from error
+
+    def wait(self, timeout=None):
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        for recorder in self.recorders:
+            recorder.engine.wait(None if deadline is None else max(0.0, deadline - time.perf_counter()))
+
+    def running(self):
+        # False as soon as any device stopped, e.g. because it disconnected.
+        return all(recorder.engine.running for recorder in self.recorders)
+
+    def stop(self):
+        for recorder in self.recorders:
+            recorder.engine.running = False
+        for recorder in self.recorders:
+            recorder.engine.stop()
+
+    def close(self):
+        for recorder in self.recorders:
+            recorder.close()
+
+    def stats(self):
+        devices = {recorder.serial: recorder.stats() for recorder in self.recorders}
+        reference = self.recorders[0].serial
+        reference_clock = devices[reference]['clock']
+        for serial, stats in devices.items():
+            clock = stats['clock']
+            if clock is None or reference_clock is None:
+                continue
+            clock['drift_vs_reference_ppm'] = 1e6 * (clock['effective_sampling_rate']
+                                                     / reference_clock['effective_sampling_rate'] - 1)
+            clock['start_offset_ms'] = 1000.0 * (clock['first_sample_time'] - reference_clock['first_sample_time'])
+        return {'session': self.session, 'reference': reference, 'devices': devices}
+
+    def save_summary(self):
+        stats = self.stats()
+        with open(self.summary_path, 'w') as f:
+            json.dump(stats, f, indent=2)
+        return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record several Unicorn headsets at once.")
+    parser.add_argument('--devices', nargs='*', help="serials to record (default: every paired device)")
+    parser.add_argument('--duration', type=float, default=60.0, help="seconds to record")
+    parser.add_argument('--output', default='Data', help="folder for the recordings")
+    parser.add_argument('--session', help="file name prefix (default: current date and time)")
+    parser.add_argument('--frame-length', type=int, default=1)
+    parser.add_argument('--lsl', action='store_true', help="also stream every device to LSL")
+    parser.add_argument('--lsl-chunk-size', type=int, default=8)
+    parser.add_argument('--test-signal', action='store_true')
+    args = parser.parse_args()
+
+    serials = args.devices or UnicornPy.GetAvailableDevices(True)
+    if not serials:
+        raise SystemExit("No device available. Please pair with a Unicorn first.")
+    print(f"Recording from {', '.join(serials)}")
+    recorder = MultiDeviceRecorder(serials, args.output, args.session, frame_length=args.frame_length,
+                                   lsl=args.lsl, lsl_chunk_size=args.lsl_chunk_size)
+    max_samples = int(args.duration * UnicornPy.SamplingRate)
+    try:
+        recorder.start(args.test_signal, max_samples)
+        while recorder.running():
+            time.sleep(0.1)
+    except KeyboardInterrupt:
+        print("Stopping.")
+    finally:
+        recorder.stop()
+        recorder.close()
+    stats = recorder.save_summary()
+    for serial, device in stats['devices'].items():
+        clock = device['clock'] or {}
+        print(f"{serial}: {device['samples_acquired']} samples, {device['dropped_samples']} dropped, "
+              f"drift {clock.get('drift_vs_reference_ppm', float('nan')):+.1f} ppm, "
+              f"start offset {clock.get('start_offset_ms', float('nan')):+.1f} ms"
+              + (f", error: {device['error']}" if 'error' in device else ""))
+    print(f"Clock fits saved to {recorder.summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""Study protocols loaded from JSON or YAML files and compiled into sample-exact timelines.
+
+A protocol is a tree of steps. A leaf step is one instruction:
+
+    {"label": "{expression} Strong (100%)", "text": "{label} for {seconds} seconds", "seconds": 5,
+     "code": {"Smile": 3, "Frown": 6}, "cue": "{expression}100.m4a", "prepare": 5, "countdown": 3}
+
+`text` is shown during the instruction (default: the label) and `label` is carried by its
+event marker (default: the text). `code` is the event code of the recorded samples, either a
+number or a mapping keyed by the `expression` variable; leaves without a code are shown but
+not tagged. `prepare` seconds of "Prepare for" text and a `countdown` of one-second steps are
+inserted before the instruction. Texts are format strings over the protocol variables plus
+{label}, {seconds}, {text} and, for countdowns, {n}. Missing fields come from "defaults".
+
+A group step has "steps" and may set "repeat", "between" (steps inserted between repetitions)
+and "order": "fixed", "shuffle" (new random order per repetition, seeded) or "rotate" (Latin
+square rotation by the counterbalancing index, so participants see the orders in turn; the UIs
+take it from Catalog.counterbalance, which numbers participants in order of arrival).
+
+`compile_protocol` expands all of this once, before the session starts, into a Timeline of
+absolute sample offsets, so the acquisition reader can tag samples from a precomputed array.
+"""
+import json
+import os
+import random
+import numpy as np
+from acquisition import NO_EVENT
+
+# Folder holding the protocols shipped with the study UIs.
+PROTOCOL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'protocols')
+
+STEP_FIELDS = {'text', 'label', 'seconds', 'code', 'cue', 'prepare', 'prepare_text', 'countdown', 'countdown_text'}
+GROUP_FIELDS = {'steps', 'repeat', 'between', 'order'}
+ORDERS = ('fixed', 'shuffle', 'rotate')
+
+
+class ProtocolError(ValueError):
+    pass
+
+
+class Timeline:
+    """A compiled protocol: one entry per displayed step, in order.
+
+    `starts` and `lengths` are in samples from the start of the session, `codes` holds the
+    event code of every entry (NO_EVENT for unrecorded ones). `texts`, `labels` and `cues` are
+    plain lists indexed like the arrays.
+    """
+
+    def __init__(self, sampling_rate, starts, lengths, codes, texts, labels, cues, name=None):
+        self.sampling_rate = sampling_rate
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.codes = np.asarray(codes, dtype=np.int32)
+        self.texts = list(texts)
+        self.labels = list(labels)
+        self.cues = list(cues)
+        self.name = name
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def total_samples(self):
+        return int(self.starts[-1] + self.lengths[-1]) if len(self) else 0
+
+    @property
+    def duration(self):
+        return self.total_samples / self.sampling_rate
+
+    def recorded(self, index):
+        return self.codes[index] != NO_EVENT
+
+    def seconds(self, index):
+        return self.lengths[index] / self.sampling_rate
+
+    def remaining(self, index):
+        # The entries from `index` on, shifted to start at sample 0, for resuming a session.
+        return Timeline(self.sampling_rate, self.starts[index:] - (self.starts[index] if index < len(self) else 0),
+                        self.lengths[index:], self.codes[index:], self.texts[index:], self.labels[index:],
+                        self.cues[index:], self.name)
+
+    @classmethod
+    def _from_steps(cls, steps, sampling_rate, name=None):
+        # Offsets are rounded from the cumulative time, so rounding never accumulates.
+        ends = np.round(np.cumsum([step['seconds'] for step in steps]) * sampling_rate).astype(np.int64)
+        starts = np.concatenate(([0], ends[:-1])) if len(steps) else ends
+        codes = [NO_EVENT if step.get('code') is None else step['code'] for step in steps]
+        return cls(sampling_rate, starts, ends - starts, codes, [step['text'] for step in steps],
+                   [step.get('label') for step in steps], [step.get('cue') for step in steps], name)
+
+
+def load_protocol(path):
+    # YAML needs PyYAML; JSON protocols work with the standard library alone.
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ProtocolError(f"PyYAML is required to load {path}; install it or use a JSON protocol.")
+            protocol = yaml.safe_load(f)
+        else:
+            protocol = json.load(f)
+    if not isinstance(protocol, dict) or 'steps' not in protocol:
+        raise ProtocolError(f"{path} does not define any protocol steps.")
+    return protocol
+
+
+def compile_protocol(protocol, sampling_rate, variables=None, seed=None, counterbalance=0):
+    """Expands a protocol (a path or a loaded dict) into a Timeline.
+
+    `variables` fill the text templates and select per-expression codes, e.g.
+    {'expression': 'Frown'}. `seed` makes shuffled orders reproducible and `counterbalance`
+    picks the rotation of "rotate" groups.
+    """
+    if isinstance(protocol, str):
+        protocol = load_protocol(protocol)
+    variables = dict(protocol.get('variables', {}), **(variables or {}))
+    defaults = protocol.get('defaults', {})
+    rng = random.Random(seed)
+    steps = []
+    lead_in = protocol.get('lead_in', 0)
+    if lead_in:
+        steps.append({'text': '', 'seconds': lead_in})
+    _expand(protocol['steps'], steps, defaults, variables, rng, counterbalance)
+    return Timeline._from_steps(steps, sampling_rate, protocol.get('name'))
+
+
+def _expand(items, steps, defaults, variables, rng, counterbalance):
+    for item in items:
+        if 'steps' in item:
+            _expand_group(item, steps, defaults, variables, rng, counterbalance)
+        else:
+            _expand_leaf(item, steps, defaults, variables)
+
+
+def _expand_group(group, steps, defaults, variables, rng, counterbalance):
+    unknown = set(group) - GROUP_FIELDS
+    if unknown:
+        raise ProtocolError(f"Unknown group fields: {', '.join(sorted(unknown))}")
+    order = group.get('order', 'fixed')
+    if order not in ORDERS:
+        raise ProtocolError(f"Unknown order '{order}', expected one of {', '.join(ORDERS)}")
+    children = list(group['steps'])
+    for repetition in range(group.get('repeat', 1)):
+        if repetition:
+            _expand(group.get('between', []), steps, defaults, variables, rng, counterbalance)
+        if order == 'shuffle':
+            rng.shuffle(children)
+        elif order == 'rotate':
+            shift = (counterbalance + repetition) % len(children)
+            children = list(group['steps'][shift:]) + list(group['steps'][:shift])
+        _expand(children, steps, defaults, variables, rng, counterbalance)
+
+
+def _expand_leaf(leaf, steps, defaults, variables):
+    unknown = set(leaf) - STEP_FIELDS
+    if unknown:
+        raise ProtocolError(f"Unknown step fields: {', '.join(sorted(unknown))}")
+    step = dict(defaults, **leaf)
+    if 'seconds' not in step:
+        raise ProtocolError(f"Step {leaf} has no duration.")
+    code = step.get('code')
+    if isinstance(code, dict):
+        try:
+            code = code[variables['expression']]
+        except KeyError:
+            raise ProtocolError(f"Step {leaf} has no code for expression {variables.get('expression')!r}")
+    fields = dict(variables, seconds=step['seconds'])
+    if 'label' in step:
+        fields['label'] = _format(step['label'], fields)
+    fields['text'] = _format(step.get('text', '{label}'), fields)
+    fields.setdefault('label', fields['text'])
+    if step.get('prepare'):
+        steps.append({'text': _format(step.get('prepare_text', 'Prepare for: {label}'), fields),
+                      'seconds': step['prepare']})
+    for n in range(step.get('countdown', 0), 0, -1):
+        steps.append({'text': _format(step.get('countdown_text', '{label} in {n}'), dict(fields, n=n)), 'seconds': 1})
+    steps.append({
+        'text': fields['text'],
+        'seconds': step['seconds'],
+        'code': code,
+        'label': fields['label'] if code is not None else None,
+        'cue': _format(step['cue'], fields) if step.get('cue') else None,
+    })
+
+
+def _format(template, fields):
+    try:
+        return template.format(**fields)
+    except KeyError as e:
+        raise ProtocolError(f"Unknown variable {e} in '{template}'")
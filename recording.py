@@ -0,0 +1,230 @@
+import json
+import os
+import struct
+import sys
+import time
+import numpy as np
+
+# Binary recording layout: magic, little-endian uint32 header length, JSON header padded to
+# HEADER_ALIGNMENT bytes, then raw little-endian float32 rows of len(header['columns']) values.
+MAGIC = b'SEMGREC1'
+HEADER_ALIGNMENT = 64
+EXTENSION = '.semg'
+EVENT_COLUMN = 'Event Code'
+COUNTER_COLUMN = 'Counter'
+
+# Sidecar of a recording that is still being written: magic, committed sample count and the
+# wall-clock time of the commit, rewritten in place after every synced block. A clean close
+# deletes it, so its presence marks a recording interrupted by a crash.
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_MAGIC = b'SEMGJRN1'
+JOURNAL_RECORD = struct.Struct('<8sQd')
+
+
+class RecordingWriter:
+    """Appends float32 sample blocks to a binary recording without any text formatting.
+
+    Rows are collected in a preallocated block of `block_samples` and written with one call
+    when it fills, so the acquisition path makes no system call per sample. Every `sync_every`
+    blocks the file is fsynced and the journal updated with the committed sample count, which
+    bounds what a crash can lose; 0 turns syncing and the journal off, e.g. for batch
+    conversion. `resume` reopens an existing recording and appends after its first `resume`
+    samples; whether it has an event column then comes from its header, not `event_column`.
+    With `exclusive` a new recording never replaces an existing file: FileExistsError is raised.
+    """
+
+    def __init__(self, path, sampling_rate, channel_names, event_column=False, block_samples=250, sync_every=1,
+                 resume=None, exclusive=False, **metadata):
+        self.path = path
+        if resume is None:
+            columns = list(channel_names) + ([EVENT_COLUMN] if event_column else [])
+            self.header = dict(metadata, sampling_rate=sampling_rate, columns=columns, dtype='<f4')
+        else:
+            self.header = read_header(path)
+            event_column = self.header['columns'][-1] == EVENT_COLUMN
+            channels = len(self.header['columns']) - event_column
+            if channels != len(channel_names):
+                raise ValueError(f"{path} has {channels} channels, not {len(channel_names)}.")
+        self.event_column = event_column
+        self.num_columns = len(self.header['columns'])
+        self.block = np.empty((block_samples, self.num_columns), dtype='<f4')
+        self.pending = 0
+        self.sync_every = sync_every
+        self.blocks_since_sync = 0
+        self.journal = None
+        if resume is None:
+            self.file = open(path, 'xb' if exclusive else 'wb')
+            self.file.write(encode_header(self.header))
+            self.samples_written = 0
+        else:
+            self.file = open(path, 'r+b')
+            self.file.truncate(self.header.pop('data_offset') + resume * 4 * self.num_columns)
+            self.file.seek(0, 2)
+            self.samples_written = resume
+        self.samples_committed = self.samples_written
+        if sync_every:
+            self.journal = open(journal_path(path), 'wb')
+            self._sync()
+
+    def write(self, data, codes=None):
+        # `data` is a (samples, channels) float32 block; codes are appended when the recording
+        # was created with an event column.
+        count = len(data)
+        offset = 0
+        while offset < count:
+            n = min(len(self.block) - self.pending, count - offset)
+            rows = self.block[self.pending:self.pending + n]
+            if self.event_column:
+                rows[:, :-1] = data[offset:offset + n]
+                rows[:, -1] = codes[offset:offset + n]
+            else:
+                rows[:] = data[offset:offset + n]
+            self.pending += n
+            offset += n
+            if self.pending == len(self.block):
+                self._commit()
+        self.samples_written += count
+
+    def write_bytes(self, buffer):
+        # Raw receive buffer straight from GetData, already laid out as float32 rows.
+        self.write(np.frombuffer(buffer, dtype='<f4').reshape(-1, self.num_columns))
+
+    def flush(self):
+        # Writes and syncs a partially filled block, e.g. at the end of an instruction.
+        self._commit()
+        if self.journal is not None and self.blocks_since_sync:
+            self._sync()
+
+    def close(self):
+        self._commit()
+        self.file.flush()
+        if self.journal is not None:
+            os.fsync(self.file.fileno())
+            self.journal.close()
+            os.remove(journal_path(self.path))
+            self.journal = None
+        self.file.close()
+
+    def _commit(self):
+        if self.pending:
+            self.file.write(self.block[:self.pending])
+            self.samples_committed += self.pending
+            self.pending = 0
+            self.blocks_since_sync += 1
+        if self.journal is not None and self.blocks_since_sync >= self.sync_every:
+            self._sync()
+
+    def _sync(self):
+        # The data must be on disk before the journal claims it is.
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.journal.seek(0)
+        self.journal.write(JOURNAL_RECORD.pack(JOURNAL_MAGIC, self.samples_committed, time.time()))
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.blocks_since_sync = 0
+
+
+def journal_path(path):
+    return path + JOURNAL_SUFFIX
+
+
+def read_journal(path):
+    # Committed sample count of an unfinished recording, or None if it was closed cleanly.
+    try:
+        with open(journal_path(path), 'rb') as f:
+            record = f.read(JOURNAL_RECORD.size)
+    except FileNotFoundError:
+        return None
+    if len(record) < JOURNAL_RECORD.size or record[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+        return 0
+    return JOURNAL_RECORD.unpack(record)[1]
+
+
+def find_unfinished(root):
+    # Recordings under `root` whose writer never closed them.
+    for directory, _, files in os.walk(root):
+        for name in sorted(files):
+            if name.endswith(EXTENSION + JOURNAL_SUFFIX):
+                yield os.path.join(directory, name[:-len(JOURNAL_SUFFIX)])
+
+
+def recover_recording(path):
+    """Trims a recording interrupted by a crash to its last trustworthy sample.
+
+    Everything up to the journal's committed count was fsynced. Later whole rows are kept as
+    long as the device counter continues (or restarts at 1), since rows the OS never wrote
+    read back as zeros. A partial trailing row is always dropped. Returns the sample count;
+    the journal is left in place so the session can still be resumed.
+    """
+    header = read_header(path)
+    columns = header['columns']
+    row_bytes = 4 * len(columns)
+    samples = (os.path.getsize(path) - header['data_offset']) // row_bytes
+    committed = read_journal(path)
+    if committed is not None and samples > committed:
+        if COUNTER_COLUMN in columns:
+            data, _ = load_recording(path)
+            counter = np.array(data[committed:samples, columns.index(COUNTER_COLUMN)])
+            previous = float(data[committed - 1, columns.index(COUNTER_COLUMN)]) if committed else 0.0
+            del data
+            valid = (counter == np.concatenate(([previous], counter[:-1])) + 1) | (counter == 1)
+            samples = committed + (int(np.argmin(valid)) if not valid.all() else len(valid))
+        else:
+            samples = committed
+    with open(path, 'r+b') as f:
+        f.truncate(header['data_offset'] + samples * row_bytes)
+    return samples
+
+
+def encode_header(header):
+    payload = json.dumps(header).encode('utf-8')
+    size = len(MAGIC) + 4 + len(payload)
+    payload += b' ' * (-size % HEADER_ALIGNMENT)
+    return MAGIC + struct.pack('<I', len(payload)) + payload
+
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a binary sEMG recording.")
+        length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(length))
+    header['data_offset'] = len(MAGIC) + 4 + length
+    return header
+
+
+def load_recording(path):
+    """Returns (data, header) with data memory-mapped as a read-only (samples, columns) array."""
+    header = read_header(path)
+    num_columns = len(header['columns'])
+    with open(path, 'rb') as f:
+        f.seek(0, 2)
+        samples = (f.tell() - header['data_offset']) // (4 * num_columns)
+    if samples == 0:
+        return np.zeros((0, num_columns), dtype='<f4'), header
+    data = np.memmap(path, dtype='<f4', mode='r', offset=header['data_offset'], shape=(samples, num_columns))
+    return data, header
+
+
+def export_csv(path, csv_path=None, fmt='%.3f', chunk_samples=25000):
+    # Offline export to the CSV layout the study scripts used to write directly.
+    if csv_path is None:
+        csv_path = path[:-len(EXTENSION)] + '.csv' if path.endswith(EXTENSION) else path + '.csv'
+    data, header = load_recording(path)
+    with open(csv_path, 'wb') as f:
+        for start in range(0, len(data), chunk_samples):
+            np.savetxt(f, data[start:start + chunk_samples], delimiter=',', fmt=fmt, newline='\n')
+    return csv_path
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(f"Usage: python recording.py <recording{EXTENSION}> [...]")
+        return
+    for path in sys.argv[1:]:
+        print(f"Exported {export_csv(path)}")
+
+
+if __name__ == "__main__":
+    main()
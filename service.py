@@ -0,0 +1,343 @@
+"""Headless acquisition service: the study session loop without Tk, controlled over local HTTP.
+
+    python service.py serve --features --classify       # on the lab machine, keeps the device open
+    python service_client.py start P01 Smile            # from any script or terminal on that machine
+    python service_client.py mark --label "participant coughed"
+    python service_client.py status
+    python service_client.py stop
+
+    python service.py run P01 Smile                     # one session in the foreground, no server
+
+The service runs its trials through session.StudySession like the study UIs: AcquisitionEngine,
+compiled protocol, SessionController, RecordingWriter, MarkerStream, MetricsLogger, the LSL
+publisher and optionally features, the live classifier and audio cues. Progress is followed
+on a plain thread instead of the Tk loop. The control API is JSON over HTTP bound to the
+loopback interface:
+
+    GET  /status                               state, current instruction, health, last result
+    POST /start  {"participant", "expression", "resume", "counterbalance"}
+    POST /stop
+    POST /mark   {"code", "label"}             experimenter marker at the current sample
+    POST /shutdown
+
+service_client.ServiceClient wraps these calls with the standard library alone, so scripts and
+GUIs can act as thin clients without the device driver. Nothing here imports Tk; scipy, PyAV
+and sounddevice are only imported for the options that need them.
+"""
+import argparse
+import contextlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pylsl import StreamInfo, StreamOutlet
+from acquisition import get_channel_names
+from catalog import Catalog
+from classifier import MODEL_SUFFIX
+from lsl_publisher import LSLPublisher
+from markers import MANUAL_EVENT
+from protocol import PROTOCOL_DIR
+from recording import EXTENSION
+from service_client import DEFAULT_PORT, ServiceError
+from session import StudySession, new_trial, resume_trial
+
+if os.environ.get("UNICORN_SIMULATOR"):
+    import UnicornPySim as UnicornPy
+else:
+    import UnicornPy
+
+
+class StudyService:
+    """One Unicorn and the study sessions recorded from it, one at a time.
+
+    `start`, `stop`, `mark` and `status` may be called from any thread. Sessions finish on
+    their own follower thread, which closes the recording and adds it to the catalog.
+    """
+
+    def __init__(self, output="Data", protocol=os.path.join(PROTOCOL_DIR, "intensity_blocks.json"),
+                 serial=None, frame_length=1, lsl_chunk_size=8, continuous=True, features=False,
+                 classify=False, calibration_repetitions=2, audio=False, publish_metrics=False):
+        self.output = output
+        self.protocol_path = protocol
+        self.frame_length = frame_length
+        self.continuous = continuous
+        self.publish_metrics = publish_metrics
+        self.calibration_repetitions = calibration_repetitions
+        self.lock = threading.Lock()
+        self.session = None
+        self.follower = None
+        self.current = None
+        self.result = None
+        os.makedirs(output, exist_ok=True)
+
+        serials = UnicornPy.GetAvailableDevices(True)
+        if not serials:
+            raise ServiceError("No device available. Please pair with a Unicorn first.")
+        self.serial = serial or serials[0]
+        self.device = UnicornPy.Unicorn(self.serial)
+        self.data_outlet = LSLPublisher(self.device, UnicornPy.SamplingRate, 'UnicornData', 'EEG',
+                                        f"unicorn_{self.serial}", serial=self.serial, event_column=True,
+                                        chunk_size=lsl_chunk_size)
+        self.event_outlet = StreamOutlet(StreamInfo('UnicornEvents', 'Markers', 1, 0, 'int32',
+                                                    f"unicorn_events_{self.serial}"))
+        self.feature_extractor = None
+        if features or classify:
+            from features import FeatureExtractor
+            self.feature_extractor = FeatureExtractor(self.device, UnicornPy.SamplingRate)
+        self.classify = classify
+        self.cue_player = None
+        if audio:
+            from audio_cues import CuePlayer
+            try:
+                self.cue_player = CuePlayer(frame_seconds=frame_length / UnicornPy.SamplingRate)
+            except Exception as e:
+                print(f"Audio cues disabled: {e}")
+
+    def start(self, participant, expression, resume=False, counterbalance=None):
+        """Starts the next trial of a participant; returns the status.
+
+        An interrupted trial of the same expression is continued with `resume`, and otherwise
+        kept as recovered, like declining the UIs' resume prompt. `counterbalance` overrides the
+        participant's rotation index from the catalog.
+        """
+        participant = participant.strip()
+        if not participant or not expression:
+            raise ServiceError("A participant label and an expression are required.")
+        with self.lock:
+            if self.session is not None:
+                raise ServiceError(f"A session is already running: {self.current['path']}")
+            directory = os.path.join(self.output, participant)
+            os.makedirs(directory, exist_ok=True)
+            resumed = resume_trial(directory, expression, UnicornPy.SamplingRate, get_channel_names(self.device),
+                                   lambda path, timeline: resume, self._catalog_add)
+            if resumed is not None:
+                writer, timeline, keep = resumed
+                self._start_session(participant, expression, writer, timeline, keep)
+                return self._status()
+
+            with contextlib.closing(Catalog(self.output)) as catalog:
+                # Recordings the catalog missed, e.g. copied in or converted without it, take a trial number too.
+                catalog.scan()
+                trial = catalog.next_trial(participant, expression)
+                if counterbalance is None:
+                    counterbalance = catalog.counterbalance(participant)
+            path = os.path.join(directory, f"{participant}_{expression}_{trial}{EXTENSION}")
+            try:
+                writer, timeline = new_trial(path, self.protocol_path, UnicornPy.SamplingRate,
+                                             get_channel_names(self.device), participant, expression, trial,
+                                             counterbalance, continuous=self.continuous)
+            except FileExistsError:
+                raise ServiceError(f"{path} already exists.")
+            self._start_session(participant, expression, writer, timeline)
+            return self._status()
+
+    def stop(self, timeout=10.0):
+        # Ends the running session early; the recording is kept up to the last sample.
+        with self.lock:
+            session, follower = self.session, self.follower
+        if session is None:
+            raise ServiceError("No session is running.")
+        session.stop()
+        follower.join(timeout)
+        return self.status()
+
+    def mark(self, code=None, label=None):
+        # Marks the sample being acquired now, in the events sidecar and on the LSL marker stream.
+        with self.lock:
+            if self.session is None:
+                raise ServiceError("No session is running.")
+            code = MANUAL_EVENT if code is None else int(code)
+            timestamp = self.session.engine.clock()
+            self.session.markers.add_timed_marker(timestamp, code, label)
+            return {'timestamp': timestamp, 'code': code, 'label': label}
+
+    def status(self):
+        with self.lock:
+            return self._status()
+
+    def close(self):
+        if self.session is not None:
+            self.stop()
+        if self.cue_player is not None:
+            self.cue_player.close()
+
+    def _catalog_add(self, path):
+        with contextlib.closing(Catalog(self.output)) as catalog:
+            catalog.add_recording(path)
+
+    def _start_session(self, participant, expression, writer, timeline, resume_from=None):
+        model_path = None
+        if self.classify:
+            model_path = os.path.join(os.path.dirname(writer.path), f"{participant}{MODEL_SUFFIX}")
+        session = StudySession(self.device, UnicornPy.SamplingRate, writer, timeline,
+                               continuous=writer.header.get('continuous', True),
+                               frame_length=self.frame_length, resume_from=resume_from, data_outlet=self.data_outlet,
+                               event_outlet=self.event_outlet, feature_extractor=self.feature_extractor,
+                               model_path=model_path, calibration_repetitions=self.calibration_repetitions,
+                               cues=self.cue_player, publish_metrics=self.publish_metrics)
+        self.current = {
+            'participant': participant, 'expression': expression, 'path': writer.path, 'started': time.time(),
+            'entries': len(timeline), 'entry': None, 'instruction': None,
+        }
+        self.session = session
+        session.start()
+        self.follower = threading.Thread(target=self._follow, args=(session,), name="session-follower", daemon=True)
+        self.follower.start()
+
+    def _follow(self, session):
+        # Plays the part of the UIs' poll_session loop.
+        while session.poll(self._show, self._finish, wait=1.0):
+            pass
+
+    def _show(self, instruction, entry):
+        with self.lock:
+            self.current['instruction'] = instruction
+            self.current['entry'] = entry
+
+    def _finish(self, outcome, error, stats):
+        self._catalog_add(self.current['path'])
+        with self.lock:
+            result = {
+                'path': self.current['path'],
+                'outcome': outcome,
+                'completed': outcome == 'finished' and not self.session.controller.stop_requested.is_set(),
+            }
+            if error is not None:
+                result['error'] = error
+            result.update(stats)
+            self.result = result
+            self.session = None
+            self.current = None
+        print(f"Session finished ({outcome}): {result['path']}")
+
+    def _status(self):
+        session = self.session
+        status = {'device': self.serial, 'state': 'idle' if session is None else session.state(),
+                  'last_result': self.result}
+        current = self.current
+        if current is not None:
+            status.update({key: current[key] for key in ('participant', 'expression', 'path', 'entry', 'entries',
+                                                         'instruction')})
+            status['elapsed'] = time.time() - current['started']
+            status['samples'] = session.writer.samples_written
+            status['health'] = session.status()
+            status['metrics'] = session.metrics.latest
+            if session.classifier is not None:
+                status['classifier'] = session.classifier.status()
+        return status
+
+
+def _json(value):
+    # NumPy scalars from the statistics dictionaries.
+    return json.dumps(value, default=lambda item: item.item() if hasattr(item, 'item') else str(item))
+
+
+class ControlHandler(BaseHTTPRequestHandler):
+    # The server's `service` attribute is the StudyService being controlled.
+
+    def do_GET(self):
+        if self.path == '/status':
+            self._reply(200, self.server.service.status())
+        else:
+            self._reply(404, {'error': f"Unknown endpoint {self.path}"})
+
+    def do_POST(self):
+        service = self.server.service
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+            body = json.loads(self.rfile.read(length) or b'{}')
+            if self.path == '/start':
+                self._reply(200, service.start(body.get('participant', ''), body.get('expression', ''),
+                                               bool(body.get('resume', False)), body.get('counterbalance')))
+            elif self.path == '/stop':
+                self._reply(200, service.stop())
+            elif self.path == '/mark':
+                self._reply(200, service.mark(body.get('code'), body.get('label')))
+            elif self.path == '/shutdown':
+                self._reply(200, {'state': 'shutting down'})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                self._reply(404, {'error': f"Unknown endpoint {self.path}"})
+        except ServiceError as e:
+            self._reply(409, {'error': str(e)})
+        except (ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            self._reply(500, {'error': str(e)})
+
+    def _reply(self, code, payload):
+        body = _json(payload).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service, host='127.0.0.1', port=DEFAULT_PORT):
+    # Blocks until /shutdown, Ctrl-C or SIGTERM; a running session is stopped and saved first.
+    server = ThreadingHTTPServer((host, port), ControlHandler)
+    server.service = service
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Unicorn service for {service.serial} listening on http://{host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless Unicorn acquisition service; control it with "
+                                                 "service_client.py.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    for name, help_text in (('serve', "open the device and serve the control API"),
+                            ('run', "record one session in the foreground")):
+        command = commands.add_parser(name, help=help_text)
+        if name == 'serve':
+            command.add_argument('--port', type=int, default=DEFAULT_PORT)
+        else:
+            command.add_argument('participant')
+            command.add_argument('expression')
+            command.add_argument('--resume', action='store_true', help="continue an interrupted trial")
+            command.add_argument('--counterbalance', type=int, help="rotation index (default: from the catalog)")
+        command.add_argument('--output', default='Data', help="folder for the recordings")
+        command.add_argument('--protocol', default=os.path.join(PROTOCOL_DIR, "intensity_blocks.json"))
+        command.add_argument('--device', help="serial to open (default: first paired device)")
+        command.add_argument('--frame-length', type=int, default=1)
+        command.add_argument('--lsl-chunk-size', type=int, default=8)
+        command.add_argument('--block-mode', action='store_true', help="acquire only during instructions")
+        command.add_argument('--features', action='store_true', help="publish sEMG features")
+        command.add_argument('--classify', action='store_true', help="run the live intensity classifier")
+        command.add_argument('--audio', action='store_true', help="play the spoken cues")
+        command.add_argument('--publish-metrics', action='store_true')
+    args = parser.parse_args()
+
+    service = StudyService(args.output, args.protocol, args.device, args.frame_length, args.lsl_chunk_size,
+                           not args.block_mode, args.features, args.classify, audio=args.audio,
+                           publish_metrics=args.publish_metrics)
+    if args.command == 'serve':
+        serve(service, port=args.port)
+        return
+    try:
+        status = service.start(args.participant, args.expression, args.resume, args.counterbalance)
+        print(f"Recording {status['path']}")
+        while service.status()['state'] != 'idle':
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        print("Stopping.")
+    finally:
+        service.close()
+    print(_json(service.status()['last_result']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Client for the control API of a running acquisition service (service.py).
+
+Uses the standard library only, so experiment scripts and GUIs can drive the recorder without
+NumPy, LSL or the device driver installed, and the command line starts instantly:
+
+    python service_client.py start P01 Smile
+    python service_client.py mark --label "participant coughed"
+    python service_client.py status
+    python service_client.py stop
+"""
+import argparse
+import json
+import urllib.error
+import urllib.request
+
+DEFAULT_PORT = 8765
+
+
+class ServiceError(RuntimeError):
+    pass
+
+
+class ServiceClient:
+    """Calls the control API of a running service, e.g. from a GUI or an experiment script."""
+
+    def __init__(self, url=f"http://127.0.0.1:{DEFAULT_PORT}", timeout=15.0):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def status(self):
+        return self._request('GET', '/status')
+
+    def start(self, participant, expression, resume=False, counterbalance=None):
+        return self._request('POST', '/start', {'participant': participant, 'expression': expression,
+                                                'resume': resume, 'counterbalance': counterbalance})
+
+    def stop(self):
+        return self._request('POST', '/stop')
+
+    def mark(self, code=None, label=None):
+        return self._request('POST', '/mark', {'code': code, 'label': label})
+
+    def shutdown(self):
+        return self._request('POST', '/shutdown')
+
+    def _request(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method,
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise ServiceError(json.loads(e.read()).get('error', str(e))) from None
+        except urllib.error.URLError as e:
+            raise ServiceError(f"No service at {self.url}: {e.reason}") from None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Control a running Unicorn acquisition service.")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{DEFAULT_PORT}", help="service to control")
+    commands = parser.add_subparsers(dest='command', required=True)
+    start = commands.add_parser('start', help="start the participant's next trial")
+    start.add_argument('participant')
+    start.add_argument('expression')
+    start.add_argument('--resume', action='store_true', help="continue an interrupted trial")
+    start.add_argument('--counterbalance', type=int, help="rotation index (default: from the catalog)")
+    commands.add_parser('stop', help="stop the running session")
+    mark = commands.add_parser('mark', help="add a marker to the running session")
+    mark.add_argument('--code', type=int, help="event code (default: the manual marker code)")
+    mark.add_argument('--label')
+    commands.add_parser('status', help="print the service status")
+    commands.add_parser('shutdown', help="stop the service")
+    args = parser.parse_args()
+
+    client = ServiceClient(args.url)
+    try:
+        if args.command == 'start':
+            result = client.start(args.participant, args.expression, args.resume, args.counterbalance)
+        elif args.command == 'mark':
+            result = client.mark(args.code, args.label)
+        else:
+            result = getattr(client, args.command)()
+    except ServiceError as e:
+        raise SystemExit(str(e))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+import os
+import queue
+import threading
+import time
+import numpy as np
+from pylsl import local_clock
+from acquisition import NO_EVENT, AcquisitionEngine
+from classifier import IntensityClassifier, timeline_classes
+from markers import MarkerStream, events_path, truncate_events
+from protocol import PROTOCOL_DIR, compile_protocol
+from recording import RecordingWriter, find_unfinished, journal_path, read_header, recover_recording
+from telemetry import MetricsLogger, metrics_path, status_line
+
+# How often the Tk UI drains the controller queue.
+UI_REFRESH_MS = 20
+
+# How finish() names the parts of a session in its statistics.
+STATISTICS_TITLES = {'acquisition': "Acquisition", 'lsl': "LSL", 'features': "Feature", 'classifier': "Classifier",
+                     'plot': "Plot", 'audio_cues': "Audio cue"}
+
+
+class SessionController:
+    """Runs a compiled protocol timeline on its own thread and reports progress through a queue.
+
+    The UI never calls into the engine or sleeps: it polls `messages` from `root.after` and
+    only updates widgets there. Messages are ('status', text, timestamp, entry_index),
+    ('finished', stats) and ('error', message).
+
+    With `continuous` the engine runs for the whole session and its reader tags every sample
+    from the timeline, so instruction boundaries fall on exact sample offsets; this thread only
+    follows the reader to update the display. Otherwise the device is started for each
+    recorded entry and stopped afterwards.
+
+    With a CuePlayer as `cues`, every entry that names a cue plays it, scheduled relative to the
+    timestamp of the entry's first sample. Block-wise sessions have no samples outside recorded
+    entries, so cues of the others are scheduled from the time the entry is shown.
+    """
+
+    def __init__(self, engine, timeline, continuous=True, cues=None):
+        self.engine = engine
+        self.timeline = timeline
+        self.continuous = continuous
+        self.cues = cues
+        if cues is not None:
+            missing = sorted({cue for cue in timeline.cues if cue} - set(cues.buffers))
+            if missing:
+                raise ValueError(f"Protocol cues not loaded: {', '.join(missing)}")
+        self.messages = queue.Queue()
+        self.stop_requested = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name="session-controller", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_requested.set()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _run(self):
+        try:
+            if self.continuous:
+                self._run_continuous()
+            else:
+                self._run_blocks()
+            if self.engine.error is not None:
+                raise self.engine.error
+            self.messages.put(('finished', self.engine.stats()))
+        except Exception as e:
+            try:
+                self.engine.stop()
+            except Exception:
+                pass
+            self.messages.put(('error', str(e)))
+
+    def _run_continuous(self):
+        timeline = self.timeline
+        engine = self.engine
+        engine.start(False, max_samples=timeline.total_samples, schedule=timeline)
+        for index in range(len(timeline)):
+            # Sleep until the reader should have stored the entry's first sample, then check.
+            target = engine.schedule_origin + int(timeline.starts[index])
+            while engine.running and not self.stop_requested.is_set():
+                remaining = target + 1 - engine.ring.write_index
+                if remaining <= 0:
+                    break
+                self.stop_requested.wait(remaining / engine.sampling_rate)
+            if self.stop_requested.is_set() or engine.ring.write_index <= target:
+                break
+            self.messages.put(('status', timeline.texts[index], time.perf_counter(), index))
+            if self.cues is not None and timeline.cues[index]:
+                self.cues.play(timeline.cues[index], engine.sample_time(target))
+        while engine.running and not self.stop_requested.is_set():
+            engine.wait(0.1)
+        engine.stop()
+
+    def _run_blocks(self):
+        timeline = self.timeline
+        # Deadlines are absolute so time spent posting messages never accumulates into drift.
+        deadline = time.perf_counter()
+        for index in range(len(timeline)):
+            if self.stop_requested.is_set():
+                break
+            self.messages.put(('status', timeline.texts[index], time.perf_counter(), index))
+            if timeline.recorded(index):
+                self._record_block(index)
+                deadline = time.perf_counter()
+            else:
+                if self.cues is not None and timeline.cues[index]:
+                    self.cues.play(timeline.cues[index])
+                deadline += timeline.seconds(index)
+                self.stop_requested.wait(max(0.0, deadline - time.perf_counter()))
+            if self.engine.error is not None:
+                raise self.engine.error
+
+    def _record_block(self, index):
+        engine = self.engine
+        cue = self.timeline.cues[index] if self.cues is not None else None
+        engine.set_event(int(self.timeline.codes[index]), self.timeline.labels[index])
+        first = engine.ring.write_index
+        engine.start(False, max_samples=int(self.timeline.lengths[index]))
+        if cue:
+            # The cue waits for the block's first sample, so it is timed like in continuous sessions.
+            while engine.running and not self.stop_requested.is_set() and engine.ring.write_index <= first:
+                self.stop_requested.wait(1.0 / engine.sampling_rate)
+            if engine.ring.write_index > first:
+                self.cues.play(cue, engine.sample_time(first))
+        while engine.running and not self.stop_requested.is_set():
+            engine.wait(0.1)
+        engine.stop()
+
+
+def print_statistics(stats):
+    # The study UIs' console report of a finished session.
+    for part, values in stats.items():
+        print(f"{STATISTICS_TITLES[part]} statistics: {values}")
+
+
+def resume_point(timeline, samples, continuous=True):
+    """Where to continue an interrupted session whose recording holds `samples` samples.
+
+    Returns (entry, keep): the timeline entry after the last fully recorded instruction and the
+    samples up to its end. Samples of a partly recorded instruction are dropped, so the resumed
+    session repeats its preparation and countdown.
+    """
+    recorded = timeline.codes != NO_EVENT
+    if continuous:
+        ends = timeline.starts + timeline.lengths
+    else:
+        # Block-wise sessions only store the recorded entries.
+        ends = np.cumsum(np.where(recorded, timeline.lengths, 0))
+    done = np.flatnonzero(recorded & (ends <= samples))
+    if not len(done):
+        return 0, 0
+    return int(done[-1]) + 1, int(ends[done[-1]])
+
+
+def protocol_reference(protocol_path):
+    # How a recording's header names its protocol: shipped protocols by file name, so trials
+    # still resume after the checkout moves, any other by absolute path.
+    path = os.path.abspath(protocol_path)
+    if os.path.dirname(path) == os.path.abspath(PROTOCOL_DIR):
+        return os.path.basename(path)
+    return path
+
+
+def plan_resume(path, sampling_rate):
+    """Recovers an interrupted recording and recompiles what is left of its protocol.
+
+    Returns (timeline, keep) with the entries still to run and the samples to keep, or None if
+    the header does not name its protocol, the protocol file is gone or no instruction is left.
+    """
+    samples = recover_recording(path)
+    header = read_header(path)
+    if 'protocol_file' not in header:
+        return None
+    # Relative names are shipped protocols; see protocol_reference.
+    protocol_file = os.path.join(PROTOCOL_DIR, header['protocol_file'])
+    if not os.path.exists(protocol_file):
+        return None
+    variables = {'expression': header['expression']} if 'expression' in header else None
+    timeline = compile_protocol(protocol_file, sampling_rate, variables, seed=header.get('seed'),
+                                counterbalance=header.get('counterbalance', 0))
+    entry, keep = resume_point(timeline, samples, header.get('continuous', True))
+    remaining = timeline.remaining(entry)
+    if not (remaining.codes != NO_EVENT).any():
+        return None
+    return remaining, keep
+
+
+def close_unfinished(path):
+    # Keeps an interrupted recording as it is, trimmed to its recovered samples.
+    samples = recover_recording(path)
+    truncate_events(path, samples)
+    os.remove(journal_path(path))
+    return samples
+
+
+def find_resumable(directory, expression, sampling_rate, accept, on_closed=None):
+    """Offers the interrupted recordings of `expression` under `directory` for resuming.
+
+    `accept(path, timeline)` decides on each one that can be resumed, e.g. by asking the
+    experimenter. Returns (path, timeline, keep) for the first accepted recording (see
+    plan_resume), or None. The others are closed as they are and passed to `on_closed`, e.g.
+    Catalog.add_recording.
+    """
+    for path in find_unfinished(directory):
+        if read_header(path).get('expression') != expression:
+            continue
+        plan = plan_resume(path, sampling_rate)
+        if plan is not None and accept(path, plan[0]):
+            return (path,) + plan
+        close_unfinished(path)
+        if on_closed is not None:
+            on_closed(path)
+    return None
+
+
+def resume_trial(directory, expression, sampling_rate, channel_names, accept, on_closed=None):
+    """Reopens the interrupted trial of `expression` under `directory` the front end accepts.
+
+    Trials interrupted by a crash continue after their last completed instruction; declined
+    ones are kept as they are (see find_resumable). Returns (writer, timeline, keep) with the
+    writer appending after the `keep` samples and the entries still to run, or None. The writer
+    keeps the recording's layout, and the session should run in the mode its header records.
+    """
+    plan = find_resumable(directory, expression, sampling_rate, accept, on_closed)
+    if plan is None:
+        return None
+    path, timeline, keep = plan
+    return RecordingWriter(path, sampling_rate, channel_names, resume=keep), timeline, keep
+
+
+def resume_question(path, timeline):
+    # What the study UIs ask before resuming a trial.
+    return f"{os.path.basename(path)} was interrupted. Resume it from '{timeline.texts[0]}'?"
+
+
+def new_trial(path, protocol_path, sampling_rate, channel_names, participant, expression, trial, counterbalance,
+              continuous=True, event_column=True):
+    """Compiles the protocol for a new trial and creates its recording; returns (writer, timeline).
+
+    The header keeps the protocol, seed and counterbalancing index, so an interrupted trial is
+    recompiled identically by plan_resume. An existing file at `path` is never replaced, even
+    when the catalog the trial number came from does not know it: FileExistsError is raised.
+    """
+    seed = f"{participant}_{expression}_{trial}"
+    timeline = compile_protocol(protocol_path, sampling_rate, {'expression': expression}, seed=seed,
+                                counterbalance=counterbalance)
+    writer = RecordingWriter(path, sampling_rate, channel_names, event_column=event_column, exclusive=True,
+                             participant=participant, expression=expression, trial=trial, continuous=continuous,
+                             protocol=timeline.name, protocol_file=protocol_reference(protocol_path), seed=seed,
+                             counterbalance=counterbalance)
+    return writer, timeline
+
+
+class StudySession:
+    """One trial of a study: a SessionController and everything recording around it.
+
+    Both study UIs and the acquisition service run their trials through this, so recordings,
+    sidecars and catalog entries come out the same whichever front end made them. A new engine
+    feeds `writer`, the events sidecar (MarkerStream) and the metrics log; `data_outlet`,
+    `event_outlet`, `feature_extractor`, `plot` and `cues` are the front end's long-lived parts,
+    attached for this trial when given. With `model_path` the participant's live classifier
+    predicts from the feature extractor. `resume_from` continues a resumed recording. If the
+    setup fails, `writer` is closed before the error is raised.
+    """
+
+    def __init__(self, device, sampling_rate, writer, timeline, continuous=True, frame_length=1,
+                 resume_from=None, data_outlet=None, event_outlet=None, feature_extractor=None, model_path=None,
+                 calibration_repetitions=2, plot=None, cues=None, publish_metrics=False):
+        self.path = writer.path
+        self.writer = writer
+        self.resume_from = resume_from
+        self.data_outlet = data_outlet
+        self.feature_extractor = feature_extractor
+        self.plot = plot
+        self.cues = cues
+        self.classifier = None
+        self.markers = None
+        self.metrics = None
+        try:
+            self.engine = AcquisitionEngine(device, sampling_rate, frame_length, clock=local_clock)
+            self.controller = SessionController(self.engine, timeline, continuous=continuous, cues=cues)
+            self.engine.add_consumer(lambda data, codes, first_sample: writer.write(data, codes), "file-writer")
+            if data_outlet is not None:
+                data_outlet.attach(self.engine)
+            if feature_extractor is not None:
+                feature_extractor.attach(self.engine)
+                if model_path is not None:
+                    self.classifier = IntensityClassifier(timeline_classes(timeline), calibration_repetitions,
+                                                          model_path=model_path)
+                    self.classifier.attach(feature_extractor)
+            if plot is not None:
+                plot.attach(self.engine)
+            # One marker per instruction, on LSL and in the recording's events sidecar.
+            self.markers = MarkerStream(self.engine, self.path, event_outlet, resume_from)
+            self.metrics = MetricsLogger(self.engine, metrics_path(self.path), publish=publish_metrics)
+        except Exception:
+            self._discard()
+            raise
+        if cues is not None:
+            # Cue onsets are marked at the moment the audio reached the DAC.
+            cues.onset_callback = self.markers.add_cue_marker
+
+    def start(self):
+        self.controller.start()
+
+    def poll(self, on_status, on_done, catalog=None, wait=None):
+        """Hands the controller's messages to the front end; returns whether the session still runs.
+
+        `on_status(text, entry_index)` is called for every instruction shown. Once the controller
+        is done the session is finished (see finish) and `on_done(outcome, error, stats)` called
+        with outcome 'finished' or 'error'. Never blocks, unless `wait` gives the seconds to wait
+        for a message, so a Tk front end can call it from `root.after`.
+        """
+        try:
+            message = self.controller.messages.get(wait is not None, wait)
+            while message[0] == 'status':
+                on_status(message[1], message[3])
+                message = self.controller.messages.get_nowait()
+        except queue.Empty:
+            return True
+        on_done(message[0], message[1] if message[0] == 'error' else None, self.finish(catalog))
+        return False
+
+    def stop(self):
+        self.controller.stop()
+
+    def is_running(self):
+        return self.controller.is_running()
+
+    def state(self):
+        # 'running' until stop() was called, then 'stopping' until the controller is done.
+        return 'stopping' if self.controller.stop_requested.is_set() else 'running'
+
+    def status(self):
+        # Acquisition health and classifier state for a status bar; the health line needs
+        # the first metrics interval, until then the session is starting.
+        if self.metrics.latest is None:
+            line = "Acquisition stopping" if self.state() == 'stopping' else "Acquisition starting"
+        else:
+            line = status_line(self.metrics.latest)
+        return line if self.classifier is None else f"{line} | {self.classifier.status()}"
+
+    def finish(self, catalog=None):
+        """Closes the recording and its sidecars once the controller has stopped; returns statistics.
+
+        The recording is added to `catalog` if given, and the trial's parts are detached from
+        the long-lived ones.
+        """
+        self.metrics.stop()
+        self.writer.close()
+        self.markers.close()
+        if catalog is not None:
+            catalog.add_recording(self.path)
+        stats = {'acquisition': self.engine.stats()}
+        if self.data_outlet is not None:
+            self.data_outlet.flush()
+            stats['lsl'] = self.data_outlet.stats()
+        if self.feature_extractor is not None:
+            stats['features'] = self.feature_extractor.stats()
+        if self.classifier is not None:
+            stats['classifier'] = self.classifier.stats()
+            self.classifier.detach()
+        if self.plot is not None:
+            stats['plot'] = self.plot.stats()
+            self.plot.detach()
+        if self.cues is not None:
+            stats['audio_cues'] = self.cues.stats()
+        return stats
+
+    def _discard(self):
+        # Undoes a setup that failed before anything was recorded. A new trial leaves no files
+        # behind; a resumed one keeps its journal, so it is offered for resuming again.
+        if self.markers is not None:
+            self.markers.close()
+        if self.classifier is not None:
+            self.classifier.detach()
+        if self.plot is not None:
+            self.plot.detach()
+        self.writer.file.close()
+        if self.writer.journal is not None:
+            self.writer.journal.close()
+        if self.resume_from is None:
+            for path in (self.path, journal_path(self.path), events_path(self.path), metrics_path(self.path)):
+                if os.path.exists(path):
+                    os.remove(path)
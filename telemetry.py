@@ -0,0 +1,188 @@
+"""Always-on latency histograms and health metrics for the acquisition path.
+
+Recording a value is a bisect into a short list of bucket bounds plus two additions, so the
+reader and consumer threads can keep their histograms updated in production. Nothing is
+locked: each histogram has a single writer, and readers work from copies of the counts, so
+an interval summary is the difference between two snapshots rather than a reset.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+import numpy as np
+from pylsl import StreamInfo, StreamOutlet
+
+# Bucket upper bounds, roughly logarithmic: microseconds for latencies, samples for queues.
+LATENCY_BOUNDS_US = [10, 20, 50, 100, 200, 500, 1e3, 2e3, 5e3, 1e4, 2e4, 5e4, 1e5, 2e5, 5e5, 1e6, 1e7]
+QUEUE_BOUNDS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+METRICS_SUFFIX = '.metrics.jsonl'
+
+# Channels of the optional LSL metrics stream, one sample per logging interval.
+METRIC_CHANNELS = [
+    'get_data_p99_us', 'reader_busy_p99_us', 'file_writer_p99_us', 'lsl_push_p99_us',
+    'queue_depth_p99', 'dropped_samples', 'overruns', 'battery_percent', 'invalid_samples',
+]
+
+
+class Histogram:
+    def __init__(self, bounds=LATENCY_BOUNDS_US):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def state(self):
+        return list(self.counts), self.total
+
+    def summary(self, since=None):
+        # Count, mean and bucket-resolution percentiles, of everything or since an earlier
+        # state(); 'max' is always the largest value ever recorded.
+        counts, total = self.state()
+        if since is not None:
+            counts = [now - then for now, then in zip(counts, since[0])]
+            total -= since[1]
+        count = sum(counts)
+        if not count:
+            return {'count': 0}
+        return {
+            'count': count,
+            'mean': total / count,
+            'p50': self._quantile(counts, count, 0.5),
+            'p99': self._quantile(counts, count, 0.99),
+            'max': self.max,
+        }
+
+    def _quantile(self, counts, count, q):
+        # Upper bound of the bucket holding the quantile, capped at the largest value seen.
+        index = int(np.searchsorted(np.cumsum(counts), q * count))
+        return min(self.bounds[index], self.max) if index < len(self.bounds) else self.max
+
+
+class Telemetry:
+    """The named histograms of one engine and the components attached to it."""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def add(self, name, histogram):
+        self.histograms[name] = histogram
+        return histogram
+
+    def histogram(self, name, bounds=LATENCY_BOUNDS_US):
+        if name not in self.histograms:
+            self.histograms[name] = Histogram(bounds)
+        return self.histograms[name]
+
+    def state(self):
+        return {name: histogram.state() for name, histogram in self.histograms.items()}
+
+    def summary(self, since=None):
+        return {name: histogram.summary(since.get(name) if since else None)
+                for name, histogram in self.histograms.items()}
+
+
+class MetricsLogger:
+    """Appends an engine's interval metrics to a JSON-lines log every `interval` seconds.
+
+    Each line holds the histograms of the past interval, the dropped-sample and overrun
+    totals and the battery and validation state read from the device channels. With
+    `publish` the headline figures also go out as an LSL 'Metrics' stream. `latest` is the
+    last record, for status displays.
+    """
+
+    def __init__(self, engine, path=None, interval=1.0, publish=False, source_id='unicorn_metrics'):
+        self.engine = engine
+        self.path = path
+        self.interval = interval
+        self.latest = None
+        self.file = open(path, 'a') if path else None
+        self.outlet = None
+        if publish:
+            info = StreamInfo('UnicornMetrics', 'Metrics', len(METRIC_CHANNELS), 1.0 / interval, 'float32', source_id)
+            channels = info.desc().append_child('channels')
+            for label in METRIC_CHANNELS:
+                channels.append_child('channel').append_child_value('label', label)
+            self.outlet = StreamOutlet(info)
+        self.previous = engine.telemetry.state()
+        self.health_index = engine.ring.write_index
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-logger", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        # Log the tail of the session, unless the last interval already covered it.
+        if self.latest is None or self.engine.ring.write_index > self.health_index:
+            self.log()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def log(self):
+        engine = self.engine
+        histograms = engine.telemetry.summary(self.previous)
+        self.previous = engine.telemetry.state()
+        battery, invalid = engine.device_health(self.health_index)
+        self.health_index = engine.ring.write_index
+        record = {
+            'time': time.time(),
+            'samples': engine.ring.write_index,
+            'dropped_samples': engine.dropped_samples,
+            'overruns': sum(consumer.overruns for consumer in engine.consumers),
+            'battery_percent': battery,
+            'invalid_samples': invalid,
+            'histograms': histograms,
+        }
+        self.latest = record
+        if self.file is not None:
+            self.file.write(json.dumps(record) + '\n')
+            self.file.flush()
+        if self.outlet is not None:
+            self.outlet.push_sample([float(value) for value in metric_values(record)])
+        return record
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.log()
+            except Exception as e:
+                print(f"Metrics logging failed: {e}")
+
+
+def metrics_path(recording_path):
+    # Metrics log written next to a recording.
+    return os.path.splitext(recording_path)[0] + METRICS_SUFFIX
+
+
+def metric_values(record):
+    # The METRIC_CHANNELS figures of a MetricsLogger record, NaN where nothing was measured.
+    histograms = record['histograms']
+
+    def p99(name):
+        return histograms.get(name, {}).get('p99', float('nan'))
+
+    depths = [summary.get('p99', 0) for name, summary in histograms.items() if name.endswith('.queue_depth')]
+    return [
+        p99('get_data_us'), p99('reader_busy_us'), p99('file-writer.handler_us'), p99('lsl_push_us'),
+        max(depths, default=0), record['dropped_samples'], record['overruns'],
+        record['battery_percent'], record['invalid_samples'],
+    ]
+
+
+def status_line(record):
+    # One-line health summary for a UI status bar.
+    if record is None:
+        return "No acquisition running"
+    get_data, _, write, push, depth, dropped, overruns, battery, invalid = metric_values(record)
+    return (f"GetData p99 {get_data / 1000:.1f} ms | write p99 {write / 1000:.1f} ms | "
+            f"LSL push p99 {push / 1000:.2f} ms | queue p99 {depth:.0f} | dropped {dropped} | "
+            f"overruns {overruns} | battery {battery:.0f}% | invalid {invalid}")
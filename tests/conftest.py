@@ -0,0 +1,50 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The modules live at the top of the repository and pick the simulated driver on import.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("UNICORN_SIMULATOR", "1")
+
+import UnicornPySim
+from acquisition import UNICORN_CHANNELS
+
+
+@pytest.fixture
+def device():
+    # A simulated headset that delivers samples as fast as they are read, with seeded noise.
+    saved = dict(UnicornPySim.settings)
+    UnicornPySim.configure(realtime=False, seed=0)
+    yield UnicornPySim.Unicorn(UnicornPySim.GetAvailableDevices(True)[0])
+    UnicornPySim.settings.clear()
+    UnicornPySim.settings.update(saved)
+
+
+@pytest.fixture
+def channel_names():
+    return list(UNICORN_CHANNELS)
+
+
+@pytest.fixture
+def rows():
+    # Makes `count` samples whose counter channel continues from `start`, like a device's.
+    def make(start, count, columns=17):
+        data = np.random.default_rng(start).normal(size=(count, columns)).astype(np.float32)
+        data[:, 15] = np.arange(start, start + count) + 1
+        return data
+    return make
+
+
+class Outlet:
+    # Keeps what would have been pushed to an LSL outlet.
+    def __init__(self):
+        self.chunks = []
+
+    def push_chunk(self, chunk, timestamp):
+        self.chunks.append((np.array(chunk), timestamp))
+
+
+@pytest.fixture
+def outlet():
+    return Outlet()
@@ -0,0 +1,93 @@
+import numpy as np
+from acquisition import AcquisitionEngine, Consumer, RingBuffer
+
+
+class Headset:
+    # Stands in for a Unicorn: 17 channels, of which channel 15 counts the samples from 1.
+    def __init__(self):
+        self.samples = 0
+
+    def GetNumberOfAcquiredChannels(self):
+        return 17
+
+    def StartAcquisition(self, test_signal):
+        pass
+
+    def StopAcquisition(self):
+        pass
+
+    def GetData(self, count, buffer, length):
+        frame = np.frombuffer(buffer, dtype=np.float32, count=count * 17).reshape(count, 17)
+        frame[:] = 0
+        frame[:, 15] = np.arange(self.samples, self.samples + count) + 1
+        self.samples += count
+
+
+def fill(ring, frames):
+    # Frame i holds the value i in every channel.
+    for i in range(frames):
+        ring.write(np.full((ring.frame_length, ring.num_channels), i, dtype=np.float32), i, float(i),
+                   np.zeros(ring.frame_length))
+
+
+def test_drain_hands_over_everything_written():
+    ring = RingBuffer(8, 2, frame_length=2)
+    fill(ring, 3)
+    blocks = []
+    consumer = Consumer('test', lambda data, codes, first: blocks.append((data, codes, first)))
+    assert consumer.drain(ring) == 6
+    data, codes, first = blocks[0]
+    assert first == 0
+    np.testing.assert_array_equal(data[:, 0], [0, 0, 1, 1, 2, 2])
+    np.testing.assert_array_equal(codes, [0, 0, 1, 1, 2, 2])
+    assert consumer.overruns == 0
+    assert consumer.drain(ring) == 0
+    assert consumer.underruns == 1
+
+
+def test_drain_counts_lapped_and_in_flight_samples_as_overruns():
+    ring = RingBuffer(8, 2, frame_length=2)
+    fill(ring, 10)
+    blocks = []
+    consumer = Consumer('test', lambda data, codes, first: blocks.append((data, first)))
+    consumer.drain(ring)
+    data, first = blocks[0]
+    # 12 samples were overwritten before the drain, and the next frame may already be landing
+    # in the two oldest slots.
+    assert first == 14
+    np.testing.assert_array_equal(data[:, 0], np.arange(14, 20) // 2)
+    assert consumer.overruns == 14
+    assert consumer.overruns + consumer.samples_consumed == ring.write_index
+    assert consumer.read_index == ring.write_index
+
+
+def test_engine_consumers_account_for_every_sample():
+    engine = AcquisitionEngine(Headset(), 250, frame_length=4, buffer_seconds=1)
+    counters = []
+    engine.add_consumer(lambda data, codes, first: counters.append(data[:, 15].copy()), 'counter')
+    engine.start(max_samples=2000)
+    engine.wait(30)
+    engine.stop()
+    assert engine.error is None
+    consumer = engine.consumers[0]
+    assert consumer.samples_consumed + consumer.overruns == engine.ring.write_index == 2000
+    counter = np.concatenate(counters)
+    # Overruns only ever drop the oldest samples, never reorder or duplicate them.
+    assert (np.diff(counter) > 0).all()
+    assert engine.dropped_samples == 0
+
+
+def test_bounded_runs_stop_mid_frame():
+    # 32-sample frames do not divide the 250-sample blocks, so the later runs no longer line up
+    # with the 736-sample ring and the last one wraps around it mid-frame.
+    engine = AcquisitionEngine(Headset(), 250, frame_length=32, buffer_seconds=3)
+    for code in (1, 2, 3):
+        engine.set_event(code)
+        engine.start(max_samples=250)
+        engine.wait(30)
+        engine.stop()
+        assert engine.error is None
+    assert engine.ring.write_index == 750
+    assert [sample for sample, _, _ in engine.events] == [0, 250, 500]
+    _, codes = engine.ring.read(14, 736)
+    np.testing.assert_array_equal(codes, np.repeat([1, 2, 3], [236, 250, 250]))
@@ -0,0 +1,99 @@
+import sys
+import types
+import numpy as np
+import pytest
+from acquisition import AcquisitionEngine, NO_EVENT
+from audio_cues import CuePlayer
+from markers import CUE_EVENT, MarkerStream
+
+
+class OutputStream:
+    # Stands in for sounddevice.OutputStream; tests call the callback as PortAudio would.
+    latency = 0.01
+
+    def __init__(self, samplerate, channels, dtype, latency, callback):
+        self.callback = callback
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def player(monkeypatch, tmp_path):
+    # A 1 kHz player on a clock that reads 10 s, with preloaded cues instead of decoded files.
+    monkeypatch.setitem(sys.modules, 'sounddevice', types.SimpleNamespace(OutputStream=OutputStream))
+    player = CuePlayer(str(tmp_path), sample_rate=1000, lead=0.05, frame_seconds=0.004, clock=lambda: 10.0)
+    player.buffers = {'Smile.m4a': np.full((30, 1), 0.5, dtype=np.float32),
+                      'Frown.m4a': np.full((80, 1), 0.75, dtype=np.float32)}
+    return player
+
+
+def play_buffer(player, dac_delay=0.02, frames=100, underflow=False):
+    # One audio buffer that reaches the DAC `dac_delay` after the clock's 10 s.
+    outdata = np.full((frames, 1), np.nan, dtype=np.float32)
+    time_info = types.SimpleNamespace(currentTime=5.0, outputBufferDacTime=5.0 + dac_delay)
+    player.stream.callback(outdata, frames, time_info, types.SimpleNamespace(output_underflow=underflow))
+    return outdata[:, 0]
+
+
+def test_cue_starts_a_fixed_lead_after_its_step(player):
+    onsets = []
+    player.onset_callback = lambda timestamp, name, requested_at: onsets.append((timestamp, name, requested_at))
+    player.play('Smile.m4a', 10.0)
+    samples = play_buffer(player)
+    # The lead is the output latency plus one acquisition frame: 10.02 s + 34 samples.
+    assert player.lead == pytest.approx(0.054)
+    assert (samples[:34] == 0).all() and (samples[34:64] == 0.5).all() and (samples[64:] == 0).all()
+    assert onsets == [(pytest.approx(10.054), 'Smile.m4a', 10.0)]
+    assert player.stats()['mean_latency_ms'] == pytest.approx(54.0)
+
+
+def test_cues_wait_for_the_buffer_they_start_in(player):
+    player.play('Smile.m4a', 10.1)
+    assert (play_buffer(player) == 0).all()
+    assert len(player.pending) == 1
+    samples = play_buffer(player, dac_delay=0.12)
+    assert (samples[:34] == 0).all() and (samples[34:64] == 0.5).all()
+
+
+def test_overlapping_cues_are_mixed_and_clipped(player):
+    player.play('Frown.m4a', 10.0)
+    player.play('Smile.m4a', 10.01)
+    samples = play_buffer(player, frames=60)
+    np.testing.assert_array_equal(samples[34:44], 0.75)
+    np.testing.assert_array_equal(samples[44:60], 1.0)
+    # The rest of the longer cue continues at the start of the next buffer.
+    samples = play_buffer(player, dac_delay=0.08, frames=60)
+    np.testing.assert_array_equal(samples[:14], 1.0)
+    np.testing.assert_array_equal(samples[14:54], 0.75)
+    np.testing.assert_array_equal(samples[54:], 0.0)
+    assert player.active == []
+
+
+def test_late_cues_start_at_once_and_are_counted(player):
+    player.play('Smile.m4a', 9.9)
+    samples = play_buffer(player, underflow=True)
+    assert (samples[:30] == 0.5).all() and (samples[30:] == 0).all()
+    stats = player.stats()
+    assert stats['late'] == 1 and stats['callback_errors'] == 1
+    assert stats['max_latency_ms'] == pytest.approx(120.0)
+
+
+def test_onset_is_marked_on_the_first_sample_it_reached(player, device):
+    engine = AcquisitionEngine(device, 250)
+    markers = MarkerStream(engine)
+    player.onset_callback = markers.add_cue_marker
+    for i in range(50):
+        engine.ring.write(np.zeros((1, engine.num_channels), dtype=np.float32), NO_EVENT, 10.0 + i / 250,
+                          np.zeros(1))
+    player.play('Smile.m4a', 10.0)
+    play_buffer(player)
+    markers.handle(*engine.ring.read(0, 50), 0)
+    # The onset at 10.054 s lies between samples 13 and 14.
+    assert [(sample, code, label) for sample, _, code, label in markers.markers] == [(14, CUE_EVENT, 'cue Smile.m4a')]
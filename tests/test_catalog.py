@@ -0,0 +1,98 @@
+import csv
+import os
+import numpy as np
+import pytest
+from catalog import Catalog
+from markers import CUE_EVENT, EVENTS_COLUMNS, events_path
+from recording import RecordingWriter
+
+
+def record(root, participant, expression, trial, markers, samples=1000, counterbalance=None):
+    # A recording whose first channel holds the sample index, with an events sidecar.
+    directory = os.path.join(root, participant)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{participant}_{expression}_{trial}.semg")
+    metadata = {} if counterbalance is None else {'counterbalance': counterbalance}
+    writer = RecordingWriter(path, 250, ['EEG 1', 'Counter'], sync_every=0, participant=participant,
+                             expression=expression, trial=trial, **metadata)
+    writer.write(np.column_stack((np.arange(samples), np.arange(samples) + 1)).astype(np.float32))
+    writer.close()
+    with open(events_path(path), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(EVENTS_COLUMNS)
+        for sample_index, code, label in markers:
+            writer.writerow((sample_index, f"{sample_index / 250:.6f}", code, label))
+    return path
+
+
+MARKERS = [(0, 0, 'Relax'), (250, 3, 'Smile Strong'), (300, CUE_EVENT, 'cue Smile100.m4a'), (500, 0, 'Relax'),
+           (750, 1, 'Smile Weak')]
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    root = str(tmp_path)
+    record(root, 'P01', 'Smile', 1, MARKERS)
+    record(root, 'P01', 'Smile', 2, MARKERS)
+    record(root, 'P01', 'Frown', 1, [(0, 0, 'Relax'), (500, 6, 'Frown Strong')])
+    record(root, 'P02', 'Smile', 1, MARKERS)
+    catalog = Catalog(root)
+    catalog.scan()
+    yield catalog
+    catalog.close()
+
+
+def test_query_and_trials(catalog):
+    assert [(r['participant'], r['expression'], r['trial']) for r in catalog.query()] == [
+        ('P01', 'Frown', 1), ('P01', 'Smile', 1), ('P01', 'Smile', 2), ('P02', 'Smile', 1)]
+    assert len(catalog.query(participant=['P01', 'P02'], expression='Smile')) == 3
+    recording = catalog.query(participant='P02')[0]
+    assert recording['samples'] == 1000 and recording['duration'] == 4.0
+    assert recording['columns'] == ['EEG 1', 'Counter']
+    assert catalog.next_trial('P01', 'Smile') == 3
+    assert catalog.next_trial('P03', 'Smile') == 1
+    assert catalog.last_recording('P01', 'Smile').endswith('P01_Smile_2.semg')
+
+
+def test_blocks_end_at_the_next_instruction(catalog):
+    path = catalog.last_recording('P01', 'Smile')
+    events = catalog.events(path)
+    assert [(e['sample_index'], e['end_index'], e['event_code']) for e in events] == [
+        (0, 250, 0), (250, 500, 3), (300, 300, CUE_EVENT), (500, 750, 0), (750, 1000, 1)]
+
+
+def test_epochs_slice_the_recordings(catalog):
+    epochs = list(catalog.epochs(event_code=3, participant='P01'))
+    assert len(epochs) == 2
+    for recording, event, data in epochs:
+        assert event['label'] == 'Smile Strong'
+        np.testing.assert_array_equal(data[:, 0], np.arange(250, 500))
+    assert len(list(catalog.epochs(label='Smile%'))) == 6
+    assert len(list(catalog.epochs(expression='Frown'))) == 2
+
+
+def test_scan_follows_the_folder(catalog, tmp_path):
+    path = catalog.last_recording('P01', 'Smile')
+    os.remove(path)
+    record(str(tmp_path), 'P03', 'Smile', 1, MARKERS)
+    catalog.scan()
+    assert catalog.last_recording('P01', 'Smile').endswith('P01_Smile_1.semg')
+    assert catalog.next_trial('P03', 'Smile') == 2
+    catalog.remove(catalog.last_recording('P03', 'Smile'))
+    assert catalog.query(participant='P03') == []
+
+
+def test_counterbalance_numbers_participants_in_order(tmp_path):
+    root = str(tmp_path)
+    catalog = Catalog(root)
+    assert [catalog.counterbalance(p) for p in ('P01', 'P02', 'P01', 'P03')] == [0, 1, 0, 2]
+    catalog.close()
+
+    # A catalog rebuilt from the recordings keeps the indices their headers were run with.
+    os.remove(os.path.join(root, 'catalog.sqlite'))
+    record(root, 'P07', 'Smile', 1, MARKERS, counterbalance=4)
+    catalog = Catalog(root)
+    catalog.scan()
+    assert catalog.counterbalance('P07') == 4
+    assert catalog.counterbalance('P08') == 5
+    catalog.close()
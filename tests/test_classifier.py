@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+from classifier import IntensityClassifier, LDAModel, feature_vectors, load_model
+
+
+def windows(code, count, rng):
+    # Feature windows (count, 3, 8) whose amplitude grows with the class code.
+    features = np.abs(rng.normal(size=(count, 3, 8)))
+    features[:, :2] += code
+    return features
+
+
+def calibrate(classifier, codes, rng, repetitions=2):
+    # Holds every class for `repetitions` instructions; no settling time without an extractor.
+    # An instruction counts once the next one starts, hence the trailing relaxation.
+    for code in codes * repetitions + [codes[0]]:
+        classifier.handle(windows(code, 20, rng), np.zeros(20), np.full(20, code))
+
+
+def test_lda_separates_classes_with_very_different_feature_scales():
+    rng = np.random.default_rng(0)
+    codes = [0, 1, 3]
+    x = np.concatenate([rng.normal(loc=2 * code, size=(200, 4)) * [1, 10, 100, 1000] for code in codes])
+    y = np.repeat(codes, 200)
+    model = LDAModel.fit(x, y, {0: 'Neutral', 1: 'Weak', 3: 'Strong'})
+    assert model.codes.tolist() == codes
+    assert model.labels == ['Neutral', 'Weak', 'Strong']
+    probabilities = model.predict_proba(x)
+    np.testing.assert_allclose(probabilities.sum(axis=1), 1.0)
+    assert (model.codes[probabilities.argmax(axis=1)] == y).mean() > 0.9
+
+
+def test_lda_needs_two_classes():
+    with pytest.raises(ValueError):
+        LDAModel.fit(np.ones((10, 3)), np.zeros(10, dtype=int), {})
+
+
+def test_model_round_trip_and_unreadable_files(tmp_path):
+    rng = np.random.default_rng(1)
+    x = rng.normal(size=(40, 3))
+    y = np.repeat([0, 1], 20)
+    model = LDAModel.fit(x, y, {0: 'Neutral', 1: 'Smile'})
+    path = str(tmp_path / 'P01.classifier.npz')
+    model.save(path, x, y)
+    loaded, saved_x, saved_y = load_model(path)
+    np.testing.assert_array_equal(loaded.predict_proba(x), model.predict_proba(x))
+    np.testing.assert_array_equal(saved_y, y)
+
+    assert load_model(str(tmp_path / 'missing.npz')) is None
+    with open(path, 'wb') as f:
+        f.write(b'not a zip file')
+    assert load_model(path) is None
+    np.savez(path, codes=model.codes)
+    assert load_model(path) is None
+
+
+def test_participant_model_grows_across_expressions(tmp_path):
+    rng = np.random.default_rng(2)
+    path = str(tmp_path / 'P01.classifier.npz')
+    smile = IntensityClassifier({0: 'Neutral', 1: 'Smile Weak', 3: 'Smile Strong'}, model_path=path, publish=False)
+    calibrate(smile, [0, 1, 3], rng)
+    assert smile.calibrated and smile.codes == [0, 1, 3]
+
+    frown = IntensityClassifier({0: 'Neutral', 6: 'Frown Strong'}, model_path=path, publish=False)
+    assert not frown.calibrated
+    assert frown.codes == [0, 1, 3, 6]
+    calibrate(frown, [0, 6], rng)
+    model, x, y = load_model(path)
+    assert model.codes.tolist() == [0, 1, 3, 6]
+    assert model.labels == ['Neutral', 'Smile Weak', 'Smile Strong', 'Frown Strong']
+    # Neutral was calibrated again, so only this session's Neutral windows are kept.
+    assert (y == 0).sum() == frown.labels.count(0)
+
+    later = IntensityClassifier({0: 'Neutral', 3: 'Smile Strong'}, model_path=path, publish=False)
+    assert later.calibrated
+    later.handle(windows(6, 5, rng), np.zeros(5), np.full(5, 3))
+    assert later.latest[0] == 6
+
+
+def test_failed_fit_stops_calibration(tmp_path):
+    classifier = IntensityClassifier({0: 'Neutral'}, repetitions=1, publish=False)
+    features = windows(0, 5, np.random.default_rng(3))
+    for code in (0, 9, 0, 9):
+        classifier.handle(features, np.zeros(5), np.full(5, code))
+    assert classifier.error is not None and not classifier.calibrated
+    collected = len(classifier.labels)
+    classifier.handle(features, np.zeros(5), np.full(5, 0))
+    assert len(classifier.labels) == collected
+    assert classifier.status().startswith('classifier failed')
+
+
+def test_feature_vectors_flatten_windows():
+    features = np.ones((4, 3, 8))
+    assert feature_vectors(features).shape == (4, 24)
+
+
+def test_saved_model_is_only_reused_for_the_same_labels(tmp_path):
+    # The V1 and V2 protocols give codes 4-6 different expressions and intensities.
+    rng = np.random.default_rng(4)
+    path = str(tmp_path / 'P01.classifier.npz')
+    v1 = IntensityClassifier({0: 'Neutral', 6: 'Smile Strong', 4: 'Smile Weak'}, model_path=path, publish=False)
+    calibrate(v1, [0, 6, 4], rng)
+    assert v1.calibrated
+
+    v2 = IntensityClassifier({0: 'Neutral', 6: 'Frown Strong', 4: 'Frown Weak'}, model_path=path, publish=False)
+    assert not v2.calibrated
+    calibrate(v2, [0, 6, 4], rng)
+    model, _, y = load_model(path)
+    assert model.labels == ['Neutral', 'Frown Weak', 'Frown Strong']
+    assert len(y) == len(v2.labels)
+
+
+def test_every_prediction_carries_its_window_time(outlet):
+    rng = np.random.default_rng(5)
+    classifier = IntensityClassifier({0: 'Neutral', 3: 'Smile Strong'}, publish=False)
+    calibrate(classifier, [0, 3], rng)
+    classifier.outlet = outlet
+    classifier.clock = lambda: 10.0
+    timestamps = 10.0 - np.array([0.2, 0.03, 0.02, 0.01])
+    classifier.handle(windows(3, 4, rng), timestamps, np.full(4, 3))
+    chunk, stamps = classifier.outlet.chunks[0]
+    # The first window is over the 50 ms budget and skipped.
+    assert len(chunk) == 3
+    assert stamps == timestamps[1:].tolist()
+    assert classifier.skipped == 1
@@ -0,0 +1,80 @@
+import os
+import numpy as np
+from convert_legacy import V2_LABELS, convert_file, find_legacy_files
+from markers import events_path, load_events
+from recording import RecordingWriter, load_recording
+
+
+def legacy_csv(path, data):
+    # The UIs saved their recordings with np.savetxt.
+    np.savetxt(path, data, delimiter=',', fmt='%.3f')
+    return str(path)
+
+
+def samples(count, codes=None):
+    data = np.random.default_rng(count).normal(size=(count, 17)).round(3)
+    data[:, 15] = np.arange(count) + 1
+    return data if codes is None else np.column_stack((data, codes))
+
+
+def test_v1_file_without_event_column(tmp_path):
+    data = samples(120)
+    path = legacy_csv(tmp_path / 'P01_Smile_2.csv', data)
+    source, output, size, count = convert_file(path, chunk_lines=50)
+    assert (source, count, size) == (path, 120, os.path.getsize(path))
+    converted, header = load_recording(output)
+    np.testing.assert_allclose(converted, data, atol=1e-6)
+    assert header['columns'][-1] == 'Validation Indicator'
+    assert (header['participant'], header['expression'], header['trial']) == ('P01', 'Smile', 2)
+    assert not os.path.exists(events_path(output))
+
+
+def test_v2_file_gets_markers_and_epochs(tmp_path):
+    codes = np.repeat([0, 3, 0, 2], [30, 40, 30, 20])
+    data = samples(120, codes)
+    # Chunks that split blocks must not add markers at the chunk boundaries.
+    path = legacy_csv(tmp_path / 'P01_Smile_1.csv', data)
+    _, output, _, count = convert_file(path, chunk_lines=25, epochs=True)
+    assert count == 120
+    converted, header = load_recording(output)
+    assert header['columns'][-1] == 'Event Code'
+    np.testing.assert_array_equal(converted[:, -1], codes)
+
+    markers = load_events(output)
+    assert [(start, code, label) for start, _, code, label in markers] == [
+        (0, 0, V2_LABELS[0]), (30, 3, V2_LABELS[3]), (70, 0, V2_LABELS[0]), (100, 2, V2_LABELS[2])]
+    assert all(np.isnan(lsl_time) for _, lsl_time, _, _ in markers)
+
+    epochs = sorted(os.listdir(tmp_path / 'epochs'))
+    assert epochs == ['P01_Smile_1_epoch01_code0.npy', 'P01_Smile_1_epoch02_code3.npy',
+                      'P01_Smile_1_epoch03_code0.npy', 'P01_Smile_1_epoch04_code2.npy']
+    np.testing.assert_array_equal(np.load(tmp_path / 'epochs' / epochs[1]), converted[30:70])
+    assert list(find_legacy_files(str(tmp_path))) == [path]
+
+
+def test_only_converted_files_are_overwritten(tmp_path):
+    path = legacy_csv(tmp_path / 'P01_Frown_1.csv', samples(40))
+    _, output, _, _ = convert_file(path)
+    assert convert_file(path)[1] is None
+    assert convert_file(path, overwrite=True)[1] == output
+
+    # A native recording exported to CSV keeps its binary original.
+    native = str(tmp_path / 'P02_Frown_1.semg')
+    writer = RecordingWriter(native, 250, ['EEG 1'])
+    writer.write(np.arange(10, dtype=np.float32)[:, None])
+    writer.close()
+    exported = legacy_csv(tmp_path / 'P02_Frown_1.csv', samples(40))
+    assert convert_file(exported, overwrite=True)[1] is None
+    assert len(load_recording(native)[0]) == 10
+
+
+def test_row_cut_short_by_a_crash_is_dropped(tmp_path, capsys):
+    codes = np.repeat([0, 3], [30, 20])
+    path = legacy_csv(tmp_path / 'P01_Smile_3.csv', samples(50, codes))
+    with open(path, 'rb+') as f:
+        f.truncate(os.path.getsize(path) - 40)
+    _, output, _, count = convert_file(path, chunk_lines=20)
+    assert count == 49
+    converted, _ = load_recording(output)
+    np.testing.assert_array_equal(converted[:, -1], codes[:49])
+    assert 'dropped the incomplete last row' in capsys.readouterr().out
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+from acquisition import AcquisitionEngine
+from features import FeatureExtractor, SlidingFeatures
+
+
+def brute_force(x, window, hop):
+    # Features of every window ending at a multiple of `hop` samples, computed from scratch.
+    previous = np.vstack((np.zeros((1, x.shape[1])), x[:-1]))
+    crossing = np.sign(x) != np.sign(previous)
+    ends = np.arange(hop - 1, len(x), hop)
+    features = []
+    for end in ends:
+        start = max(0, end - window + 1)
+        features.append((np.sqrt((x[start:end + 1] ** 2).mean(axis=0)), np.abs(x[start:end + 1]).mean(axis=0),
+                         crossing[start:end + 1].sum(axis=0)))
+    return ends, np.array(features)
+
+
+@pytest.mark.parametrize('blocks', [[200], [1] * 50 + [150], [7, 13, 30, 64, 3, 83]])
+def test_sliding_features_match_full_windows(blocks):
+    x = np.random.default_rng(1).normal(size=(sum(blocks), 3))
+    sliding = SlidingFeatures(3, window=20, hop=5)
+    ends, features = [], []
+    position = 0
+    for size in blocks:
+        offsets, block_features = sliding.update(x[position:position + size])
+        ends.extend(position + offsets)
+        features.append(block_features)
+        position += size
+    expected_ends, expected = brute_force(x, 20, 5)
+    np.testing.assert_array_equal(ends, expected_ends)
+    np.testing.assert_allclose(np.concatenate(features), expected, atol=1e-9)
+
+
+def test_extractor_windows_follow_the_engine(device):
+    engine = AcquisitionEngine(device, 250, frame_length=4)
+    extractor = FeatureExtractor(device, 250, window_seconds=0.2, hop_seconds=0.05, publish=False)
+    extractor.attach(engine)
+    windows = []
+    extractor.add_listener(lambda features, timestamps, codes: windows.append((features, timestamps, codes)))
+    engine.set_event(2, 'Smile Medium')
+    engine.start(max_samples=1000)
+    engine.wait(30)
+    engine.stop()
+    assert engine.consumers[0].overruns == 0
+
+    features = np.concatenate([w[0] for w in windows])
+    timestamps = np.concatenate([w[1] for w in windows])
+    codes = np.concatenate([w[2] for w in windows])
+    assert features.shape == (1000 // extractor.hop, 3, 8)
+    # Each window is stamped with the time of its last sample.
+    np.testing.assert_array_equal(timestamps, engine.ring.times[np.arange(extractor.hop - 1, 1000, extractor.hop)])
+    assert (codes == 2).all()
+    assert np.isfinite(features).all() and (features[:, 0] >= features[:, 1]).all()
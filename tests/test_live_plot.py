@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+pytest.importorskip('matplotlib')
+from live_plot import minmax_envelope
+
+
+def test_envelope_keeps_the_extremes_of_every_bin():
+    data = np.zeros((100, 2), dtype=np.float32)
+    data[13, 0] = 50.0
+    data[57, 1] = -80.0
+    envelope = minmax_envelope(data, 10)
+    assert envelope.shape == (20, 2) and envelope.dtype == np.float32
+    # Bins of ten samples, minimum then maximum: the spikes survive the decimation.
+    assert envelope[3, 0] == 50.0 and envelope[2, 0] == 0.0
+    assert envelope[10, 1] == -80.0 and envelope[11, 1] == 0.0
+
+
+def test_envelope_drops_the_oldest_samples_that_do_not_fill_a_bin():
+    data = np.arange(25, dtype=np.float32)[:, None]
+    envelope = minmax_envelope(data, 4)
+    np.testing.assert_array_equal(envelope[:, 0], [1, 6, 7, 12, 13, 18, 19, 24])
+    # Never more bins than samples.
+    assert len(minmax_envelope(data[:3], 100)) == 6
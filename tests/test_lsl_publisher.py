@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from acquisition import AcquisitionEngine
+from lsl_publisher import LSLPublisher, build_stream_info
+
+
+@pytest.fixture
+def engine(device):
+    # An engine whose ring holds 30 samples numbered in every channel, taken at 100 + i.
+    engine = AcquisitionEngine(device, 250)
+    data = np.repeat(np.arange(30, dtype=np.float32)[:, None], engine.num_channels, axis=1)
+    engine.ring.write(data, 4, 100.0, -np.arange(30.0))
+    return engine
+
+
+def publish(device, engine, outlet, chunk_size, sizes, event_column=False):
+    publisher = LSLPublisher(device, 250, 'Test', 'EEG', 'test', event_column=event_column, chunk_size=chunk_size)
+    publisher.outlet = outlet
+    publisher.attach(engine)
+    first = 0
+    for size in sizes:
+        publisher.handle(*engine.ring.read(first, size), first)
+        first += size
+    return publisher
+
+
+def test_blocks_are_regrouped_into_chunks(device, engine, outlet):
+    publisher = publish(device, engine, outlet, 8, [5, 7, 10], event_column=True)
+    chunks = publisher.outlet.chunks
+    assert [len(chunk) for chunk, _ in chunks] == [8, 8]
+    # Every chunk is stamped with the time of its last sample.
+    assert [timestamp for _, timestamp in chunks] == [107.0, 115.0]
+    np.testing.assert_array_equal(chunks[1][0][:, 0], np.arange(8, 16))
+    assert chunks[0][0].shape[1] == engine.num_channels + 1
+    assert (chunks[0][0][:, -1] == 4).all()
+
+    publisher.flush()
+    chunk, timestamp = publisher.outlet.chunks[-1]
+    np.testing.assert_array_equal(chunk[:, 0], np.arange(16, 22))
+    assert timestamp == 121.0
+    assert publisher.stats()['chunks_pushed'] == 3
+
+
+def test_chunk_size_zero_pushes_every_block(device, engine, outlet):
+    publisher = publish(device, engine, outlet, 0, [5, 7])
+    assert [(len(chunk), timestamp) for chunk, timestamp in publisher.outlet.chunks] == [(5, 104.0), (7, 111.0)]
+    assert publisher.outlet.chunks[0][0].shape[1] == engine.num_channels
+
+
+def test_stream_info_describes_the_device_channels(device, channel_names):
+    info = build_stream_info(device, 'Test', 'EEG', 250, 'test', serial='UN-SIM.0001', event_column=True)
+    assert info.channel_count() == len(channel_names) + 1
+    channel = info.desc().child('channels').child('channel')
+    labels = []
+    while not channel.empty():
+        labels.append(channel.child_value('label'))
+        channel = channel.next_sibling()
+    assert labels == channel_names + ['Event Code']
+    assert info.desc().child_value('serial') == 'UN-SIM.0001'
+
+
+def test_statistics_restart_with_every_session(device, engine, outlet):
+    publisher = publish(device, engine, outlet, 0, [5, 7])
+    assert publisher.stats()['chunks_pushed'] == 2
+    # The UIs and the service keep one publisher across trials.
+    publisher.attach(AcquisitionEngine(device, 250))
+    assert publisher.stats() == {'chunks_pushed': 0, 'mean_push_us': 0.0, 'max_push_us': 0.0}
+    assert publisher.push_us.summary() == {'count': 0}
@@ -0,0 +1,44 @@
+import numpy as np
+from acquisition import AcquisitionEngine, NO_EVENT
+from markers import MarkerStream, load_events
+from protocol import Timeline
+from recording import RecordingWriter, load_recording
+
+
+def test_markers_start_on_every_timeline_entry(device, channel_names, tmp_path):
+    # Two adjacent entries share a code and must still get a marker each.
+    timeline = Timeline(250, [0, 100, 200, 300], [100, 100, 100, 100], [0, 3, 3, NO_EVENT],
+                        ['Relax', 'Smile', 'Smile', 'Rest'], ['Relax', 'Smile 1', 'Smile 2', None], [None] * 4)
+    path = str(tmp_path / 'markers.semg')
+    writer = RecordingWriter(path, 250, channel_names, event_column=True, sync_every=0)
+    engine = AcquisitionEngine(device, 250, frame_length=8)
+    engine.add_consumer(lambda data, codes, first: writer.write(data, codes), 'file-writer')
+    markers = MarkerStream(engine, path)
+    engine.start(max_samples=timeline.total_samples, schedule=timeline)
+    engine.wait(30)
+    engine.stop()
+    writer.close()
+    markers.close()
+
+    events = load_events(path)
+    assert [(sample, code, label) for sample, _, code, label in events] == [
+        (0, 0, 'Relax'), (100, 3, 'Smile 1'), (200, 3, 'Smile 2'), (300, NO_EVENT, '')]
+    data, _ = load_recording(path)
+    codes = data[:, -1]
+    for sample, _, code, _ in events:
+        assert codes[sample] == code
+    assert codes[99] == 0
+    # Marker times are the clock times of the samples they point at.
+    assert events[1][1] == round(float(engine.ring.times[100]), 6)
+
+
+def test_timed_marker_lands_on_first_sample_at_or_after_it(device):
+    engine = AcquisitionEngine(device, 250, frame_length=1)
+    markers = MarkerStream(engine)
+    for i in range(10):
+        engine.ring.write(np.zeros((1, engine.num_channels), dtype=np.float32), NO_EVENT, 1.0 + i / 250,
+                          np.zeros(1))
+    markers.add_timed_marker(1.0 + 4.5 / 250, label='cue')
+    markers.handle(*engine.ring.read(0, 10), 0)
+    assert [(sample, code, label) for sample, _, code, label in markers.markers] == [(5, 100, 'cue')]
+
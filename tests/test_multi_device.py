@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from multi_device import ClockFit
+
+
+def samples(counters):
+    data = np.zeros((len(counters), 17), dtype=np.float32)
+    data[:, 15] = counters
+    return data
+
+
+def test_fit_recovers_rate_and_start_across_blocks():
+    # A headset running 100 ppm fast, first sample at 1000.5 s, with 1 ms of timestamp noise.
+    rate = 250 * (1 + 100e-6)
+    counters = np.arange(1, 25001)
+    times = 1000.5 + (counters - 1) / rate + np.random.default_rng(0).normal(0, 1e-3, len(counters))
+    fit = ClockFit()
+    for start in range(0, len(counters), 997):
+        fit.handle(samples(counters[start:start + 997]), times[start:start + 997])
+    result = fit.result()
+    assert result['first_counter'] == 1
+    assert result['effective_sampling_rate'] == pytest.approx(rate, abs=0.002)
+    assert 1e6 * (result['effective_sampling_rate'] / 250 - 1) == pytest.approx(100, abs=10)
+    assert result['first_sample_time'] == pytest.approx(1000.5, abs=1e-4)
+    assert result['timestamp_jitter_ms'] == pytest.approx(1.0, rel=0.05)
+
+
+def test_fit_needs_samples_at_two_counters():
+    fit = ClockFit()
+    assert fit.result() is None
+    fit.handle(samples([7]), np.array([3.0]))
+    assert fit.result() is None
+    fit.handle(samples([7]), np.array([3.1]))
+    assert fit.result() is None
@@ -0,0 +1,70 @@
+import os
+import pytest
+from acquisition import NO_EVENT
+from protocol import PROTOCOL_DIR, ProtocolError, compile_protocol
+
+STEPS = [{'label': name, 'seconds': 1, 'code': code} for name, code in (('A', 1), ('B', 2), ('C', 3))]
+
+
+def recorded_labels(timeline):
+    return [timeline.labels[i] for i in range(len(timeline)) if timeline.recorded(i)]
+
+
+def test_leaf_expands_prepare_and_countdown():
+    protocol = {'variables': {'expression': 'Smile'}, 'steps': [
+        {'label': '{expression} Strong', 'seconds': 2, 'code': {'Smile': 3, 'Frown': 6}, 'prepare': 1.5,
+         'countdown': 2, 'cue': '{expression}100.m4a'}]}
+    timeline = compile_protocol(protocol, 250, {'expression': 'Frown'})
+    assert timeline.texts == ['Prepare for: Frown Strong', 'Frown Strong in 2', 'Frown Strong in 1', 'Frown Strong']
+    assert timeline.starts.tolist() == [0, 375, 625, 875]
+    assert timeline.lengths.tolist() == [375, 250, 250, 500]
+    assert timeline.codes.tolist() == [NO_EVENT, NO_EVENT, NO_EVENT, 6]
+    assert timeline.cues[-1] == 'Frown100.m4a'
+    assert timeline.total_samples == 1375
+
+
+def test_lead_in_and_between():
+    protocol = {'lead_in': 1, 'steps': [
+        {'repeat': 3, 'between': [{'text': 'Rest', 'seconds': 2}], 'steps': STEPS[:2]}]}
+    timeline = compile_protocol(protocol, 250)
+    assert timeline.texts == ['', 'A', 'B', 'Rest', 'A', 'B', 'Rest', 'A', 'B']
+    assert timeline.starts[1] == 250
+    assert not timeline.recorded(0) and not timeline.recorded(3)
+
+
+def test_shuffle_is_seeded_and_reshuffles_every_repetition():
+    protocol = {'steps': [{'repeat': 4, 'order': 'shuffle', 'steps': STEPS}]}
+    first = compile_protocol(protocol, 250, seed='P01_Smile_1')
+    assert recorded_labels(first) == recorded_labels(compile_protocol(protocol, 250, seed='P01_Smile_1'))
+    orders = [tuple(recorded_labels(first)[i:i + 3]) for i in range(0, 12, 3)]
+    assert all(sorted(order) == ['A', 'B', 'C'] for order in orders)
+    seeds = {tuple(recorded_labels(compile_protocol(protocol, 250, seed=seed))) for seed in range(10)}
+    assert len(seeds) > 1
+
+
+def test_rotate_is_a_latin_square_over_counterbalance():
+    protocol = {'steps': [{'repeat': 3, 'order': 'rotate', 'steps': STEPS}]}
+    rows = [recorded_labels(compile_protocol(protocol, 250, counterbalance=index))[:3] for index in range(3)]
+    assert rows == [['A', 'B', 'C'], ['B', 'C', 'A'], ['C', 'A', 'B']]
+    # Every repetition moves on by one, so a participant also sees each order once.
+    assert recorded_labels(compile_protocol(protocol, 250, counterbalance=1)) == \
+        ['B', 'C', 'A', 'C', 'A', 'B', 'A', 'B', 'C']
+
+
+def test_shipped_protocols_compile():
+    for name in os.listdir(PROTOCOL_DIR):
+        for expression in ('Smile', 'Frown'):
+            timeline = compile_protocol(os.path.join(PROTOCOL_DIR, name), 250, {'expression': expression})
+            assert len(timeline) and (timeline.codes != NO_EVENT).any()
+
+
+@pytest.mark.parametrize('protocol', [
+    {'steps': [{'text': 'A'}]},
+    {'steps': [{'text': 'A', 'seconds': 1, 'colour': 'red'}]},
+    {'steps': [{'order': 'random', 'steps': STEPS}]},
+    {'steps': [{'text': '{missing}', 'seconds': 1}]},
+    {'steps': [{'text': 'A', 'seconds': 1, 'code': {'Smile': 3}}]},
+])
+def test_invalid_protocols_are_rejected(protocol):
+    with pytest.raises(ProtocolError):
+        compile_protocol(protocol, 250, {'expression': 'Frown'})
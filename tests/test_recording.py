@@ -0,0 +1,57 @@
+import os
+import numpy as np
+from recording import RecordingWriter, export_csv, find_unfinished, journal_path, load_recording, read_journal, \
+    recover_recording
+
+
+def test_write_and_load(tmp_path, channel_names, rows):
+    path = str(tmp_path / 'trial.semg')
+    data = rows(0, 25)
+    codes = np.repeat([0, 3], [10, 15])
+    writer = RecordingWriter(path, 250, channel_names, event_column=True, block_samples=10, participant='P01')
+    writer.write(data[:12], codes[:12])
+    writer.write(data[12:], codes[12:])
+    writer.close()
+
+    loaded, header = load_recording(path)
+    assert loaded.shape == (25, 18)
+    np.testing.assert_array_equal(loaded[:, :-1], data)
+    np.testing.assert_array_equal(loaded[:, -1], codes)
+    assert header['participant'] == 'P01'
+    assert header['columns'][-1] == 'Event Code'
+    assert header['data_offset'] % 64 == 0
+    assert not os.path.exists(journal_path(path))
+
+
+
+def test_recover_keeps_synced_blocks_and_continuing_rows(tmp_path, channel_names, rows):
+    path = str(tmp_path / 'crashed.semg')
+    writer = RecordingWriter(path, 250, channel_names, block_samples=10)
+    writer.write(rows(0, 25))
+    # Crash: the pending 5 rows never reach the file. The OS did write three more whole rows,
+    # then zeros and half a row.
+    writer.file.flush()
+    with open(path, 'ab') as f:
+        f.write(rows(20, 3).tobytes())
+        f.write(np.zeros((2, 17), dtype=np.float32).tobytes())
+        f.write(b'\0' * 30)
+    assert read_journal(path) == 20
+    assert list(find_unfinished(str(tmp_path))) == [path]
+
+    assert recover_recording(path) == 23
+    data, _ = load_recording(path)
+    np.testing.assert_array_equal(data[:, 15], np.arange(1, 24))
+    writer.file.close()
+    writer.journal.close()
+
+
+def test_export_csv_matches_the_legacy_layout(tmp_path, channel_names, rows):
+    path = str(tmp_path / 'trial.semg')
+    data = rows(0, 30)
+    writer = RecordingWriter(path, 250, channel_names, sync_every=0)
+    writer.write(data)
+    writer.close()
+    csv_path = export_csv(path, chunk_samples=7)
+    assert csv_path == str(tmp_path / 'trial.csv')
+    np.testing.assert_allclose(np.loadtxt(csv_path, delimiter=','), data, atol=5e-4)
+
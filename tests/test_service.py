@@ -0,0 +1,105 @@
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer
+import pytest
+import numpy as np
+import UnicornPySim
+from acquisition import UNICORN_CHANNELS
+from markers import MANUAL_EVENT, load_events
+from recording import RecordingWriter, find_unfinished, load_recording
+from service import ControlHandler, StudyService
+from service_client import ServiceClient, ServiceError
+from session import new_trial
+
+
+@pytest.fixture
+def service(tmp_path):
+    # A client of a service on a real-time simulated headset, its protocol and its output folder.
+    saved = dict(UnicornPySim.settings)
+    UnicornPySim.configure(realtime=True, seed=0)
+    protocol = tmp_path / 'protocol.json'
+    protocol.write_text(json.dumps({'steps': [{'text': 'Relax', 'seconds': 5, 'code': 0},
+                                              {'text': 'Smile', 'seconds': 5, 'code': 3}]}))
+    study_service = StudyService(str(tmp_path / 'Data'), str(protocol))
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ControlHandler)
+    server.service = study_service
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield ServiceClient(f"http://127.0.0.1:{server.server_port}"), str(protocol), str(tmp_path / 'Data')
+    server.shutdown()
+    server.server_close()
+    study_service.close()
+    UnicornPySim.settings.clear()
+    UnicornPySim.settings.update(saved)
+
+
+def test_start_mark_and_stop(service):
+    client, _, _ = service
+    assert client.status()['state'] == 'idle'
+    status = client.start('P01', 'Smile')
+    assert status['state'] == 'running'
+    assert status['path'].endswith(os.path.join('P01', 'P01_Smile_1.semg'))
+    assert status['health'] == "Acquisition starting"
+    time.sleep(0.3)
+    marker = client.mark(label='participant coughed')
+    assert marker['code'] == MANUAL_EVENT
+
+    result = client.stop()['last_result']
+    assert client.status()['state'] == 'idle'
+    assert result['outcome'] == 'finished' and not result['completed']
+    assert result['acquisition']['samples_acquired'] > 0
+    events = load_events(result['path'])
+    assert [(code, label) for _, _, code, label in events] == [(0, 'Relax'), (MANUAL_EVENT, 'participant coughed')]
+
+
+def test_requests_that_do_not_fit_the_state_are_refused(service):
+    client, _, _ = service
+    with pytest.raises(ServiceError, match="No session is running"):
+        client.stop()
+    with pytest.raises(ServiceError, match="participant label"):
+        client.start(' ', 'Smile')
+    client.start('P01', 'Smile')
+    with pytest.raises(ServiceError, match="already running"):
+        client.start('P02', 'Smile')
+    with pytest.raises(ServiceError, match="Unknown endpoint"):
+        client._request('POST', '/restart')
+    client.stop()
+    assert client.start('P01', 'Smile')['path'].endswith('P01_Smile_2.semg')
+
+
+def test_resumes_a_block_mode_trial_without_event_column(service):
+    # Interrupted in UserStudyUI, which records no event column and only the instructions.
+    client, protocol, output = service
+    path = os.path.join(output, 'P01', 'P01_Smile_1.semg')
+    os.makedirs(os.path.dirname(path))
+    writer, _ = new_trial(path, protocol, 250, UNICORN_CHANNELS, 'P01', 'Smile', 1, 0, continuous=False,
+                          event_column=False)
+    writer.write(np.zeros((1300, 17), dtype=np.float32))
+    writer.file.flush()
+
+    status = client.start('P01', 'Smile', resume=True)
+    assert status['path'] == path
+    assert status['instruction'] is None and status['entries'] == 1
+    client.stop()
+    writer.file.close()
+    writer.journal.close()
+    data, header = load_recording(path)
+    assert data.shape[1] == 17 and len(data) > 1250
+    assert not header['continuous']
+    assert list(find_unfinished(output)) == []
+
+
+def test_uncatalogued_recordings_are_never_overwritten(service):
+    # E.g. copied in from another machine, or converted with --no-catalog.
+    client, _, output = service
+    path = os.path.join(output, 'P01', 'P01_Smile_1.semg')
+    os.makedirs(os.path.dirname(path))
+    writer = RecordingWriter(path, 250, UNICORN_CHANNELS, sync_every=0, participant='P01', expression='Smile',
+                             trial=1)
+    writer.write(np.zeros((5000, 17), dtype=np.float32))
+    writer.close()
+
+    assert client.start('P01', 'Smile')['path'].endswith('P01_Smile_2.semg')
+    client.stop()
+    assert len(load_recording(path)[0]) == 5000
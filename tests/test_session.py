@@ -0,0 +1,234 @@
+import json
+import os
+import types
+import numpy as np
+import pytest
+from acquisition import AcquisitionEngine, NO_EVENT
+from protocol import Timeline
+from recording import RecordingWriter, find_unfinished, journal_path, load_recording, read_header
+from session import SessionController, StudySession, new_trial, plan_resume, print_statistics, resume_point, \
+    resume_trial
+
+
+def block_timeline():
+    # Short unrecorded entries, so the block-wise controller's waits stay brief.
+    return Timeline(250, [0, 25, 125, 150], [25, 100, 25, 100], [NO_EVENT, 3, NO_EVENT, 6],
+                    ['Prepare', 'Smile', 'Rest', 'Frown'], [None, 'Smile', None, 'Frown'], [None] * 4)
+
+
+def messages(controller):
+    controller.thread.join(30)
+    result = []
+    while not controller.messages.empty():
+        result.append(controller.messages.get())
+    return result
+
+
+def test_block_mode_records_only_the_instructions(device):
+    engine = AcquisitionEngine(device, 250, frame_length=8)
+    controller = SessionController(engine, block_timeline(), continuous=False)
+    controller.start()
+    received = messages(controller)
+    assert [message[1] for message in received[:-1]] == ['Prepare', 'Smile', 'Rest', 'Frown']
+    assert [message[3] for message in received[:-1]] == [0, 1, 2, 3]
+    assert received[-1][0] == 'finished'
+    assert engine.ring.write_index == 200
+    assert [(sample, code) for sample, code, _ in engine.events] == [(0, 3), (100, 6)]
+    np.testing.assert_array_equal(engine.ring.codes[:200], np.repeat([3, 6], 100))
+
+
+def test_stopped_session_finishes_early(device):
+    timeline = Timeline(250, [0, 250], [250, 2500], [NO_EVENT, 3], ['Wait', 'Smile'], [None, 'Smile'], [None] * 2)
+    engine = AcquisitionEngine(device, 250)
+    controller = SessionController(engine, timeline, continuous=False)
+    controller.start()
+    controller.stop()
+    received = messages(controller)
+    assert received[-1][0] == 'finished'
+    assert engine.ring.write_index == 0
+    assert not controller.is_running()
+
+
+def test_continuous_mode_records_the_whole_timeline_in_one_run(device):
+    starts = []
+    start_acquisition = device.StartAcquisition
+    device.StartAcquisition = lambda test_signal: starts.append(test_signal) or start_acquisition(test_signal)
+    timeline = block_timeline()
+    engine = AcquisitionEngine(device, 250, frame_length=8)
+    controller = SessionController(engine, timeline)
+    controller.start()
+    received = messages(controller)
+    assert [message[1] for message in received[:-1]] == ['Prepare', 'Smile', 'Rest', 'Frown']
+    assert received[-1][0] == 'finished'
+    assert starts == [False]
+    assert engine.ring.write_index == timeline.total_samples
+    data, codes = engine.ring.read(0, timeline.total_samples)
+    # No gaps: the device counter runs on through the preparation and rest periods.
+    np.testing.assert_array_equal(data[:, 15], np.arange(1, timeline.total_samples + 1))
+    np.testing.assert_array_equal(codes, np.repeat([NO_EVENT, 3, NO_EVENT, 6], [25, 100, 25, 100]))
+
+
+def test_resume_point_after_the_last_complete_instruction():
+    timeline = block_timeline()
+    # Continuous recordings hold every entry, block-wise ones only the recorded entries.
+    assert resume_point(timeline, 140) == (2, 125)
+    assert resume_point(timeline, 124) == (0, 0)
+    assert resume_point(timeline, 250) == (4, 250)
+    assert resume_point(timeline, 150, continuous=False) == (2, 100)
+    assert resume_point(timeline, 99, continuous=False) == (0, 0)
+    assert resume_point(timeline, 200, continuous=False) == (4, 200)
+
+
+def test_resume_continues_after_last_complete_instruction(tmp_path, channel_names, rows):
+    protocol = tmp_path / 'custom.json'
+    protocol.write_text(json.dumps({'name': 'Custom', 'steps': [
+        {'text': 'Relax', 'seconds': 1, 'code': 0},
+        {'text': 'Smile', 'seconds': 1, 'code': 3},
+        {'text': 'Relax', 'seconds': 1, 'code': 0},
+    ]}))
+    path = str(tmp_path / 'P01_Smile_1.semg')
+    writer, timeline = new_trial(path, str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0)
+    assert read_header(path)['protocol_file'] == str(protocol)
+    codes = np.repeat(timeline.codes, timeline.lengths)
+    # Interrupted 100 samples into the second instruction.
+    writer.write(rows(0, 350), codes[:350])
+    writer.file.flush()
+
+    remaining, keep = plan_resume(path, 250)
+    assert keep == 250
+    assert remaining.texts == ['Smile', 'Relax']
+    resumed = RecordingWriter(path, 250, channel_names, event_column=True, resume=keep)
+    resumed.write(rows(250, 500), codes[250:])
+    resumed.close()
+    writer.file.close()
+    writer.journal.close()
+
+    data, header = load_recording(path)
+    assert len(data) == 750
+    np.testing.assert_array_equal(data[:, 15], np.arange(1, 751))
+    np.testing.assert_array_equal(data[:, -1], codes)
+    assert header['participant'] == 'P01'
+    assert not os.path.exists(journal_path(path))
+
+
+def test_plan_resume_without_protocol_file(tmp_path, channel_names):
+    path = str(tmp_path / 'P01_Smile_1.semg')
+    protocol = tmp_path / 'gone.json'
+    protocol.write_text(json.dumps({'steps': [{'text': 'Smile', 'seconds': 1, 'code': 3}]}))
+    writer, _ = new_trial(path, str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0)
+    writer.file.flush()
+    os.remove(protocol)
+    assert plan_resume(path, 250) is None
+    writer.file.close()
+    writer.journal.close()
+
+
+@pytest.mark.parametrize('event_column, continuous', [(False, False), (True, True)])
+def test_resume_keeps_the_layout_of_the_recording(tmp_path, device, channel_names, rows, event_column, continuous):
+    # The study UIs and the service share Data/<participant>/, so a trial started in one front end
+    # may be resumed by another that records the other layout.
+    protocol = tmp_path / 'blocks.json'
+    protocol.write_text(json.dumps({'steps': [{'text': 'Smile', 'seconds': 1, 'code': 3},
+                                              {'text': 'Relax', 'seconds': 1, 'code': 0},
+                                              {'text': 'Frown', 'seconds': 1, 'code': 6}]}))
+    path = str(tmp_path / 'P01_Smile_1.semg')
+    writer, timeline = new_trial(path, str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0,
+                                 continuous=continuous, event_column=event_column)
+    codes = np.repeat(timeline.codes, timeline.lengths)
+    writer.write(rows(0, 400), codes[:400])
+    writer.file.flush()
+
+    resumed, remaining, keep = resume_trial(str(tmp_path), 'Smile', 250, channel_names, lambda path, timeline: True)
+    assert keep == 250
+    assert resumed.event_column == event_column
+    session = StudySession(device, 250, resumed, remaining, continuous=resumed.header['continuous'],
+                           resume_from=keep)
+    session.start()
+    session.controller.thread.join(30)
+    assert session.controller.messages.get_nowait()[0] == 'status'
+    session.finish()
+    writer.file.close()
+    writer.journal.close()
+
+    data, header = load_recording(path)
+    assert data.shape == (750, 17 + event_column)
+    if event_column:
+        np.testing.assert_array_equal(data[:, -1], codes)
+    assert not os.path.exists(journal_path(path))
+
+
+def test_declined_trials_are_closed_as_they_are(tmp_path, channel_names, rows):
+    protocol = tmp_path / 'single.json'
+    protocol.write_text(json.dumps({'steps': [{'text': 'Smile', 'seconds': 1, 'code': 3},
+                                              {'text': 'Frown', 'seconds': 1, 'code': 6}]}))
+    path = str(tmp_path / 'P01_Smile_1.semg')
+    writer, _ = new_trial(path, str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0)
+    writer.write(rows(0, 300), np.full(300, 3))
+    writer.file.flush()
+    closed = []
+    # Trials of another expression are left alone.
+    assert resume_trial(str(tmp_path), 'Frown', 250, channel_names, lambda path, timeline: True) is None
+    assert os.path.exists(journal_path(path))
+    assert resume_trial(str(tmp_path), 'Smile', 250, channel_names, lambda path, timeline: False,
+                        closed.append) is None
+    assert closed == [path]
+    assert not os.path.exists(journal_path(path))
+    assert len(load_recording(path)[0]) == 250
+    writer.file.close()
+    writer.journal.close()
+
+
+def test_new_trial_never_replaces_a_file(tmp_path, channel_names):
+    protocol = tmp_path / 'single.json'
+    protocol.write_text(json.dumps({'steps': [{'text': 'Smile', 'seconds': 1, 'code': 3}]}))
+    path = tmp_path / 'P01_Smile_1.semg'
+    path.write_bytes(b'data')
+    with pytest.raises(FileExistsError):
+        new_trial(str(path), str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0)
+    assert path.read_bytes() == b'data'
+
+
+def test_failed_setup_leaves_no_trial_behind(tmp_path, device, channel_names, rows):
+    protocol = tmp_path / 'cued.json'
+    protocol.write_text(json.dumps({'steps': [{'text': 'Smile', 'seconds': 1, 'code': 3, 'cue': 'Smile.m4a'},
+                                              {'text': 'Frown', 'seconds': 1, 'code': 6, 'cue': 'Frown.m4a'}]}))
+    cues = types.SimpleNamespace(buffers={}, onset_callback=None)
+    path = str(tmp_path / 'P01_Smile_1.semg')
+    writer, timeline = new_trial(path, str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0)
+    with pytest.raises(ValueError, match="Frown.m4a, Smile.m4a"):
+        StudySession(device, 250, writer, timeline, cues=cues)
+    assert os.listdir(tmp_path) == ['cued.json']
+
+    # A resumed trial stays resumable.
+    writer, timeline = new_trial(path, str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0)
+    writer.write(rows(0, 300), np.full(300, 3))
+    writer.file.flush()
+    resumed, remaining, keep = resume_trial(str(tmp_path), 'Smile', 250, channel_names, lambda path, timeline: True)
+    with pytest.raises(ValueError, match="Frown.m4a"):
+        StudySession(device, 250, resumed, remaining, cues=cues, resume_from=keep)
+    assert list(find_unfinished(str(tmp_path))) == [path]
+    assert len(load_recording(path)[0]) == 250
+    writer.file.close()
+    writer.journal.close()
+
+
+def test_poll_hands_progress_and_the_result_to_the_front_end(tmp_path, device, channel_names, capsys):
+    protocol = tmp_path / 'short.json'
+    protocol.write_text(json.dumps({'steps': [{'text': 'Relax', 'seconds': 0.2, 'code': 0},
+                                              {'text': 'Smile', 'seconds': 0.2, 'code': 3}]}))
+    path = str(tmp_path / 'P01_Smile_1.semg')
+    writer, timeline = new_trial(path, str(protocol), 250, channel_names, 'P01', 'Smile', 1, 0)
+    session = StudySession(device, 250, writer, timeline)
+    shown, done, catalogued = [], [], []
+    session.start()
+    while session.poll(lambda text, entry: shown.append((text, entry)), lambda *result: done.append(result),
+                       types.SimpleNamespace(add_recording=catalogued.append), wait=1.0):
+        pass
+    assert shown == [('Relax', 0), ('Smile', 1)]
+    [(outcome, error, stats)] = done
+    assert outcome == 'finished' and error is None
+    assert stats['acquisition']['samples_acquired'] == 100
+    assert catalogued == [path]
+    assert not os.path.exists(journal_path(path))
+    print_statistics(stats)
+    assert capsys.readouterr().out.startswith("Acquisition statistics: {")
@@ -0,0 +1,66 @@
+import json
+import numpy as np
+from acquisition import AcquisitionEngine
+from telemetry import Histogram, MetricsLogger, metric_values, metrics_path, status_line
+
+
+def test_quantiles_are_bucket_upper_bounds():
+    histogram = Histogram()
+    for value, count in ((5, 90), (300, 9), (4000, 1)):
+        for _ in range(count):
+            histogram.record(value)
+    summary = histogram.summary()
+    assert summary['count'] == 100
+    assert summary['mean'] == (5 * 90 + 300 * 9 + 4000) / 100
+    assert (summary['p50'], summary['p99'], summary['max']) == (10, 500, 4000)
+
+
+def test_quantiles_are_capped_at_the_largest_value():
+    histogram = Histogram()
+    histogram.record(12)
+    histogram.record(3e7)
+    assert histogram.summary()['p50'] == 20
+    # Beyond the last bucket only the maximum is known.
+    assert histogram.summary()['p99'] == 3e7
+    single = Histogram()
+    single.record(12)
+    assert single.summary()['p99'] == 12
+
+
+def test_summary_since_an_earlier_state():
+    histogram = Histogram()
+    histogram.record(1000)
+    since = histogram.state()
+    assert histogram.summary(since) == {'count': 0}
+    histogram.record(15)
+    histogram.record(15)
+    summary = histogram.summary(since)
+    assert (summary['count'], summary['mean'], summary['p99']) == (2, 15, 20)
+    # The maximum is of everything ever recorded.
+    assert summary['max'] == 1000
+
+
+def test_metrics_logger_writes_the_session_tail(device, tmp_path):
+    engine = AcquisitionEngine(device, 250, frame_length=4)
+    engine.add_consumer(lambda data, codes, first: None, 'file-writer')
+    path = metrics_path(str(tmp_path / 'P01_Smile_1.semg'))
+    assert path.endswith('P01_Smile_1.metrics.jsonl')
+    logger = MetricsLogger(engine, path, interval=60)
+    assert status_line(logger.latest) == "No acquisition running"
+    engine.start(max_samples=500)
+    engine.wait(30)
+    engine.stop()
+    logger.stop()
+
+    with open(path) as f:
+        records = [json.loads(line) for line in f]
+    assert len(records) == 1 and records[0] == logger.latest
+    record = records[0]
+    assert (record['samples'], record['dropped_samples'], record['overruns']) == (500, 0, 0)
+    assert (record['battery_percent'], record['invalid_samples']) == (100.0, 0)
+    assert record['histograms']['get_data_us']['count'] == 125
+    assert record['histograms']['file-writer.handler_us']['count'] > 0
+    values = metric_values(record)
+    # No LSL publisher is attached, so its latency is unknown.
+    assert np.isnan(values[3]) and values[5:] == [0, 0, 100.0, 0]
+    assert status_line(record).startswith("GetData p99")
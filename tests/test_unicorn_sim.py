@@ -0,0 +1,78 @@
+import time
+import numpy as np
+import pytest
+import UnicornPySim
+from recording import RecordingWriter
+
+
+def get_data(device, count):
+    buffer = bytearray(count * UnicornPySim.NumberOfAcquiredChannels * 4)
+    device.GetData(count, buffer, len(buffer))
+    return np.frombuffer(buffer, dtype=np.float32).reshape(count, -1)
+
+
+@pytest.fixture
+def settings():
+    # Simulator settings changed by a test are restored afterwards.
+    saved = dict(UnicornPySim.settings)
+    yield UnicornPySim.settings
+    UnicornPySim.settings.clear()
+    UnicornPySim.settings.update(saved)
+
+
+def test_channels_look_like_a_unicorn(device):
+    device.StartAcquisition(False)
+    data = np.concatenate([get_data(device, 10), get_data(device, 5)])
+    np.testing.assert_array_equal(data[:, 15], np.arange(1, 16))
+    assert (data[:, 14] == 100).all() and (data[:, 16] == 1).all()
+    device.StopAcquisition()
+    with pytest.raises(UnicornPySim.DeviceException):
+        get_data(device, 1)
+    # Every acquisition restarts the counter.
+    device.StartAcquisition(True)
+    assert get_data(device, 1)[0, 15] == 1
+
+
+def test_realtime_frames_wait_for_their_last_sample(settings):
+    UnicornPySim.configure(realtime=True, seed=0)
+    device = UnicornPySim.Unicorn(UnicornPySim.GetAvailableDevices(True)[0])
+    device.StartAcquisition(False)
+    started = time.perf_counter()
+    get_data(device, 25)
+    get_data(device, 25)
+    assert time.perf_counter() - started >= 0.19
+
+
+def test_disconnect_and_unknown_devices(settings):
+    UnicornPySim.configure(realtime=False, disconnect_after=0.0)
+    device = UnicornPySim.Unicorn(UnicornPySim.GetAvailableDevices(True)[0])
+    device.StartAcquisition(False)
+    with pytest.raises(UnicornPySim.DeviceException, match="disconnected"):
+        get_data(device, 1)
+    with pytest.raises(UnicornPySim.DeviceException):
+        UnicornPySim.Unicorn('UN-0000.0000')
+    with pytest.raises(ValueError):
+        UnicornPySim.configure(sample_rate=500)
+
+
+def test_drifting_headsets(settings):
+    UnicornPySim.configure(devices=2, drift_ppm=100)
+    first, second = [UnicornPySim.Unicorn(serial) for serial in UnicornPySim.GetAvailableDevices(True)]
+    assert first.sampling_rate == UnicornPySim.SamplingRate
+    assert second.sampling_rate == pytest.approx(UnicornPySim.SamplingRate * 1.0001)
+
+
+def test_replays_a_recording(settings, tmp_path, channel_names):
+    path = str(tmp_path / 'replay.semg')
+    recorded = np.random.default_rng(0).normal(size=(20, 17)).astype(np.float32)
+    writer = RecordingWriter(path, 250, channel_names, event_column=True, sync_every=0)
+    writer.write(recorded, np.zeros(20))
+    writer.close()
+    UnicornPySim.configure(realtime=False, replay=path)
+    device = UnicornPySim.Unicorn(UnicornPySim.GetAvailableDevices(True)[0])
+    device.StartAcquisition(False)
+    data = get_data(device, 25)
+    # The replay loops, with the battery, counter and validation channels of a live device.
+    np.testing.assert_array_equal(data[:20, :14], recorded[:, :14])
+    np.testing.assert_array_equal(data[20:, :8], recorded[:5, :8])
+    np.testing.assert_array_equal(data[:, 15], np.arange(1, 26))